@@ -27,6 +27,14 @@ int beatAvg = 0;
 long irValue = 0;
 bool fingerDetected = false;
 
+// Binary sample format (see streamlit-dashboard/packets.py), all little-endian:
+// 12 byte header followed by 12 byte records
+#define PACKET_CONTENT_TYPE "application/vnd.heartrate.samples"
+const byte PACKET_VERSION = 1;
+const byte PACKET_HEADER_SIZE = 12;
+const byte PACKET_RECORD_SIZE = 12;
+const byte PACKET_FINGER_DETECTED = 1;
+
 // UART Communication
 #define RXp2 16
 #define TXp2 17
@@ -119,8 +127,55 @@ void handleData() {
   server.send(200, "application/json", json);
 }
 
+void putU16(uint8_t *buf, uint16_t value) {
+  buf[0] = value & 0xFF;
+  buf[1] = value >> 8;
+}
+
+void putU32(uint8_t *buf, uint32_t value) {
+  for (byte i = 0; i < 4; i++) {
+    buf[i] = (value >> (8 * i)) & 0xFF;
+  }
+}
+
+// Packet header: magic "HRS", version, record count, record size, device clock (ms)
+size_t encodePacketHeader(uint8_t *buf, uint16_t count, uint32_t deviceTime) {
+  buf[0] = 'H';
+  buf[1] = 'R';
+  buf[2] = 'S';
+  buf[3] = PACKET_VERSION;
+  putU16(buf + 4, count);
+  putU16(buf + 6, PACKET_RECORD_SIZE);
+  putU32(buf + 8, deviceTime);
+  return PACKET_HEADER_SIZE;
+}
+
+// One record: timestamp (ms), IR value, BPM x 100, average BPM, flags
+size_t encodeRecord(uint8_t *buf, uint32_t timestamp, float bpm, int avg, long ir, bool finger) {
+  float centiBpm = bpm > 0 ? bpm * 100 + 0.5 : 0;
+  putU32(buf, timestamp);
+  putU32(buf + 4, ir > 0 ? (uint32_t)ir : 0);
+  putU16(buf + 8, centiBpm < 65535 ? (uint16_t)centiBpm : 65535);
+  buf[10] = constrain(avg, 0, 255);
+  buf[11] = finger ? PACKET_FINGER_DETECTED : 0;
+  return PACKET_RECORD_SIZE;
+}
+
+bool acceptsPackets() {
+  return server.header("Accept").indexOf(PACKET_CONTENT_TYPE) >= 0;
+}
+
 void handleAPI() {
   // API endpoint for programmatic access
+  if (acceptsPackets()) {
+    // Compact binary reading for hosts that ask for it, JSON for everyone else
+    uint8_t packet[PACKET_HEADER_SIZE + PACKET_RECORD_SIZE];
+    uint32_t now = millis();
+    size_t length = encodePacketHeader(packet, 1, now);
+    length += encodeRecord(packet + length, now, beatsPerMinute, beatAvg, irValue, fingerDetected);
+    server.send_P(200, PACKET_CONTENT_TYPE, (const char *)packet, length);
+    return;
+  }
   String json = "{\"heart_rate\":"
                 "{\"current_bpm\":" + String(beatsPerMinute) + 
                 ",\"average_bpm\":" + String(beatAvg) + 
@@ -318,6 +373,10 @@ void setup() {
     Serial.println(WiFi.localIP());
   }
 
+  // Keep the Accept header so /api can negotiate the binary format
+  const char *headerKeys[] = {"Accept"};
+  server.collectHeaders(headerKeys, 1);
+
   // Set up web server routes
   server.on("/", handleRoot);
   server.on("/data", handleData);
@@ -0,0 +1,101 @@
+import random
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class AdaptivePollSchedule:
+    """Pick the delay before the next poll of one device from its recent behaviour.
+
+    * Active readings (finger on the sensor and BPM changing) are polled
+      faster than the base interval, idle ones (no finger, no BPM) slower.
+    * Consecutive connection failures back off exponentially.
+    * After ``failure_threshold`` failures the circuit opens and the device
+      is left alone for ``open_duration`` seconds. The next poll is a
+      half-open probe with a short timeout; success closes the circuit,
+      failure opens it again for twice as long (up to ``max_open_duration``).
+    """
+
+    def __init__(self, fast_factor=0.5, idle_factor=3.0, min_interval=0.5,
+                 max_backoff=60.0, failure_threshold=5, open_duration=30.0,
+                 max_open_duration=300.0, probe_timeout=1.0, jitter=0.1):
+        self.fast_factor = fast_factor
+        self.idle_factor = idle_factor
+        self.min_interval = min_interval
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.open_duration = open_duration
+        self.max_open_duration = max_open_duration
+        self.probe_timeout = probe_timeout
+        self.jitter = jitter
+        self.reset()
+
+    def reset(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._open_for = self.open_duration
+        self._activity = "steady"
+        self._last_bpm = None
+
+    def before_request(self, now=None):
+        """Move an open circuit to half-open once its wait has elapsed"""
+        now = time.monotonic() if now is None else now
+        if self.state == OPEN and now >= self.opened_at + self._open_for:
+            self.state = HALF_OPEN
+
+    def request_timeout(self, timeout):
+        """Half-open probes use a short timeout so a dead device costs little"""
+        if self.state == HALF_OPEN:
+            return min(timeout, self.probe_timeout)
+        return timeout
+
+    def record_success(self, data):
+        self.state = CLOSED
+        self.failures = 0
+        self._open_for = self.open_duration
+
+        bpm = data['heart_rate']['current_bpm']
+        if not data['sensor']['finger_detected'] or bpm <= 0:
+            self._activity = "idle"
+        elif self._last_bpm is not None and bpm != self._last_bpm:
+            self._activity = "active"
+        else:
+            self._activity = "steady"
+        self._last_bpm = bpm
+
+    def record_failure(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.failures += 1
+        self._last_bpm = None
+        if self.state == HALF_OPEN:
+            self._open_for = min(self._open_for * 2, self.max_open_duration)
+            self.state = OPEN
+            self.opened_at = now
+        elif self.state == CLOSED and self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened_at = now
+
+    def open_remaining(self, now=None):
+        """Seconds until an open circuit allows its half-open probe"""
+        if self.state != OPEN:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        return max(self.opened_at + self._open_for - now, 0.0)
+
+    def next_delay(self, interval, now=None):
+        """Seconds to wait before polling again, given the base ``interval``"""
+        if self.state == OPEN:
+            return self.open_remaining(now)
+        if self.failures:
+            delay = min(interval * 2 ** self.failures, self.max_backoff)
+        elif self._activity == "active":
+            delay = max(interval * self.fast_factor, self.min_interval)
+        elif self._activity == "idle":
+            delay = interval * self.idle_factor
+        else:
+            delay = interval
+        # Jitter keeps a fleet from polling in lock-step
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
@@ -0,0 +1,326 @@
+import math
+from collections import deque, namedtuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Inter-beat intervals per HRV window, and readings per rolling z-score window
+IBI_WINDOW = 60
+BPM_WINDOW = 60
+# Intervals needed before HRV metrics are reported
+MIN_IBIS = 10
+# Span of the exponentially weighted mean/variance, in readings
+EWMA_SPAN = 30
+# |z| above this marks a reading as anomalous
+Z_THRESHOLD = 3.0
+# Successive interval difference counted by pNN50, in ms
+NN50_MS = 50.0
+# RMSSD relative to the mean interval above which the rhythm is irregular
+IRREGULAR_RATIO = 0.1
+# An interval this far from the window mean counts as an ectopic-like beat
+ECTOPIC_DEVIATION = 0.2
+
+AnalyticsSnapshot = namedtuple(
+    "AnalyticsSnapshot",
+    ["ibi_count", "mean_ibi", "sdnn", "rmssd", "pnn50", "ectopic",
+     "irregular", "zscore", "ewma", "ewma_zscore", "anomaly"],
+)
+
+EMPTY_ANALYTICS = AnalyticsSnapshot(0, None, None, None, None, 0, False, None, None, None, False)
+
+
+def sample_ibis(data):
+    """Inter-beat intervals (ms) carried by one sample in the /api shape.
+
+    Only samples from host-side beat detection (beats.beat_sample) carry
+    real consecutive intervals. Polled BPM readings miss most beats
+    between polls, so no intervals are derived from them and HRV stays
+    unavailable for those devices.
+    """
+    beats = data.get("beats")
+    if beats is None:
+        return []
+    return [float(ibi) for ibi in beats.get("ibi_ms", ())]
+
+
+def _linear_recurrence(inputs, beta, initial):
+    """``y[k] = beta * y[k-1] + inputs[k]`` without a Python loop per element.
+
+    Uses ``y[k] = beta**k * (initial + cumsum(inputs * beta**-j))`` in blocks
+    short enough for ``beta**-j`` to stay well within float range.
+    """
+    inputs = np.asarray(inputs, dtype=np.float64)
+    out = np.empty_like(inputs)
+    block = max(int(150 / -math.log10(beta)), 1) if 0 < beta < 1 else len(inputs) or 1
+    level = initial
+    for start in range(0, len(inputs), block):
+        chunk = inputs[start:start + block]
+        powers = beta ** np.arange(1, len(chunk) + 1)
+        out[start:start + len(chunk)] = powers * (level + np.cumsum(chunk / powers))
+        level = out[start + len(chunk) - 1]
+    return out
+
+
+def ewma(values, span=EWMA_SPAN):
+    """Exponentially weighted mean and variance of ``values`` after each reading"""
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return values.copy(), values.copy()
+    alpha = 2.0 / (span + 1)
+    beta = 1 - alpha
+    mean = _linear_recurrence(alpha * values, beta, values[0])
+    previous = np.concatenate([[values[0]], mean[:-1]])
+    variance = _linear_recurrence(alpha * beta * (values - previous) ** 2, beta, 0.0)
+    return mean, variance
+
+
+def rolling_zscore(values, window=BPM_WINDOW):
+    """z-score of each reading against the ``window`` readings before it"""
+    values = np.asarray(values, dtype=np.float64)
+    scores = np.full(len(values), np.nan)
+    if len(values) <= window:
+        return scores
+    windows = sliding_window_view(values[:-1], window)
+    std = windows.std(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores[window:] = np.where(std > 0, (values[window:] - windows.mean(axis=1)) / std, 0.0)
+    return scores
+
+
+def rolling_hrv(ibis, window=IBI_WINDOW):
+    """HRV metrics over every window of ``window`` consecutive intervals (ms).
+
+    Returns a dict of arrays aligned with the last interval of each window.
+    """
+    ibis = np.asarray(ibis, dtype=np.float64)
+    if len(ibis) < window or window < 2:
+        empty = np.empty(0)
+        return {"mean_ibi": empty, "sdnn": empty, "rmssd": empty, "pnn50": empty,
+                "ectopic": np.empty(0, dtype=np.int64)}
+    windows = sliding_window_view(ibis, window)
+    diffs = sliding_window_view(np.diff(ibis), window - 1)
+    mean = windows.mean(axis=1)
+    return {
+        "mean_ibi": mean,
+        "sdnn": windows.std(axis=1),
+        "rmssd": np.sqrt((diffs ** 2).mean(axis=1)),
+        "pnn50": 100.0 * (np.abs(diffs) > NN50_MS).mean(axis=1),
+        "ectopic": (np.abs(windows - mean[:, None]) > ECTOPIC_DEVIATION * mean[:, None]).sum(axis=1),
+    }
+
+
+def analyze_history(current_bpm, ibis=None, ibi_window=IBI_WINDOW, bpm_window=BPM_WINDOW,
+                    span=EWMA_SPAN):
+    """Batch analytics over a stored series of readings, e.g. from a store.DeviceStore.
+
+    HRV is only computed from measured ``ibis``; without them it is
+    reported as unavailable. Returns a
+    dict of per-reading and per-window arrays plus the ``snapshot`` an
+    incremental HeartRateAnalytics would hold after the same readings.
+    """
+    bpm = np.asarray(current_bpm, dtype=np.float64)
+    bpm = bpm[bpm > 0]
+    ibis = np.asarray(() if ibis is None else ibis, dtype=np.float64)
+
+    mean, variance = ewma(bpm, span)
+    ewma_z = np.full(len(bpm), np.nan)
+    if len(bpm) > 1:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ewma_z[1:] = np.where(variance[:-1] > 0,
+                                  (bpm[1:] - mean[:-1]) / np.sqrt(variance[:-1]), 0.0)
+    ewma_z[:span] = np.nan
+    zscore = rolling_zscore(bpm, bpm_window)
+    anomaly = (np.abs(np.nan_to_num(zscore)) > Z_THRESHOLD) | (np.abs(np.nan_to_num(ewma_z)) > Z_THRESHOLD)
+    hrv = rolling_hrv(ibis[-ibi_window:] if len(ibis) >= MIN_IBIS else ibis[:0],
+                      min(len(ibis), ibi_window))
+
+    snapshot = EMPTY_ANALYTICS
+    if len(bpm):
+        snapshot = snapshot._replace(
+            zscore=_last(zscore), ewma=float(mean[-1]), ewma_zscore=_last(ewma_z),
+            anomaly=bool(anomaly[-1]),
+        )
+    if len(hrv["sdnn"]):
+        snapshot = snapshot._replace(
+            ibi_count=min(len(ibis), ibi_window),
+            mean_ibi=float(hrv["mean_ibi"][-1]),
+            sdnn=float(hrv["sdnn"][-1]),
+            rmssd=float(hrv["rmssd"][-1]),
+            pnn50=float(hrv["pnn50"][-1]),
+            ectopic=int(hrv["ectopic"][-1]),
+            irregular=bool(hrv["rmssd"][-1] > IRREGULAR_RATIO * hrv["mean_ibi"][-1]),
+        )
+    return {
+        "ewma": mean,
+        "ewma_zscore": ewma_z,
+        "zscore": zscore,
+        "anomaly": anomaly,
+        "hrv": rolling_hrv(ibis, ibi_window),
+        "snapshot": snapshot,
+    }
+
+
+def _last(values):
+    value = values[-1]
+    return None if np.isnan(value) else float(value)
+
+
+class _RunningWindow:
+    """Sum and sum of squares of the last ``size`` values"""
+
+    def __init__(self, size):
+        self.values = deque(maxlen=size)
+        self.total = 0.0
+        self.squares = 0.0
+        self._updates = 0
+
+    def push(self, value):
+        values = self.values
+        if len(values) == values.maxlen:
+            old = values[0]
+            self.total -= old
+            self.squares -= old * old
+        values.append(value)
+        self.total += value
+        self.squares += value * value
+        # Re-sum now and then so rounding errors from removals can't build up
+        self._updates += 1
+        if self._updates >= values.maxlen:
+            array = np.fromiter(values, dtype=np.float64, count=len(values))
+            self.total = float(array.sum())
+            self.squares = float((array * array).sum())
+            self._updates = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def mean(self):
+        return self.total / len(self.values)
+
+    def std(self):
+        mean = self.mean()
+        return math.sqrt(max(self.squares / len(self.values) - mean * mean, 0.0))
+
+
+class HeartRateAnalytics:
+    """Incrementally updated HRV and anomaly scores for one device.
+
+    Each sample updates running sums over the last ``ibi_window`` intervals
+    and their successive differences (SDNN, RMSSD, pNN50, ectopic-like
+    beats), a rolling z-score over the last ``bpm_window`` readings and an
+    exponentially weighted mean/variance, in O(1). The latest results are
+    cached as an AnalyticsSnapshot, so ``snapshot()`` is free. For whole
+    stored histories use ``analyze_history``, which computes the same
+    metrics in batch.
+    """
+
+    def __init__(self, ibi_window=IBI_WINDOW, bpm_window=BPM_WINDOW, span=EWMA_SPAN):
+        self.ibi_window = ibi_window
+        self.bpm_window = bpm_window
+        self.span = span
+        self.reset()
+
+    def reset(self):
+        self._ibis = _RunningWindow(self.ibi_window)
+        self._diffs = _RunningWindow(self.ibi_window - 1)
+        self._nn50 = deque(maxlen=self.ibi_window - 1)
+        self._nn50_count = 0
+        self._reset_readings()
+        self._snapshot = EMPTY_ANALYTICS
+
+    def _reset_readings(self):
+        self._bpm = _RunningWindow(self.bpm_window)
+        self._readings = 0
+        self._ewma = None
+        self._ewm_var = 0.0
+
+    def snapshot(self):
+        return self._snapshot
+
+    def rebuild(self, current_bpm):
+        """Replay the tail of a stored series of readings into the z-scores.
+
+        Beat intervals can't be recovered from BPM readings, so the HRV
+        window is kept as it is.
+        """
+        self._reset_readings()
+        bpm = np.asarray(current_bpm, dtype=np.float64)
+        bpm = bpm[bpm > 0][-max(self.bpm_window, self.span * 4):]
+        for value in bpm:
+            self._push_bpm(float(value))
+        self._refresh(None, None)
+
+    def update(self, data):
+        """Ingest one sample in the /api shape and refresh the snapshot"""
+        for ibi in sample_ibis(data):
+            self._push_ibi(ibi)
+        self._refresh(*self._push_reading(data["heart_rate"]["current_bpm"],
+                                          data["sensor"]["finger_detected"]))
+        return self._snapshot
+
+    def update_readings(self, current_bpm, finger_detected):
+        """Ingest decoded readings, oldest first, refreshing the snapshot once"""
+        scores = (None, None)
+        for bpm, finger in zip(current_bpm, finger_detected):
+            scores = self._push_reading(bpm, finger)
+        self._refresh(*scores)
+        return self._snapshot
+
+    def _push_reading(self, bpm, finger_detected):
+        if bpm > 0 and finger_detected:
+            return self._push_bpm(float(bpm))
+        return None, None
+
+    def _push_ibi(self, ibi):
+        ibis = self._ibis
+        if len(ibis):
+            diff = abs(ibi - ibis.values[-1])
+            if len(self._nn50) == self._nn50.maxlen:
+                self._nn50_count -= self._nn50[0]
+            nn50 = int(diff > NN50_MS)
+            self._nn50.append(nn50)
+            self._nn50_count += nn50
+            self._diffs.push(diff)
+        ibis.push(ibi)
+
+    def _push_bpm(self, bpm):
+        window = self._bpm
+        zscore = None
+        if len(window) == window.values.maxlen:
+            std = window.std()
+            zscore = (bpm - window.mean()) / std if std > 0 else 0.0
+        window.push(bpm)
+
+        ewma_zscore = None
+        self._readings += 1
+        if self._ewma is None:
+            self._ewma = bpm
+        else:
+            alpha = 2.0 / (self.span + 1)
+            delta = bpm - self._ewma
+            if self._readings > self.span:
+                ewma_zscore = delta / math.sqrt(self._ewm_var) if self._ewm_var > 0 else 0.0
+            self._ewma += alpha * delta
+            self._ewm_var = (1 - alpha) * (self._ewm_var + alpha * delta * delta)
+        return zscore, ewma_zscore
+
+    def _refresh(self, zscore, ewma_zscore):
+        anomaly = any(z is not None and abs(z) > Z_THRESHOLD for z in (zscore, ewma_zscore))
+        snapshot = EMPTY_ANALYTICS._replace(
+            zscore=zscore, ewma=self._ewma, ewma_zscore=ewma_zscore, anomaly=anomaly,
+        )
+        ibis = self._ibis
+        if len(ibis) >= MIN_IBIS:
+            mean = ibis.mean()
+            rmssd = math.sqrt(self._diffs.squares / len(self._diffs))
+            values = np.fromiter(ibis.values, dtype=np.float64, count=len(ibis))
+            snapshot = snapshot._replace(
+                ibi_count=len(ibis),
+                mean_ibi=float(mean),
+                sdnn=float(ibis.std()),
+                rmssd=float(rmssd),
+                pnn50=100.0 * float(self._nn50_count) / len(self._nn50),
+                ectopic=int((np.abs(values - mean) > ECTOPIC_DEVIATION * mean).sum()),
+                irregular=bool(rmssd > IRREGULAR_RATIO * mean),
+            )
+        self._snapshot = snapshot
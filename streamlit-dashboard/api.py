@@ -0,0 +1,259 @@
+import hashlib
+import json
+import math
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+import numpy as np
+
+from auth import authorized, check_bind
+from downsample import lttb_indices
+from stats import summarize
+
+DEFAULT_API_HOST = "127.0.0.1"
+DEFAULT_API_PORT = 8503
+# Seconds a built response is served from memory before it is rebuilt
+DEFAULT_TTL = 1.0
+# Cached responses kept before expired ones are dropped
+MAX_CACHE_ENTRIES = 4096
+DEFAULT_HISTORY_POINTS = 200
+MAX_HISTORY_POINTS = 5000
+
+
+class NotFound(Exception):
+    pass
+
+
+def device_path(key):
+    """API path of a device, with its key (usually a URL) percent-encoded"""
+    return "/devices/" + quote(key, safe="")
+
+
+def sample_json(data):
+    """A sample in the /api shape with its arrival time as epoch seconds"""
+    sample = {"heart_rate": dict(data["heart_rate"]), "sensor": dict(data["sensor"])}
+    timestamp = data.get("timestamp")
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.timestamp()
+    sample["received"] = timestamp
+    return sample
+
+
+class ResponseCache:
+    """Built response bodies by request path, each valid for ``ttl`` seconds.
+
+    The ETag is a hash of the body, so it stays the same across rebuilds
+    while the data doesn't change and clients keep getting 304s.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=MAX_CACHE_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """Return ``(etag, body)``, calling ``build()`` for a new body when expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+        # Built outside the lock; concurrent misses may build twice, which is harmless
+        body = json.dumps(build(), separators=(",", ":")).encode("utf-8")
+        etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = {k: e for k, e in self._entries.items() if e[0] > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[key] = (now + self.ttl, etag, body)
+        return etag, body
+
+
+class VitalsServer:
+    """Read-only JSON API over the monitors of a hub.DeviceHub.
+
+    Other consumers (nurse-station displays, EHR bridges, mobile apps) read
+    the vitals here instead of polling the sensors themselves:
+
+    * ``GET /devices``: every monitored device
+    * ``GET /devices/<key>/latest``: the latest sample
+    * ``GET /devices/<key>/stats[?window=<seconds>]``: running statistics,
+      HRV and anomaly analytics, or statistics over the last ``window``
+      seconds only
+    * ``GET /devices/<key>/history[?points=N&since=<seconds>]``: history
+      downsampled with LTTB to at most ``N`` points
+
+    ``<key>`` is the device key (usually its API URL) percent-encoded.
+    Responses are cached for ``ttl`` seconds and carry an ETag, so
+    conditional requests with ``If-None-Match`` are answered with 304.
+
+    With a ``token`` every request must carry ``Authorization: Bearer
+    <token>``; one is required to listen on anything but a loopback address.
+    """
+
+    def __init__(self, hub, host=DEFAULT_API_HOST, port=DEFAULT_API_PORT, ttl=DEFAULT_TTL,
+                 token=None):
+        check_bind(host, token, "vitals API")
+        self.hub = hub
+        self.cache = ResponseCache(ttl)
+        self.token = token
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if not authorized(self.headers, server.token):
+                    self._reply(401, b'{"error": "Missing or wrong token"}')
+                    return
+                url = urlparse(self.path)
+                path = url.path.rstrip("/")
+                query = parse_qs(url.query)
+                # Normalized so equivalent requests share a cache entry
+                cache_key = path + "?" + "&".join(
+                    f"{name}={values[-1]}" for name, values in sorted(query.items())
+                )
+                try:
+                    etag, body = server.cache.get(cache_key, lambda: server.route(path, query))
+                except NotFound as e:
+                    self._reply(404, json.dumps({"error": str(e)}).encode("utf-8"))
+                    return
+                except ValueError as e:
+                    self._reply(400, json.dumps({"error": str(e)}).encode("utf-8"))
+                    return
+
+                match = self.headers.get("If-None-Match")
+                if match and (match.strip() == "*" or etag in
+                              [tag.strip() for tag in match.split(",")]):
+                    self._reply(304, b"", etag)
+                else:
+                    self._reply(200, body, etag)
+
+            def _reply(self, status, payload, etag=None):
+                self.send_response(status)
+                if etag is not None:
+                    self.send_header("ETag", etag)
+                    self.send_header("Cache-Control", f"max-age={server.cache.ttl:g}")
+                if status != 304:
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                if payload:
+                    self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def route(self, path, query):
+        """Build the JSON body for a request path"""
+        if path == "/devices":
+            return self.devices()
+        parts = path.split("/")
+        if len(parts) != 4 or parts[1] != "devices":
+            raise NotFound("Unknown endpoint")
+        key, resource = unquote(parts[2]), parts[3]
+        monitor = self.hub.monitors().get(key)
+        if monitor is None:
+            raise NotFound(f"Unknown device: {key}")
+        if resource == "latest":
+            return self.latest(key, monitor)
+        if resource == "stats":
+            return self.stats(key, monitor, _float_param(query, "window"))
+        if resource == "history":
+            points = _float_param(query, "points") or DEFAULT_HISTORY_POINTS
+            return self.history(key, monitor, min(int(points), MAX_HISTORY_POINTS),
+                                _float_param(query, "since"))
+        raise NotFound("Unknown endpoint")
+
+    def devices(self):
+        return {"devices": [
+            {"device": key, "path": device_path(key)}
+            for key in sorted(self.hub.monitors())
+        ]}
+
+    def latest(self, key, monitor):
+        data = monitor.latest_data
+        return {
+            "device": key,
+            "status": monitor.get_current_status(),
+            "error": monitor.last_error,
+            "sample": sample_json(data) if data else None,
+        }
+
+    def stats(self, key, monitor, window=None):
+        if window is None:
+            with monitor.lock:
+                snapshot = monitor.stats.snapshot()
+                analytics = monitor.analytics.snapshot()
+            return {
+                "device": key,
+                "window": None,
+                "stats": snapshot._asdict(),
+                "analytics": analytics._asdict(),
+            }
+        with monitor.lock:
+            timestamps = monitor.history.timestamps()
+            start = np.searchsorted(timestamps, time.time() - window)
+            bpm = np.array(monitor.history.current_bpm()[start:])
+        return {
+            "device": key,
+            "window": window,
+            "stats": summarize(bpm[bpm > 0])._asdict(),
+        }
+
+    def history(self, key, monitor, points, since=None):
+        with monitor.lock:
+            timestamps = monitor.history.timestamps()
+            start = 0 if since is None else np.searchsorted(timestamps, time.time() - since)
+            timestamps = np.array(timestamps[start:])
+            bpm = np.array(monitor.history.current_bpm()[start:])
+            average = np.array(monitor.history.average_bpm()[start:])
+            finger = np.array(monitor.history.finger_detected()[start:])
+        index = lttb_indices(timestamps, bpm, max(points, 3))
+        return {
+            "device": key,
+            "points": len(index),
+            "total": len(timestamps),
+            "timestamp": timestamps[index].tolist(),
+            "current_bpm": bpm[index].tolist(),
+            "average_bpm": average[index].tolist(),
+            "finger_detected": finger[index].tolist(),
+        }
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _float_param(query, name):
+    if name not in query:
+        return None
+    try:
+        value = float(query[name][-1])
+    except ValueError:
+        raise ValueError(f"'{name}' must be a number")
+    if not math.isfinite(value) or value <= 0:
+        raise ValueError(f"'{name}' must be a positive finite number")
+    return value
@@ -5,9 +5,34 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from datetime import datetime, timedelta
 import time
-import json
 import numpy as np
-import random
+import atexit
+import os
+
+from api import DEFAULT_API_HOST, VitalsServer
+from downsample import lttb_indices, minmax_indices
+from history import to_local_datetime64
+from hub import DeviceHub, MOCK_DEVICE_KEY, device_key, is_push_device
+from ingest import DEFAULT_INGEST_HOST, DEFAULT_INGEST_PORT, IngestServer
+from metrics import METRICS, MetricsServer
+from notifier import AlertNotifier, AlertTarget, TelegramDispatcher, format_telegram_report
+from recording import SessionRecorder
+from shards import ShardedIngest
+from rules import HeartRateThresholds, RuleEngine, thresholds_ordered
+from store import TimeSeriesStore, device_dirname
+
+# Where sample history is persisted across restarts
+DATA_DIR = os.environ.get("HEART_RATE_DATA_DIR", "heart_rate_data")
+
+# Most points sent to the browser per chart trace, about one per pixel column
+CHART_POINT_BUDGET = 800
+
+HISTORY_RANGES = {
+    "Last hour": timedelta(hours=1),
+    "Last 6 hours": timedelta(hours=6),
+    "Last 24 hours": timedelta(days=1),
+    "Last 7 days": timedelta(days=7),
+}
 
 # Page configuration
 st.set_page_config(
@@ -81,143 +106,158 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-class HeartRateMonitor:
-    def __init__(self):
-        self.data_history = []
-        self.max_history = 100
-        self.api_url = ""
-        self.use_mock_data = False
-        
-    def set_api_url(self, url):
-        self.api_url = url
-        
-    def set_use_mock_data(self, use_mock):
-        self.use_mock_data = use_mock
-        
-    def generate_mock_data(self):
-        """Generate realistic mock heart rate data for testing"""
-        current_bpm = random.randint(60, 100)
-        if random.random() < 0.2:  # 20% chance of abnormal reading
-            current_bpm = random.choice([random.randint(40, 59), random.randint(101, 140)])
-            
-        return {
-            "heart_rate": {
-                "current_bpm": current_bpm,
-                "average_bpm": random.randint(65, 85),
-                "timestamp": int(time.time() * 1000)
-            },
-            "sensor": {
-                "ir_value": random.randint(800, 1000),
-                "finger_detected": random.random() > 0.3  # 70% chance finger is detected
-            }
-        }
-        
-    def fetch_data(self):
-        if self.use_mock_data:
-            # Generate mock data for testing
-            mock_data = self.generate_mock_data()
-            mock_data['timestamp'] = datetime.now()
-            self.data_history.append(mock_data)
-            if len(self.data_history) > self.max_history:
-                self.data_history.pop(0)
-            return mock_data
-            
-        if not self.api_url:
-            return None
-            
-        try:
-            response = requests.get(self.api_url, timeout=3)
-            if response.status_code == 200:
-                data = response.json()
-                data['timestamp'] = datetime.now()
-                self.data_history.append(data)
-                if len(self.data_history) > self.max_history:
-                    self.data_history.pop(0)
-                return data
-            else:
-                st.warning(f"API returned status code: {response.status_code}")
-                return None
-        except requests.exceptions.RequestException as e:
-            st.warning(f"Connection issue: {str(e)}")
-            return None
-        except json.JSONDecodeError:
-            st.warning("Invalid JSON response from API")
-            return None
-    
-    def get_current_status(self):
-        if not self.data_history:
-            return "No data"
-        
-        current_data = self.data_history[-1]
-        heart_rate = current_data['heart_rate']['current_bpm']
-        finger_detected = current_data['sensor']['finger_detected']
-        
-        if not finger_detected:
-            return "No finger detected"
-        elif heart_rate == 0:
-            return "Measuring..."
-        elif heart_rate < 60:
-            return "Low heart rate"
-        elif heart_rate > 100:
-            return "High heart rate"
-        else:
-            return "Normal"
+@st.cache_resource
+def get_device_hub():
+    """Process-wide hub shared by every browser session"""
+    rules = RuleEngine()
+    rules.on_event = AlertNotifier(get_telegram_dispatcher(), rules)
+    rules.start(1.0)
+    return DeviceHub(store=TimeSeriesStore(DATA_DIR), rules=rules)
+
+@st.cache_resource
+def get_ingest_server():
+    """Process-wide endpoint that push devices send samples to"""
+    port = int(os.environ.get("HEART_RATE_INGEST_PORT", DEFAULT_INGEST_PORT))
+    host = os.environ.get("HEART_RATE_INGEST_HOST", DEFAULT_INGEST_HOST)
+    # Devices allowed to push before any dashboard has connected to them
+    device_ids = os.environ.get("HEART_RATE_INGEST_DEVICES", "").split(",")
+    try:
+        server = IngestServer(get_device_hub(), host=host, port=port,
+                              token=os.environ.get("HEART_RATE_INGEST_TOKEN"),
+                              device_ids=[d.strip() for d in device_ids if d.strip()])
+    except (OSError, ValueError):
+        return None
+    server.start()
+    return server
+
+@st.cache_resource
+def get_vitals_server():
+    """Process-wide read-only vitals API, only when HEART_RATE_API_PORT is set"""
+    port = os.environ.get("HEART_RATE_API_PORT")
+    if not port:
+        return None
+    host = os.environ.get("HEART_RATE_API_HOST", DEFAULT_API_HOST)
+    try:
+        server = VitalsServer(get_device_hub(), host=host, port=int(port),
+                              token=os.environ.get("HEART_RATE_API_TOKEN"))
+    except (OSError, ValueError):
+        return None
+    server.start()
+    return server
+
+@st.cache_resource
+def get_sharded_ingest():
+    """Worker processes polling the ward, only when HEART_RATE_INGEST_WORKERS is set"""
+    workers = int(os.environ.get("HEART_RATE_INGEST_WORKERS", 0))
+    if workers <= 0:
+        return None
+    ingest = ShardedIngest(workers=workers, data_dir=DATA_DIR)
+    ingest.start()
+    atexit.register(ingest.stop)
+    return ingest
+
+@st.cache_resource
+def get_metrics_server():
+    """Process-wide Prometheus endpoint, only when HEART_RATE_METRICS_PORT is set"""
+    port = os.environ.get("HEART_RATE_METRICS_PORT")
+    if not port:
+        return None
+    try:
+        server = MetricsServer(port=int(port))
+    except OSError:
+        return None
+    server.start()
+    return server
+
+@st.cache_resource
+def get_telegram_dispatcher():
+    """Process-wide Telegram queue; undelivered messages survive restarts"""
+    dispatcher = TelegramDispatcher(spool_dir=os.path.join(DATA_DIR, "telegram_outbox"))
+    # The spool keeps no tokens; messages spooled for this bot resend at once
+    token = os.environ.get("TELEGRAM_BOT_TOKEN")
+    if token:
+        dispatcher.register_token(token)
+    return dispatcher
+
+def connect_device(api_url, use_mock_data):
+    """Subscribe this session to the shared poller for a device"""
+    disconnect_device()
+    ingest = get_sharded_ingest()
+    key = device_key(api_url, use_mock_data)
+    if ingest is not None and not is_push_device(key):
+        # The owning ingest worker polls, stores and checks the device; this
+        # process only follows the stored samples for the charts
+        subscription = get_device_hub().subscribe(api_url, use_mock_data, relayed=True)
+        relay = ingest.subscribe(key)
+        relay.watch(subscription.monitor.ingest_readings)
+        st.session_state.relay = relay
+    else:
+        subscription = get_device_hub().subscribe(api_url, use_mock_data)
+    st.session_state.subscription = subscription
+    st.session_state.live_chart = LiveHeartRateChart()
+
+def disconnect_device():
+    if st.session_state.subscription is not None:
+        st.session_state.subscription.close()
+        st.session_state.subscription = None
+    if st.session_state.get("relay") is not None:
+        st.session_state.relay.close()
+        st.session_state.relay = None
+
+def device_owner():
+    """Where the connected device is polled: the sharded ingest or the hub"""
+    if st.session_state.get("relay") is not None:
+        return get_sharded_ingest()
+    return get_device_hub()
+
+def recording_path():
+    """Session log the connected device is being recorded to, if any"""
+    if st.session_state.get("relay") is not None:
+        return get_sharded_ingest().recording(st.session_state.subscription.key)
+    recorder = st.session_state.subscription.monitor.recorder
+    return recorder.path if recorder is not None else None
+
+def toggle_recording():
+    """Start or stop logging the connected device's raw API responses"""
+    key = st.session_state.subscription.key
+    monitor = st.session_state.subscription.monitor
+    path = None
+    if st.session_state.record_session:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(DATA_DIR, "recordings", f"{device_dirname(key)}-{stamp}.hrrec")
+    if st.session_state.get("relay") is not None:
+        # Responses are received by the owning ingest worker
+        if (path is None) != (recording_path() is None):
+            get_sharded_ingest().record(key, path)
+    elif path is not None and monitor.recorder is None:
+        monitor.recorder = SessionRecorder(path)
+    elif path is None and monitor.recorder is not None:
+        recorder, monitor.recorder = monitor.recorder, None
+        recorder.close()
+
+def downsample_history(history, max_points=CHART_POINT_BUDGET):
+    """Reduce the chart series to at most ``max_points`` each.
     
-    def get_heart_rate_trend(self):
-        if len(self.data_history) < 2:
-            return "No trend data"
-        
-        recent_rates = [d['heart_rate']['current_bpm'] for d in self.data_history[-5:] if d['heart_rate']['current_bpm'] > 0]
-        if len(recent_rates) < 2:
-            return "Insufficient data"
-        
-        if recent_rates[-1] > recent_rates[0] + 5:
-            return "Rising"
-        elif recent_rates[-1] < recent_rates[0] - 5:
-            return "Falling"
-        else:
-            return "Stable"
+    Heart rate uses LTTB to keep the shape of the line; IR values use
+    min/max bucketing so no spike is lost.
+    """
+    timestamps = history.timestamps()
+    heart_rates = history.current_bpm()
+    ir_values = history.ir_values()
     
-    def generate_health_insights(self, heart_rates):
-        """Generate health insights based on heart rate data"""
-        if not heart_rates or len(heart_rates) < 5:
-            return ["Insufficient data for health analysis"]
-            
-        insights = []
-        avg_hr = np.mean(heart_rates)
-        max_hr = max(heart_rates)
-        min_hr = min(heart_rates)
-        hr_std = np.std(heart_rates)
-        
-        # Overall health assessment
-        if avg_hr < 60:
-            insights.append("Low average heart rate - may indicate good cardiovascular fitness")
-        elif avg_hr > 100:
-            insights.append("High average heart rate - consider consulting a healthcare provider")
-        else:
-            insights.append("Normal average heart rate - within healthy range")
-        
-        # Variability assessment
-        if hr_std > 15:
-            insights.append("High heart rate variability - may indicate stress or changing activity levels")
-        else:
-            insights.append("Stable heart rate pattern - consistent activity or rest state")
-        
-        # Extreme values alert
-        if max_hr > 120:
-            insights.append("⚠️ Warning: Detected very high heart rate values")
-        if min_hr < 50:
-            insights.append("⚠️ Warning: Detected very low heart rate values")
-            
-        return insights
+    bpm_index = lttb_indices(timestamps, heart_rates, max_points)
+    ir_index = minmax_indices(ir_values, max_points)
+    return (
+        (timestamps[bpm_index], heart_rates[bpm_index]),
+        (timestamps[ir_index], ir_values[ir_index]),
+    )
 
-def create_heart_rate_chart(data_history):
-    if len(data_history) < 2:
+@METRICS.timed("chart_build")
+def create_heart_rate_chart(history, max_points=CHART_POINT_BUDGET):
+    if len(history) < 2:
         return None
     
-    timestamps = [d['timestamp'] for d in data_history]
-    heart_rates = [d['heart_rate']['current_bpm'] for d in data_history]
-    ir_values = [d['sensor']['ir_value'] for d in data_history]
+    (bpm_times, heart_rates), (ir_times, ir_values) = downsample_history(history, max_points)
     
     fig = make_subplots(
         rows=2, cols=1,
@@ -228,7 +268,7 @@ def create_heart_rate_chart(data_history):
     # Heart rate line
     fig.add_trace(
         go.Scatter(
-            x=timestamps, y=heart_rates,
+            x=to_local_datetime64(bpm_times), y=heart_rates,
             mode='lines+markers',
             name='Heart Rate',
             line=dict(color='#ff4b4b', width=3),
@@ -240,7 +280,7 @@ def create_heart_rate_chart(data_history):
     # IR values line
     fig.add_trace(
         go.Scatter(
-            x=timestamps, y=ir_values,
+            x=to_local_datetime64(ir_times), y=ir_values,
             mode='lines',
             name='IR Values',
             line=dict(color='#667eea', width=2)
@@ -263,65 +303,457 @@ def create_heart_rate_chart(data_history):
     
     return fig
 
-def send_telegram_message(token, chat_id, message):
-    """Send message via Telegram bot"""
-    try:
-        url = f"https://api.telegram.org/bot{token}/sendMessage?chat_id={chat_id}&text={message}"
-        response = requests.get(url)
-        return response.status_code == 200
-    except Exception as e:
-        st.error(f"Failed to send Telegram message: {str(e)}")
-        return False
-
-def format_telegram_report(monitor, latest_data, patient_name):
-    """Format the current state as a Telegram report"""
-    if not latest_data:
-        return "No data available for report"
+class LiveHeartRateChart:
+    """A downsampled live chart whose figure is reused between refreshes.
+    
+    Each update extends the downsampled series with the samples that
+    arrived since the last one and drops those that left the history
+    window, then sets them as the trace data of the existing figure,
+    instead of rebuilding the subplots and downsampling the whole history.
+    The series are re-downsampled only once they grow past twice the point
+    budget. Streamlit still sends the whole figure on every refresh; the
+    downsampling is what keeps it bounded by the budget rather than by the
+    history length.
+    """
+    
+    def __init__(self, max_points=CHART_POINT_BUDGET):
+        self.max_points = max_points
+        self.fig = None
+        self._series = None
+    
+    def update(self, history):
+        if len(history) < 2:
+            self.fig = None
+            return None
+        
+        timestamps = history.timestamps()
+        if self.fig is None or self._series is None:
+            return self._rebuild(history)
+        
+        last_timestamp = self._series[0][0][-1]
+        new_count = len(timestamps) - np.searchsorted(timestamps, last_timestamp, side='right')
+        if new_count == len(timestamps):
+            return self._rebuild(history)
+        if new_count == 0:
+            return self.fig
+        
+        oldest = timestamps[0]
+        new_times = history.timestamps(new_count)
+        new_values = (history.current_bpm(new_count), history.ir_values(new_count))
+        series = []
+        for (times, values), appended in zip(self._series, new_values):
+            keep = times >= oldest
+            series.append((
+                np.concatenate([times[keep], new_times]),
+                np.concatenate([values[keep], appended]),
+            ))
+        if max(len(times) for times, _ in series) > 2 * self.max_points:
+            return self._rebuild(history)
+        
+        self._series = series
+        with self.fig.batch_update():
+            for trace, (times, values) in zip(self.fig.data, series):
+                trace.x = to_local_datetime64(times)
+                trace.y = values
+        return self.fig
+    
+    def _rebuild(self, history):
+        self.fig = create_heart_rate_chart(history, self.max_points)
+        self._series = [
+            (np.array(times), np.array(values))
+            for times, values in downsample_history(history, self.max_points)
+        ]
+        return self.fig
+
+def create_history_chart(rows, resolution):
+    """Chart stored rollups as a mean line inside a min/max band"""
+    if len(rows) < 2:
+        return None
+    
+    timestamps = to_local_datetime64(rows['start'])
+    
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=timestamps, y=rows['max'],
+        mode='lines', line=dict(width=0),
+        hoverinfo='skip', showlegend=False
+    ))
+    fig.add_trace(go.Scatter(
+        x=timestamps, y=rows['min'],
+        mode='lines', line=dict(width=0),
+        fill='tonexty', fillcolor='rgba(255,75,75,0.2)',
+        name='Min/Max'
+    ))
+    fig.add_trace(go.Scatter(
+        x=timestamps, y=rows['mean'],
+        mode='lines',
+        name='Mean',
+        line=dict(color='#ff4b4b', width=2)
+    ))
+    
+    fig.update_layout(
+        height=350,
+        title=f"Heart Rate ({resolution}s buckets)",
+        plot_bgcolor='rgba(240,240,240,0.1)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        font=dict(color='#2c3e50')
+    )
+    fig.update_xaxes(title_text="Time")
+    fig.update_yaxes(title_text="BPM")
     
-    # Get current metrics
-    heart_rate = latest_data['heart_rate']['current_bpm']
-    avg_heart_rate = latest_data['heart_rate']['average_bpm']
-    finger_detected = latest_data['sensor']['finger_detected']
-    ir_value = latest_data['sensor']['ir_value']
-    status = monitor.get_current_status()
-    trend = monitor.get_heart_rate_trend()
+    return fig
+
+def render_stored_history(monitor):
+    """Chart a time range from the on-disk store using precomputed rollups"""
+    store = monitor.store
+    if store is None and st.session_state.get("relay") is not None:
+        # Written by the owning ingest worker, only read here
+        store = get_device_hub().store.reader(st.session_state.subscription.key)
+    if store is None:
+        return
     
-    # Get health insights
-    valid_rates = [d['heart_rate']['current_bpm'] for d in monitor.data_history if d['heart_rate']['current_bpm'] > 0]
-    insights = monitor.generate_health_insights(valid_rates)
+    with st.expander("Stored History"):
+        label = st.selectbox("Time range", list(HISTORY_RANGES))
+        end = time.time()
+        start = end - HISTORY_RANGES[label].total_seconds()
+        resolution, rows = store.read_auto(start, end, max_points=1000)
+        
+        fig = create_history_chart(rows, resolution)
+        if fig:
+            st.plotly_chart(fig, use_container_width=True)
+            hist_col1, hist_col2, hist_col3 = st.columns(3)
+            hist_col1.metric("Readings", f"{rows['count'].sum()}")
+            hist_col2.metric("Max BPM", f"{rows['max'].max():g}")
+            hist_col3.metric("Min BPM", f"{rows['min'].min():g}")
+        else:
+            st.info("No stored readings in this time range yet.")
+
+def send_telegram_message(token, chat_id, message):
+    """Queue a message for the background Telegram dispatcher and return its id"""
+    return get_telegram_dispatcher().send(token, chat_id, message)
+
+@METRICS.timed("live_refresh")
+def render_live_dashboard(patient_name, telegram_token, telegram_chat_id):
+    """Render the live metrics, chart and statistics from the latest snapshot"""
+    # Main content
+    col1, col2, col3, col4 = st.columns(4)
     
-    # Format message
-    message = "❤️ HEART RATE STATUS REPORT ❤️\n\n"
-    message += f"👤 Patient: {patient_name}\n" if patient_name else "👤 Patient: Not specified\n"
-    message += f"📊 Current Status: {status}\n"
-    message += f"📈 Trend: {trend}\n\n"
+    # Read the latest sample published by the shared background poller;
+    # the monitor's history is shared with other sessions and read-only here
+    subscription = st.session_state.subscription
+    monitor = subscription.monitor
+    new_samples = subscription.drain()
+    latest_data = new_samples[-1] if new_samples else subscription.latest_data
     
-    message += "🔢 CURRENT METRICS:\n"
-    message += f"• Heart Rate: {heart_rate if heart_rate > 0 else 'N/A'} BPM\n"
-    message += f"• Average HR: {avg_heart_rate if avg_heart_rate > 0 else 'N/A'} BPM\n"
-    message += f"• Finger Detected: {'Yes' if finger_detected else 'No'}\n"
-    message += f"• IR Sensor Value: {ir_value}\n\n"
+    if latest_data:
+        # Connection status
+        with col1:
+            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
+            if st.session_state.use_mock_data:
+                st.markdown('<span class="status-indicator" style="background-color: orange;"></span> MOCK DATA', unsafe_allow_html=True)
+                st.metric("API Status", "Mock Data", delta=None)
+            else:
+                st.markdown('<span class="status-indicator status-online"></span> CONNECTED', unsafe_allow_html=True)
+                st.metric("API Status", "Online", delta=None)
+            st.markdown('</div>', unsafe_allow_html=True)
+        
+        # Current heart rate with animation
+        with col2:
+            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
+            heart_rate = latest_data['heart_rate']['current_bpm']
+            status = monitor.get_current_status()
+            
+            if heart_rate > 0 and latest_data['sensor']['finger_detected']:
+                st.markdown(f'<div class="heart-animation">❤️</div>', unsafe_allow_html=True)
+                st.metric("Current BPM", f"{heart_rate}", delta=None)
+            else:
+                st.markdown('❤️', unsafe_allow_html=True)
+                st.metric("Current BPM", "---", delta=None)
+            
+            st.caption(f"Status: {status}")
+            st.markdown('</div>', unsafe_allow_html=True)
+        
+        for alert in device_owner().active_alerts(subscription.key):
+            st.error(f"🚨 Active alert: {alert}")
+        
+        # Average heart rate
+        with col3:
+            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
+            avg_heart_rate = latest_data['heart_rate']['average_bpm']
+            trend = monitor.get_heart_rate_trend()
+            
+            st.metric("Average BPM", f"{avg_heart_rate}" if avg_heart_rate > 0 else "---", 
+                     delta=trend if trend != "No trend data" else None)
+            st.caption(f"Trend: {trend}")
+            st.markdown('</div>', unsafe_allow_html=True)
+        
+        # Sensor status
+        with col4:
+            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
+            finger_detected = latest_data['sensor']['finger_detected']
+            ir_value = latest_data['sensor']['ir_value']
+            
+            status_color = "🟢" if finger_detected else "🔴"
+            st.metric("Finger Detection", f"{status_color} {'Detected' if finger_detected else 'Not Detected'}")
+            st.metric("IR Value", f"{ir_value}")
+            st.markdown('</div>', unsafe_allow_html=True)
+        
+        # Telegram report button
+        st.markdown("---")
+        report_col1, report_col2 = st.columns([3, 1])
+        
+        with report_col2:
+            st.markdown("### Send Report")
+            if st.button("📤 Send Telegram Report", key="telegram_report", use_container_width=True):
+                if telegram_token and telegram_chat_id:
+                    report_message = format_telegram_report(monitor, latest_data, patient_name)
+                    st.session_state.last_report_id = send_telegram_message(
+                        telegram_token, telegram_chat_id, report_message
+                    )
+                else:
+                    st.error("Please provide both Telegram Bot Token and Chat ID in the sidebar")
+            
+            report_status = get_telegram_dispatcher().status(st.session_state.get('last_report_id'))
+            if report_status == "queued":
+                st.info("Report queued for delivery via Telegram...")
+            elif report_status == "sent":
+                st.success("Report sent successfully via Telegram!")
+            elif report_status == "failed":
+                st.error("Failed to send report. Please check your token and chat ID.")
+        
+        # Charts
+        with report_col1:
+            st.subheader("Real-time Monitoring")
+            with METRICS.timer("chart"), monitor.lock:
+                fig = st.session_state.live_chart.update(monitor.history)
+            if fig:
+                with METRICS.timer("chart_render"):
+                    st.plotly_chart(fig, use_container_width=True)
+            else:
+                st.info("Collecting data... Please wait.")
+        
+        # Statistics
+        st.subheader("Statistics")
+        stat_col1, stat_col2, stat_col3, stat_col4 = st.columns(4)
+        
+        snapshot = monitor.stats.snapshot()
+        if snapshot.samples > 1:
+            if snapshot.count:
+                with stat_col1:
+                    st.metric("Max BPM", f"{snapshot.max:g}")
+                with stat_col2:
+                    st.metric("Min BPM", f"{snapshot.min:g}")
+                with stat_col3:
+                    st.metric("Data Points", f"{snapshot.count}")
+                with stat_col4:
+                    st.metric("Variability", f"{snapshot.std:.2f}")
+            else:
+                st.info("No valid heart rate data yet")
+        else:
+            st.info("Collecting data...")
     
-    if len(valid_rates) > 0:
-        message += "📈 STATISTICS:\n"
-        message += f"• Max HR: {max(valid_rates)} BPM\n"
-        message += f"• Min HR: {min(valid_rates)} BPM\n"
-        message += f"• Data Points: {len(valid_rates)}\n"
-        hr_std = np.std(valid_rates) if len(valid_rates) > 1 else 0
-        message += f"• Variability: {hr_std:.2f}\n\n"
+    elif monitor.last_error is None:
+        st.info("Waiting for the first reading from the sensor...")
     
-    message += "💡 HEALTH INSIGHTS:\n"
-    for i, insight in enumerate(insights, 1):
-        message += f"{i}. {insight}\n"
+    else:
+        # Connection failed
+        with col1:
+            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
+            st.markdown('<span class="status-indicator status-offline"></span> OFFLINE', unsafe_allow_html=True)
+            st.metric("API Status", "Offline", delta=None)
+            st.markdown('</div>', unsafe_allow_html=True)
+        
+        st.warning(monitor.last_error)
+        if monitor.schedule.state == "open":
+            st.info(f"Polling paused after {monitor.schedule.failures} failed attempts; "
+                    f"retrying in {monitor.schedule.open_remaining():.0f} seconds.")
+        st.error("Unable to connect to the heart rate sensor API. Please check:")
+        st.write("1. The device is powered on and connected to the network")
+        st.write(f"2. The IP address is correct: {st.session_state.api_url}")
+        st.write("3. The device is on the same network as this computer")
+        st.write("4. Try using mock data for testing while troubleshooting")
+        
+        if st.button("Try to reconnect"):
+            st.rerun()
+
+def toggle_debug_panel():
+    # Metrics stay on while the Prometheus endpoint is serving them
+    METRICS.enabled = st.session_state.debug_panel or get_metrics_server() is not None
+
+def render_debug_panel():
+    """Per-stage latencies and per-device polling counters, for troubleshooting"""
+    st.sidebar.checkbox("Performance debug panel", value=False, key="debug_panel",
+                        on_change=toggle_debug_panel,
+                        help="Time each stage of the pipeline; adds a little overhead")
+    if not st.session_state.debug_panel:
+        return
     
-    message += f"\n⏰ Report generated at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+    with st.expander("⏱️ Performance", expanded=True):
+        stages = METRICS.stage_summary()
+        if stages:
+            frame = pd.DataFrame(stages).set_index("stage")
+            st.dataframe((frame[["mean", "p50", "p95"]] * 1000).round(2)
+                         .rename(columns=lambda name: f"{name} (ms)")
+                         .join(frame["count"]), use_container_width=True)
+        else:
+            st.info("No timings recorded yet")
+        
+        polls = METRICS.polls.values()
+        ages = METRICS.sample_ages()
+        devices = sorted(set(device for device, _ in polls) | set(ages))
+        if devices:
+            st.dataframe(pd.DataFrame([
+                {
+                    "device": device,
+                    "success": polls.get((device, "success"), 0),
+                    "failure": polls.get((device, "failure"), 0),
+                    "timeout": polls.get((device, "timeout"), 0),
+                    "sample age (s)": round(ages[device], 1) if device in ages else None,
+                }
+                for device in devices
+            ]).set_index("device"), use_container_width=True)
+
+def parse_ward_devices(text):
+    """Parse one device per line as ``name = url`` or just ``url``"""
+    devices = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        name, sep, url = line.partition("=")
+        if not sep or "://" in name:
+            name, url = line, line
+        devices[name.strip()] = url.strip()
+    return devices
+
+def sync_ward_subscriptions(devices, refresh_rate):
+    """Keep one overview subscription per ward device, dropping removed ones.
     
-    return message
+    With ingest workers configured the ward is polled by them, otherwise
+    by the shared hub in this process.
+    """
+    subscriptions = st.session_state.ward_subscriptions
+    ingest = get_sharded_ingest()
+    urls = set(devices.values())
+    for url in list(subscriptions):
+        if url not in urls:
+            subscriptions.pop(url).close()
+    for url in urls:
+        if url not in subscriptions:
+            if ingest is not None:
+                subscriptions[url] = ingest.subscribe(url, interval=refresh_rate)
+            else:
+                subscriptions[url] = get_device_hub().subscribe(
+                    url, url == MOCK_DEVICE_KEY, interval=refresh_rate, receive_samples=False
+                )
+        else:
+            subscriptions[url].configure(interval=refresh_rate)
+
+def open_device(url):
+    """Drill down from the ward overview into the single-device view"""
+    st.session_state.use_mock_data = url == MOCK_DEVICE_KEY
+    st.session_state.api_url = url
+    connect_device(url, st.session_state.use_mock_data)
+    st.session_state.api_configured = True
+    st.session_state.page = "Single device"
+
+def ward_row_from_snapshot(name, snapshot):
+    """Ward grid row from a shards.ShardSnapshot published by an ingest worker"""
+    if snapshot is not None and snapshot.received is not None:
+        return {
+            "Device": name,
+            "Status": snapshot.status,
+            "BPM": snapshot.current_bpm if snapshot.current_bpm > 0 else None,
+            "Average BPM": snapshot.average_bpm if snapshot.average_bpm > 0 else None,
+            "Trend": snapshot.trend,
+            "Connection": "🔴 Offline" if snapshot.error else "🟢 Online",
+        }
+    return {
+        "Device": name,
+        "Status": snapshot.status if snapshot is not None else "No data",
+        "BPM": None,
+        "Average BPM": None,
+        "Trend": "",
+        "Connection": ("⛔ Paused" if snapshot is not None and snapshot.paused
+                       else "🔴 Offline" if snapshot is not None and snapshot.error
+                       else "⏳ Connecting"),
+    }
+
+def render_ward_grid(devices):
+    """Render the status of every ward device from the shared monitors"""
+    subscriptions = st.session_state.ward_subscriptions
+    rows = []
+    for name, url in devices.items():
+        if get_sharded_ingest() is not None:
+            rows.append(ward_row_from_snapshot(name, subscriptions[url].snapshot()))
+            continue
+        monitor = subscriptions[url].monitor
+        latest_data = monitor.latest_data
+        if latest_data:
+            heart_rate = latest_data['heart_rate']['current_bpm']
+            average = latest_data['heart_rate']['average_bpm']
+            rows.append({
+                "Device": name,
+                "Status": monitor.get_current_status(),
+                "BPM": heart_rate if heart_rate > 0 else None,
+                "Average BPM": average if average > 0 else None,
+                "Trend": monitor.get_heart_rate_trend(),
+                "Connection": "🟢 Online",
+            })
+        else:
+            rows.append({
+                "Device": name,
+                "Status": monitor.get_current_status(),
+                "BPM": None,
+                "Average BPM": None,
+                "Trend": "",
+                "Connection": ("⛔ Paused" if monitor.schedule.state == "open"
+                               else "🔴 Offline" if monitor.last_error else "⏳ Connecting"),
+            })
+
+    online = sum(row["Connection"] == "🟢 Online" for row in rows)
+    alerts = sum(row["Status"] in ("Low heart rate", "High heart rate") for row in rows)
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Devices", len(rows))
+    col2.metric("Online", online)
+    col3.metric("Abnormal readings", alerts)
+    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+
+def render_ward_overview():
+    """Overview of every sensor on the ward, polled concurrently"""
+    if 'ward_subscriptions' not in st.session_state:
+        st.session_state.ward_subscriptions = {}
+
+    with st.sidebar:
+        st.header("Ward Devices")
+        ward_text = st.text_area(
+            "Devices", key="ward_devices", height=200,
+            placeholder="Bed 1 = http://192.168.0.102/api\nBed 2 = http://192.168.0.103/api",
+            help="One device per line, as 'name = API URL' or just the URL"
+        )
+        refresh_rate = st.slider("Refresh rate (seconds)", 1, 10, 2, key="ward_refresh_rate")
+
+    devices = parse_ward_devices(ward_text)
+    sync_ward_subscriptions(devices, refresh_rate)
+    if not devices:
+        st.info("Add the API URLs of the ward's sensors in the sidebar to monitor them together.")
+        return
+
+    st.fragment(render_ward_grid, run_every=refresh_rate)(devices)
+
+    st.subheader("Device Details")
+    detail_col1, detail_col2 = st.columns([3, 1])
+    with detail_col1:
+        selected = st.selectbox("Device", list(devices), label_visibility="collapsed")
+    with detail_col2:
+        st.button("Open device view", use_container_width=True,
+                  on_click=open_device, args=(devices[selected],))
 
 def main():
     # Initialize session state variables
-    if 'monitor' not in st.session_state:
-        st.session_state.monitor = HeartRateMonitor()
+    if 'subscription' not in st.session_state:
+        st.session_state.subscription = None
+        st.session_state.relay = None
         st.session_state.api_configured = False
         st.session_state.api_url = "http://192.168.0.102/api"
     
@@ -331,6 +763,11 @@ def main():
     # Header
     st.markdown('<h1 class="main-header">❤️ Real-time Heart Rate Monitor</h1>', unsafe_allow_html=True)
     
+    page = st.sidebar.radio("View", ["Single device", "Ward overview"], key="page", horizontal=True)
+    if page == "Ward overview":
+        render_ward_overview()
+        return
+    
     # API Configuration Section
     with st.expander("API Configuration", expanded=not st.session_state.api_configured):
         st.subheader("Enter API URL")
@@ -341,7 +778,6 @@ def main():
         use_mock = st.checkbox("Use mock data for testing", value=st.session_state.use_mock_data)
         if use_mock != st.session_state.use_mock_data:
             st.session_state.use_mock_data = use_mock
-            st.session_state.monitor.set_use_mock_data(use_mock)
             if use_mock:
                 st.info("Using mock data for testing. Uncheck to use real API.")
         
@@ -349,14 +785,22 @@ def main():
         with col1:
             if st.button("Connect to API"):
                 if api_url:
-                    st.session_state.monitor.set_api_url(api_url)
                     st.session_state.api_url = api_url
                     
                     # Test the connection (only if not using mock data)
-                    if not st.session_state.use_mock_data:
+                    if is_push_device(api_url) and not st.session_state.use_mock_data:
+                        if get_ingest_server() is None:
+                            st.error("❌ Ingest server could not be started")
+                        else:
+                            connect_device(api_url, False)
+                            st.session_state.api_configured = True
+                            st.success("✅ Waiting for samples pushed by the device!")
+                            st.rerun()
+                    elif not st.session_state.use_mock_data:
                         try:
                             response = requests.get(api_url, timeout=3)
                             if response.status_code == 200:
+                                connect_device(api_url, False)
                                 st.session_state.api_configured = True
                                 st.success("✅ Successfully connected to API!")
                                 st.rerun()
@@ -365,6 +809,7 @@ def main():
                         except Exception as e:
                             st.error(f"❌ Connection failed: {str(e)}")
                     else:
+                        connect_device(api_url, True)
                         st.session_state.api_configured = True
                         st.success("✅ Using mock data for testing!")
                         st.rerun()
@@ -374,7 +819,7 @@ def main():
         with col2:
             if st.button("Reset Connection"):
                 st.session_state.api_configured = False
-                st.session_state.monitor.data_history = []
+                disconnect_device()
                 st.rerun()
     
     # If API is not configured, show instructions and stop execution
@@ -387,6 +832,9 @@ def main():
         
         Example API URL: `http://192.168.0.102/api`
         
+        Devices that push their samples to the ingest server use
+        `push://<device id>` instead.
+        
         **Troubleshooting:**
         - Check if your sensor device is powered on
         - Verify the IP address is correct
@@ -405,11 +853,61 @@ def main():
                                           help="Get this from @BotFather on Telegram")
             telegram_chat_id = st.text_input("Chat ID", 
                                             help="Your Telegram user ID or group ID")
+            if telegram_token:
+                # Resends alerts spooled for this bot before a restart
+                get_telegram_dispatcher().register_token(telegram_token)
             
             st.header("Settings")
             refresh_rate = st.slider("Refresh rate (seconds)", 1, 10, 2)
             st.session_state.max_history = st.slider("Data points to keep", 50, 500, 100)
-            st.session_state.monitor.max_history = st.session_state.max_history
+            # Shared devices poll at the fastest rate and keep the longest
+            # history requested by any of their viewers
+            st.session_state.subscription.configure(refresh_rate, st.session_state.max_history)
+            if st.session_state.relay is not None:
+                st.session_state.relay.configure(refresh_rate)
+            recording = recording_path()
+            st.checkbox("Record raw API responses", value=recording is not None,
+                        key="record_session", on_change=toggle_recording,
+                        help="Save a session log that can be replayed with `python -m heartrate replay`")
+            recorder = st.session_state.subscription.monitor.recorder
+            if recorder is not None:
+                st.caption(f"Recording to `{recorder.path}` ({recorder.records} responses)")
+            elif recording is not None:
+                st.caption(f"Recording to `{recording}`")
+            
+            st.header("Automatic Alerts")
+            # Alert settings belong to the device and are shared by every
+            # viewer, so they only change when someone saves them
+            owner = device_owner()
+            key = st.session_state.subscription.key
+            current, current_target = owner.alert_settings(key)
+            if current_target is not None:
+                st.caption(f"Alerts are sent to chat `{current_target.chat_id}`")
+            else:
+                st.caption("Automatic alerts are off for this device")
+            with st.form("alert_settings"):
+                auto_alerts = st.checkbox("Send Telegram alerts automatically",
+                                          value=current_target is not None,
+                                          help="Alert when the heart rate stays out of range")
+                low_col, high_col = st.columns(2)
+                thresholds = HeartRateThresholds(
+                    low=low_col.number_input("Low BPM", 20, 200, int(current.low)),
+                    high=high_col.number_input("High BPM", 20, 250, int(current.high)),
+                    very_low=low_col.number_input("Very low BPM", 20, 200, int(current.very_low)),
+                    very_high=high_col.number_input("Very high BPM", 20, 250, int(current.very_high)),
+                )
+                save_alerts = st.form_submit_button("Save alert settings")
+            if save_alerts and not thresholds_ordered(thresholds):
+                st.error("Limits must satisfy Very low ≤ Low < High ≤ Very high; "
+                         "alert settings were not saved")
+            elif save_alerts and auto_alerts and not (telegram_token and telegram_chat_id):
+                st.warning("Provide a Telegram Bot Token and Chat ID to send alerts")
+            elif save_alerts:
+                target = None
+                if auto_alerts:
+                    target = AlertTarget(telegram_token, telegram_chat_id, patient_name)
+                owner.configure_alerts(key, thresholds, target)
+                st.rerun()
             
             st.header("Current Connection")
             if st.session_state.use_mock_data:
@@ -419,6 +917,7 @@ def main():
             
             if st.button("Change API URL"):
                 st.session_state.api_configured = False
+                disconnect_device()
                 st.rerun()
             
             st.header("About")
@@ -429,129 +928,16 @@ def main():
             - Data updates every few seconds
             """)
         
-        # Main content
-        col1, col2, col3, col4 = st.columns(4)
-        
-        # Fetch latest data
-        latest_data = st.session_state.monitor.fetch_data()
-        
-        if latest_data:
-            # Connection status
-            with col1:
-                st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-                if st.session_state.use_mock_data:
-                    st.markdown('<span class="status-indicator" style="background-color: orange;"></span> MOCK DATA', unsafe_allow_html=True)
-                    st.metric("API Status", "Mock Data", delta=None)
-                else:
-                    st.markdown('<span class="status-indicator status-online"></span> CONNECTED', unsafe_allow_html=True)
-                    st.metric("API Status", "Online", delta=None)
-                st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Current heart rate with animation
-            with col2:
-                st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-                heart_rate = latest_data['heart_rate']['current_bpm']
-                status = st.session_state.monitor.get_current_status()
-                
-                if heart_rate > 0 and latest_data['sensor']['finger_detected']:
-                    st.markdown(f'<div class="heart-animation">❤️</div>', unsafe_allow_html=True)
-                    st.metric("Current BPM", f"{heart_rate}", delta=None)
-                else:
-                    st.markdown('❤️', unsafe_allow_html=True)
-                    st.metric("Current BPM", "---", delta=None)
-                
-                st.caption(f"Status: {status}")
-                st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Average heart rate
-            with col3:
-                st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-                avg_heart_rate = latest_data['heart_rate']['average_bpm']
-                trend = st.session_state.monitor.get_heart_rate_trend()
-                
-                st.metric("Average BPM", f"{avg_heart_rate}" if avg_heart_rate > 0 else "---", 
-                         delta=trend if trend != "No trend data" else None)
-                st.caption(f"Trend: {trend}")
-                st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Sensor status
-            with col4:
-                st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-                finger_detected = latest_data['sensor']['finger_detected']
-                ir_value = latest_data['sensor']['ir_value']
-                
-                status_color = "🟢" if finger_detected else "🔴"
-                st.metric("Finger Detection", f"{status_color} {'Detected' if finger_detected else 'Not Detected'}")
-                st.metric("IR Value", f"{ir_value}")
-                st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Telegram report button
-            st.markdown("---")
-            report_col1, report_col2 = st.columns([3, 1])
-            
-            with report_col2:
-                st.markdown("### Send Report")
-                if st.button("📤 Send Telegram Report", key="telegram_report", use_container_width=True):
-                    if telegram_token and telegram_chat_id:
-                        report_message = format_telegram_report(st.session_state.monitor, latest_data, patient_name)
-                        if send_telegram_message(telegram_token, telegram_chat_id, report_message):
-                            st.success("Report sent successfully via Telegram!")
-                        else:
-                            st.error("Failed to send report. Please check your token and chat ID.")
-                    else:
-                        st.error("Please provide both Telegram Bot Token and Chat ID in the sidebar")
-            
-            # Charts
-            with report_col1:
-                st.subheader("Real-time Monitoring")
-                fig = create_heart_rate_chart(st.session_state.monitor.data_history)
-                if fig:
-                    st.plotly_chart(fig, use_container_width=True)
-                else:
-                    st.info("Collecting data... Please wait.")
-            
-            # Statistics
-            st.subheader("Statistics")
-            stat_col1, stat_col2, stat_col3, stat_col4 = st.columns(4)
-            
-            if len(st.session_state.monitor.data_history) > 1:
-                valid_rates = [d['heart_rate']['current_bpm'] for d in st.session_state.monitor.data_history 
-                              if d['heart_rate']['current_bpm'] > 0]
-                if valid_rates:
-                    with stat_col1:
-                        st.metric("Max BPM", f"{max(valid_rates)}")
-                    with stat_col2:
-                        st.metric("Min BPM", f"{min(valid_rates)}")
-                    with stat_col3:
-                        st.metric("Data Points", f"{len(valid_rates)}")
-                    with stat_col4:
-                        hr_std = np.std(valid_rates) if len(valid_rates) > 1 else 0
-                        st.metric("Variability", f"{hr_std:.2f}")
-                else:
-                    st.info("No valid heart rate data yet")
-            else:
-                st.info("Collecting data...")
-        
-        else:
-            # Connection failed
-            with col1:
-                st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-                st.markdown('<span class="status-indicator status-offline"></span> OFFLINE', unsafe_allow_html=True)
-                st.metric("API Status", "Offline", delta=None)
-                st.markdown('</div>', unsafe_allow_html=True)
-            
-            st.error("Unable to connect to the heart rate sensor API. Please check:")
-            st.write("1. The device is powered on and connected to the network")
-            st.write(f"2. The IP address is correct: {st.session_state.api_url}")
-            st.write("3. The device is on the same network as this computer")
-            st.write("4. Try using mock data for testing while troubleshooting")
-            
-            if st.button("Try to reconnect"):
-                st.rerun()
-        
-        # Auto-refresh
-        time.sleep(refresh_rate)
-        st.rerun()
+        # Sampling happens in the shared background poller; only the live
+        # section below re-renders
+        st.fragment(render_live_dashboard, run_every=refresh_rate)(
+            patient_name, telegram_token, telegram_chat_id
+        )
+        render_stored_history(st.session_state.subscription.monitor)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    get_metrics_server()
+    get_vitals_server()
+    with METRICS.timer("rerun"):
+        main()
+    render_debug_panel()
\ No newline at end of file
@@ -0,0 +1,29 @@
+"""Shared-token checks for the HTTP endpoints the dashboard and worker serve"""
+import hmac
+import ipaddress
+
+
+def is_loopback(host):
+    """Whether a bind address only accepts connections from this machine"""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def check_bind(host, token, name):
+    """Refuse to serve ``name`` beyond this machine without a shared token"""
+    if not token and not is_loopback(host):
+        raise ValueError(f"The {name} needs a token to listen on {host}")
+
+
+def authorized(headers, token):
+    """Whether a request carries ``Authorization: Bearer <token>`` (always, without a token)"""
+    if not token:
+        return True
+    scheme, _, credentials = headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(
+        credentials.strip().encode("utf-8"), token.encode("utf-8")
+    )
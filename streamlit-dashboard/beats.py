@@ -0,0 +1,207 @@
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+# Pass band in Hz, i.e. 30 to 240 BPM
+LOW_CUTOFF = 0.5
+HIGH_CUTOFF = 4.0
+# Shortest plausible inter-beat interval in seconds (240 BPM)
+REFRACTORY = 0.25
+# Mean raw IR below this means no finger on the sensor, as on the ESP32
+FINGER_THRESHOLD = 50000
+DEFAULT_SAMPLE_RATE = 100
+DEFAULT_WINDOW_SECONDS = 8
+
+# ``fresh`` is how many of the trailing ``ibis`` were not reported before
+BeatResult = namedtuple("BeatResult", ["bpm", "ibis", "peaks", "finger_detected", "fresh"])
+
+NO_BEATS = BeatResult(bpm=0.0, ibis=np.empty(0), peaks=np.empty(0, dtype=np.int64),
+                      finger_detected=False, fresh=0)
+
+
+def bandpass(windows, sample_rate, low=LOW_CUTOFF, high=HIGH_CUTOFF):
+    """Band-pass every row of ``windows`` at once by zeroing FFT bins.
+
+    Removes the DC level and slow baseline drift of the raw IR signal as
+    well as high frequency noise, leaving the pulse waveform.
+    """
+    windows = np.asarray(windows, dtype=np.float64)
+    length = windows.shape[-1]
+    # Remove the linear trend so the window edges don't ring
+    ramp = np.linspace(-1.0, 1.0, length)
+    slope = windows @ ramp / (ramp @ ramp)
+    detrended = windows - windows.mean(axis=-1, keepdims=True) - slope[..., None] * ramp
+    spectrum = np.fft.rfft(detrended, axis=-1)
+    freqs = np.fft.rfftfreq(length, 1.0 / sample_rate)
+    spectrum[..., (freqs < low) | (freqs > high)] = 0
+    return np.fft.irfft(spectrum, n=length, axis=-1)
+
+
+def find_peaks(filtered, sample_rate, refractory=REFRACTORY, threshold=0.3):
+    """Boolean mask of beat peaks in every row of a filtered batch.
+
+    A peak is the maximum of the window spanning ``refractory`` seconds
+    around it and rises above ``threshold`` standard deviations of its row.
+    """
+    filtered = np.asarray(filtered, dtype=np.float64)
+    half = max(int(refractory * sample_rate) // 2, 1)
+    padded = np.pad(filtered, [(0, 0)] * (filtered.ndim - 1) + [(half, half)],
+                    mode="constant", constant_values=-np.inf)
+    neighbourhood = np.lib.stride_tricks.sliding_window_view(padded, 2 * half + 1, axis=-1)
+    local_max = neighbourhood.max(axis=-1)
+    level = threshold * filtered.std(axis=-1, keepdims=True)
+    peaks = (filtered == local_max) & (filtered > level)
+    # Flat tops would otherwise count as several peaks; keep the first sample
+    peaks[..., 1:] &= ~(peaks[..., :-1] & (filtered[..., 1:] == filtered[..., :-1]))
+    return peaks
+
+
+def detect_beats(windows, sample_rate=DEFAULT_SAMPLE_RATE):
+    """Compute BPM and inter-beat intervals for a batch of raw IR windows.
+
+    ``windows`` is a 2-D array with one equally long window per device.
+    Filtering and peak detection run over the whole batch in one pass;
+    returns one BeatResult per row, with ``ibis`` in seconds.
+    """
+    windows = np.atleast_2d(np.asarray(windows, dtype=np.float64))
+    fingers = windows.mean(axis=1) >= FINGER_THRESHOLD
+    peaks = find_peaks(bandpass(windows, sample_rate), sample_rate)
+
+    rows, columns = np.nonzero(peaks)
+    counts = np.bincount(rows, minlength=len(windows))
+    intervals = np.diff(columns) / sample_rate
+    # Drop the intervals spanning the end of one row and the start of the next
+    same_row = rows[1:] == rows[:-1]
+    interval_rows = rows[1:][same_row]
+    intervals = intervals[same_row]
+
+    sums = np.bincount(interval_rows, weights=intervals, minlength=len(windows))
+    interval_counts = counts - 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bpm = np.where(interval_counts > 0, 60.0 * interval_counts / sums, 0.0)
+    bpm = np.where(fingers, bpm, 0.0)
+
+    starts = np.concatenate([[0], np.cumsum(counts)])
+    interval_starts = np.concatenate([[0], np.cumsum(np.maximum(interval_counts, 0))])
+    results = []
+    for i in range(len(windows)):
+        if not fingers[i]:
+            results.append(NO_BEATS)
+            continue
+        ibis = intervals[interval_starts[i]:interval_starts[i + 1]]
+        results.append(BeatResult(
+            bpm=float(bpm[i]),
+            ibis=ibis,
+            peaks=columns[starts[i]:starts[i + 1]],
+            finger_detected=True,
+            fresh=len(ibis),
+        ))
+    return results
+
+
+def beat_sample(result, ir_value, timestamp):
+    """Turn a BeatResult into a sample in the /api shape.
+
+    The current rate comes from the latest inter-beat interval and the
+    average from the whole window; the intervals not reported before are
+    kept under ``beats``.
+    """
+    fresh = result.ibis[len(result.ibis) - result.fresh:]
+    current = 60.0 / float(result.ibis[-1]) if len(result.ibis) else 0.0
+    return {
+        "heart_rate": {
+            "current_bpm": round(current, 1),
+            "average_bpm": round(result.bpm, 1),
+        },
+        "sensor": {
+            "ir_value": int(ir_value),
+            "finger_detected": result.finger_detected,
+        },
+        "beats": {
+            "ibi_ms": [round(float(ibi) * 1000, 1) for ibi in fresh],
+        },
+        "timestamp": timestamp,
+    }
+
+
+def synthetic_ir(bpm, seconds, sample_rate=DEFAULT_SAMPLE_RATE, level=100000.0,
+                 amplitude=800.0, noise=50.0, start=0.0, phase=0.0, rng=None):
+    """Raw IR samples resembling a MAX30102 photoplethysmogram, for tests.
+
+    ``start`` (seconds) and ``phase`` (pulse phase in radians) describe the
+    first sample, so consecutive chunks join up into one continuous signal
+    even when the rate changes between them.
+    """
+    rng = np.random.default_rng(rng)
+    t = start + np.arange(int(seconds * sample_rate)) / sample_rate
+    phase = phase + 2 * np.pi * bpm / 60.0 * (t - start)
+    # Sharp systolic peak followed by a smaller dicrotic bump
+    pulse = np.sin(phase) + 0.25 * np.sin(2 * phase + 0.5)
+    drift = 0.02 * level * np.sin(2 * np.pi * 0.05 * t)
+    return level + drift + amplitude * pulse + rng.normal(0, noise, len(t))
+
+
+class BeatDetector:
+    """Collect raw IR samples per device and detect beats for all of them at once.
+
+    Each device keeps its latest ``window_seconds`` of raw samples.
+    ``process`` stacks the windows of every device that received
+    new samples since the last call and runs ``detect_beats`` on the batch,
+    then hands each device's result to ``on_result(device_id, result)``.
+    """
+
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE, window_seconds=DEFAULT_WINDOW_SECONDS,
+                 on_result=None):
+        self.sample_rate = sample_rate
+        self.window = int(sample_rate * window_seconds)
+        self.on_result = on_result
+        self._lock = threading.Lock()
+        self._buffers = {}
+        # Samples added per device since its last detection pass
+        self._added = {}
+        self._dirty = set()
+
+    def add_samples(self, device_id, ir_values):
+        """Append raw IR samples of one device, oldest first"""
+        with self._lock:
+            buffer = self._buffers.get(device_id)
+            values = np.asarray(ir_values, dtype=np.float64)
+            if buffer is not None:
+                values = np.concatenate([buffer, values])
+            self._buffers[device_id] = values[-self.window:]
+            self._added[device_id] = self._added.get(device_id, 0) + len(ir_values)
+            self._dirty.add(device_id)
+
+    def latest(self, device_id):
+        """The newest raw sample of a device, or None"""
+        with self._lock:
+            buffer = self._buffers.get(device_id)
+            return buffer[-1] if buffer is not None and len(buffer) else None
+
+    def remove_device(self, device_id):
+        with self._lock:
+            self._buffers.pop(device_id, None)
+            self._added.pop(device_id, None)
+            self._dirty.discard(device_id)
+
+    def process(self):
+        """Detect beats for every device with new, complete windows"""
+        with self._lock:
+            ready = [d for d in self._dirty if len(self._buffers[d]) >= self.window]
+            if not ready:
+                return {}
+            windows = np.stack([self._buffers[d] for d in ready])
+            added = [self._added.pop(d) for d in ready]
+            self._dirty.difference_update(ready)
+
+        results = {}
+        for device_id, count, result in zip(ready, added, detect_beats(windows, self.sample_rate)):
+            # Only intervals ending in the newly added samples are new
+            first_new = self.window - min(count, self.window)
+            fresh = int(np.count_nonzero(result.peaks[1:] >= first_new))
+            results[device_id] = result._replace(fresh=fresh)
+        if self.on_result is not None:
+            for device_id, result in results.items():
+                self.on_result(device_id, result)
+        return results
@@ -0,0 +1,261 @@
+"""Benchmarks of the ingest -> statistics -> render pipeline.
+
+Run with ``python -m heartrate bench``; every case is timed for each
+history size (and device count, for the fleet case) against a local
+simulated device, and the results are written to JSON so runs from
+different commits can be compared with ``--compare``.
+"""
+import json
+import logging
+import os
+import platform
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import requests
+
+from fleet import FleetPoller
+from monitor import HeartRateMonitor
+from notifier import format_telegram_report
+from packets import encode_sample
+from recording import ReplayResponse
+from simulator import FleetSimulator, SimulatorServer
+
+logger = logging.getLogger("heartrate.bench")
+
+DEFAULT_SIZES = (100, 1000, 10_000, 100_000, 1_000_000)
+DEFAULT_DEVICE_COUNTS = (1, 10, 100)
+# Each case repeats until it has run this long, within the repeat limits
+MIN_TIME = 0.2
+MIN_REPEATS = 5
+MAX_REPEATS = 10_000
+# Readings simulated per device when filling large histories
+PREFILL_STEPS = 3600
+# A case slower than the baseline by more than this factor is a regression
+DEFAULT_TOLERANCE = 1.25
+# Fleet rounds re-add every device, so this only keeps it from polling twice
+FLEET_ROUND_INTERVAL = 3600
+# Longest a fleet round may take before the benchmark gives up
+FLEET_ROUND_TIMEOUT = 30
+
+Result = namedtuple(
+    "Result", ["case", "history", "devices", "repeats", "mean_us", "median_us", "p95_us", "min_us"]
+)
+
+
+class CannedSession:
+    """Stand-in for requests.Session that answers every GET with the same body"""
+
+    def __init__(self, body):
+        self._response = ReplayResponse(200, body)
+
+    def get(self, url, timeout=None, headers=None):
+        return self._response
+
+    def close(self):
+        pass
+
+
+class RoundMonitor(HeartRateMonitor):
+    """Monitor on a fixed schedule that reports every finished poll"""
+
+    def __init__(self, on_poll):
+        super().__init__()
+        self.on_poll = on_poll
+
+    def poll(self):
+        try:
+            super().poll()
+        finally:
+            self.on_poll()
+
+    def next_poll_delay(self, interval):
+        return interval
+
+
+def measure(func, min_time=MIN_TIME, min_repeats=MIN_REPEATS, max_repeats=MAX_REPEATS):
+    """Call ``func`` repeatedly; returns the sorted per-call times in microseconds"""
+    times = []
+    started = time.perf_counter()
+    while len(times) < max_repeats:
+        begin = time.perf_counter_ns()
+        func()
+        times.append((time.perf_counter_ns() - begin) / 1000)
+        if len(times) >= min_repeats and time.perf_counter() - started >= min_time:
+            break
+    return np.sort(np.array(times))
+
+
+def summarize_times(case, history, devices, times):
+    return Result(
+        case=case,
+        history=history,
+        devices=devices,
+        repeats=len(times),
+        mean_us=float(times.mean()),
+        median_us=float(np.median(times)),
+        p95_us=float(np.percentile(times, 95)),
+        min_us=float(times[0]),
+    )
+
+
+def prefilled_monitor(size, seed=0):
+    """Monitor whose history holds ``size`` simulated one-second readings"""
+    # Simulating hour-long stretches of many devices at once is far quicker
+    # than stepping a single device ``size`` times
+    steps = min(size, PREFILL_STEPS)
+    simulator = FleetSimulator(-(-size // steps), seed=seed)
+    readings = simulator.run(steps)
+    now = time.time()
+    monitor = HeartRateMonitor()
+    monitor.max_history = size
+    monitor.history.extend({
+        "timestamp": now - size + np.arange(size, dtype=np.float64),
+        "current_bpm": readings.current_bpm.T.ravel()[:size],
+        "average_bpm": readings.average_bpm.T.ravel()[:size],
+        "ir_value": readings.ir_value.T.ravel()[:size],
+        "finger_detected": readings.finger_detected.T.ravel()[:size],
+    })
+    current_bpm = monitor.history.current_bpm()
+    monitor.stats.rebuild(current_bpm, window=size)
+    monitor.analytics.rebuild(current_bpm)
+    monitor.latest_data = simulator.sample(0)
+    return monitor
+
+
+def load_chart():
+    """app.create_heart_rate_chart, or None when the dashboard can't be imported"""
+    try:
+        from app import create_heart_rate_chart
+    except ImportError as e:
+        logger.warning("Skipping chart benchmarks: %s", e)
+        return None
+    return create_heart_rate_chart
+
+
+def bench_history_size(size, server_url, chart=None, min_time=MIN_TIME):
+    """Time every single-device case with ``size`` readings of history"""
+    monitor = prefilled_monitor(size)
+    results = []
+
+    def run(case, func):
+        times = measure(func, min_time)
+        results.append(summarize_times(case, size, 1, times))
+        logger.info("%-22s history=%-8d median %10.1f us", case, size, results[-1].median_us)
+
+    # Parsing and appending only, with the HTTP round trip taken out
+    monitor.api_url = "bench://canned"
+    monitor.session = CannedSession(json.dumps(monitor.latest_data).encode("utf-8"))
+    run("fetch_data_parse", monitor.fetch_data)
+    monitor.session = CannedSession(encode_sample(monitor.latest_data))
+    run("fetch_data_packet", monitor.fetch_data)
+
+    monitor.api_url = server_url
+    monitor.session = requests.Session()
+    run("fetch_data_http", monitor.fetch_data)
+    monitor.session.close()
+
+    run("status_trend", lambda: (monitor.get_current_status(), monitor.get_heart_rate_trend()))
+    run("insights_cached", monitor.generate_health_insights)
+    heart_rates = monitor.history.current_bpm()
+    run("insights_full", lambda: monitor.generate_health_insights(heart_rates))
+    if chart is not None:
+        run("chart_figure", lambda: chart(monitor.history))
+    run("telegram_report",
+        lambda: format_telegram_report(monitor, monitor.latest_data, "Benchmark"))
+    return results
+
+
+def bench_fleet(devices, server, min_time=MIN_TIME):
+    """Time one round of ``devices`` monitors polled concurrently by a FleetPoller"""
+    poller = FleetPoller()
+    lock = threading.Lock()
+    done = threading.Event()
+    pending = [0]
+
+    def polled():
+        with lock:
+            pending[0] -= 1
+            if pending[0] == 0:
+                done.set()
+
+    monitors = []
+    for url in server.urls()[:devices]:
+        monitor = RoundMonitor(polled)
+        monitor.api_url = url
+        monitors.append(monitor)
+
+    def poll_round():
+        done.clear()
+        pending[0] = len(monitors)
+        # Adding a device schedules its first poll right away
+        for key, monitor in enumerate(monitors):
+            poller.add(key, monitor, FLEET_ROUND_INTERVAL)
+        if not done.wait(FLEET_ROUND_TIMEOUT):
+            raise RuntimeError(f"Fleet round of {devices} devices timed out")
+
+    try:
+        times = measure(poll_round, min_time, min_repeats=3)
+    finally:
+        poller.stop()
+    result = summarize_times("fleet_round", 0, devices, times)
+    logger.info("%-22s devices=%-8d median %10.1f us (%.0f samples/s)", "fleet_round", devices,
+                result.median_us, devices / result.median_us * 1e6)
+    return result
+
+
+def environment():
+    """Where the benchmarks ran, so results from different machines aren't mixed up"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, device_counts=DEFAULT_DEVICE_COUNTS, chart=True,
+                   min_time=MIN_TIME):
+    """Run every case and return ``{"environment": ..., "results": [...]}``"""
+    chart = load_chart() if chart else None
+    devices = max(device_counts, default=1)
+    results = []
+    with SimulatorServer(FleetSimulator(devices, seed=0, interval=0.1)) as server:
+        for size in sizes:
+            results.extend(bench_history_size(size, server.url + "/api", chart, min_time))
+        for count in device_counts:
+            results.append(bench_fleet(count, server, min_time))
+    return {
+        "environment": environment(),
+        "results": [result._asdict() for result in results],
+    }
+
+
+def compare_results(baseline, current, tolerance=DEFAULT_TOLERANCE):
+    """Median time ratios of cases present in both runs; returns the regressions"""
+    previous = {
+        (r["case"], r["history"], r["devices"]): r["median_us"] for r in baseline["results"]
+    }
+    regressions = []
+    for result in current["results"]:
+        key = (result["case"], result["history"], result["devices"])
+        if key not in previous or not previous[key]:
+            continue
+        ratio = result["median_us"] / previous[key]
+        logger.info("%-22s history=%-8d devices=%-5d %8.2fx", key[0], key[1], key[2], ratio)
+        if ratio > tolerance:
+            regressions.append((key, ratio))
+    return regressions
@@ -0,0 +1,65 @@
+import numpy as np
+
+
+def lttb_indices(x, y, n):
+    """Indices of ``n`` points chosen by Largest-Triangle-Three-Buckets.
+
+    LTTB keeps the first and last points and, for every bucket in between,
+    the point forming the largest triangle with the previously kept point
+    and the average of the next bucket, which preserves the visual shape
+    of a line far better than taking every k-th point.
+    """
+    length = len(x)
+    if n >= length or n < 3:
+        return np.arange(length)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # n - 2 buckets between the fixed first and last points
+    edges = np.linspace(1, length - 1, n - 1).astype(np.int64)
+
+    selected = np.empty(n, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = length - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        if i + 2 < len(edges):
+            next_lo, next_hi = edges[i + 1], max(edges[i + 2], edges[i + 1] + 1)
+        else:
+            next_lo, next_hi = length - 1, length
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+
+        area = np.abs(
+            (x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y, n):
+    """Indices of the min and max of ``n // 2`` equal buckets, in order.
+
+    Cheaper than LTTB and fully vectorised; keeps every spike, which suits
+    noisy signals such as raw IR values.
+    """
+    length = len(y)
+    buckets = n // 2
+    if n >= length or buckets < 1:
+        return np.arange(length)
+
+    size = -(-length // buckets)
+    padded = np.full(buckets * size, np.nan)
+    padded[:length] = y
+    padded = padded.reshape(buckets, size)
+    # The final bucket may be entirely padding when length divides unevenly
+    filled = ~np.all(np.isnan(padded), axis=1)
+    padded = padded[filled]
+    offsets = np.flatnonzero(filled) * size
+
+    lows = offsets + np.nanargmin(padded, axis=1)
+    highs = offsets + np.nanargmax(padded, axis=1)
+    indices = np.unique(np.concatenate([lows, highs, [0, length - 1]]))
+    return indices
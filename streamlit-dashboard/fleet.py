@@ -0,0 +1,124 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 32
+DEFAULT_TIMEOUT = 3
+
+
+class FleetPoller:
+    """Poll many monitors on their own schedules from one bounded worker pool.
+
+    A single scheduler thread hands due devices to a fixed-size thread pool
+    that shares one keep-alive ``requests.Session``. A device is only
+    rescheduled once its poll completes, using the monitor's adaptive
+    ``next_poll_delay`` when it has one, so a dead node waiting out its
+    timeout or backing off never holds up the rest of the fleet.
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="fleet-poll")
+        self._cond = threading.Condition()
+        # key -> [monitor, interval, generation, in_flight]
+        self._devices = {}
+        self._heap = []
+        self._generations = itertools.count()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="fleet-scheduler", daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __contains__(self, key):
+        return key in self._devices
+
+    def add(self, key, monitor, interval, timeout=None):
+        """Start polling ``monitor`` every ``interval`` seconds under ``key``"""
+        monitor.session = self.session
+        monitor.timeout = self.timeout if timeout is None else timeout
+        with self._cond:
+            generation = next(self._generations)
+            self._devices[key] = [monitor, float(interval), generation, False]
+            heapq.heappush(self._heap, (time.monotonic(), generation, key))
+            self._cond.notify()
+
+    def set_interval(self, key, interval):
+        with self._cond:
+            entry = self._devices.get(key)
+            if entry is None or entry[1] == float(interval):
+                return
+            entry[1] = float(interval)
+            if entry[3]:
+                # Picked up when the in-flight poll reschedules itself
+                return
+            # Reschedule from now; the stale heap entry is ignored by generation
+            entry[2] = next(self._generations)
+            heapq.heappush(self._heap, (time.monotonic(), entry[2], key))
+            self._cond.notify()
+
+    def remove(self, key):
+        with self._cond:
+            entry = self._devices.pop(key, None)
+            if entry is not None:
+                entry[0].session = None
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._devices.clear()
+            self._cond.notify()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def _run(self):
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, generation, key = self._heap[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+
+                entry = self._devices.get(key)
+                if entry is None or entry[2] != generation or entry[3]:
+                    continue
+                entry[3] = True
+                self._executor.submit(self._poll, key, entry[0], generation, due)
+
+    def _poll(self, key, monitor, generation, due):
+        try:
+            monitor.poll()
+        finally:
+            with self._cond:
+                entry = self._devices.get(key)
+                if entry is not None and entry[2] == generation:
+                    entry[3] = False
+                    interval = entry[1]
+                    if hasattr(monitor, "next_poll_delay"):
+                        # A failing delay must not drop the device from the schedule
+                        try:
+                            interval = monitor.next_poll_delay(interval)
+                        except Exception:
+                            logger.exception("Poll delay of %s failed", key)
+                    # Keep to the schedule unless the poll itself overran it
+                    due = max(due + interval, time.monotonic())
+                    heapq.heappush(self._heap, (due, generation, key))
+                    self._cond.notify()
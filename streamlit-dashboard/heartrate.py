@@ -0,0 +1,397 @@
+"""Command line entry point: ``python -m heartrate worker|report|replay|simulate|bench|ui``.
+
+The worker runs polling, storage, alert rules and Telegram reports without
+the dashboard, so only the lightweight core modules are imported; pandas is
+only loaded for ``report`` and Streamlit and Plotly by ``ui`` alone.
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger("heartrate")
+
+DEFAULT_DATA_DIR = "heart_rate_data"
+
+
+def recording_path(directory, key):
+    """New session log path for a device, named after it and the current time"""
+    from store import device_dirname
+
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return os.path.join(directory, f"{device_dirname(key)}-{stamp}.hrrec")
+
+
+def parse_thresholds(text):
+    """Parse ``low,high,very_low,very_high`` into rules.HeartRateThresholds"""
+    from rules import HeartRateThresholds, thresholds_ordered
+
+    try:
+        thresholds = HeartRateThresholds(*(float(value) for value in text.split(",")))
+    except (TypeError, ValueError):
+        raise argparse.ArgumentTypeError(
+            f"Expected four comma separated numbers (low,high,very_low,very_high): {text!r}"
+        )
+    if not thresholds_ordered(thresholds):
+        raise argparse.ArgumentTypeError(
+            f"Expected very_low <= low < high <= very_high: {text!r}"
+        )
+    return thresholds
+
+
+def run_worker(args):
+    from api import VitalsServer
+    from hub import DeviceHub
+    from ingest import IngestServer
+    from metrics import MetricsServer
+    from notifier import AlertNotifier, AlertTarget, TelegramDispatcher, format_telegram_report
+    from recording import SessionRecorder
+    from rules import RuleEngine
+    from store import TimeSeriesStore
+
+    store = TimeSeriesStore(args.data_dir)
+    dispatcher = TelegramDispatcher(spool_dir=os.path.join(args.data_dir, "telegram_outbox"))
+    telegram = bool(args.telegram_token and args.telegram_chat_id)
+    target = None
+    if telegram:
+        target = AlertTarget(args.telegram_token, args.telegram_chat_id, args.patient)
+        # Resend whatever an earlier run left in the spool for this bot
+        dispatcher.register_token(args.telegram_token)
+
+    rules = RuleEngine()
+    rules.on_event = AlertNotifier(dispatcher, rules)
+    rules.start(1.0)
+    hub = DeviceHub(store=store, rules=rules)
+
+    subscriptions = []
+    for device in args.devices:
+        mock = device == "mock"
+        subscription = hub.subscribe(device, use_mock_data=mock, interval=args.interval,
+                                     max_history=args.max_history, receive_samples=False)
+        hub.configure_alerts(subscription.key, args.thresholds, target if args.alerts else None)
+        if args.record_dir:
+            subscription.monitor.recorder = SessionRecorder(
+                recording_path(args.record_dir, subscription.key)
+            )
+        subscriptions.append(subscription)
+        logger.info("Monitoring %s", subscription.key)
+
+    ingest = None
+    if args.ingest_port is not None:
+        ingest = IngestServer(hub, host=args.ingest_host, port=args.ingest_port,
+                              max_history=args.max_history, token=args.ingest_token)
+        ingest.start()
+        logger.info("Accepting pushed samples on port %d", ingest.port)
+
+    api = None
+    if args.api_port is not None:
+        api = VitalsServer(hub, host=args.api_host, port=args.api_port, token=args.api_token)
+        api.start()
+        logger.info("Serving the vitals API on port %d", api.port)
+
+    metrics = None
+    if args.metrics_port is not None:
+        metrics = MetricsServer(port=args.metrics_port)
+        metrics.start()
+        logger.info("Serving metrics at http://127.0.0.1:%d/metrics", metrics.port)
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    reports = telegram and args.report_interval > 0
+    next_status = next_report = time.monotonic()
+    while not stop.is_set():
+        now = time.monotonic()
+        if now >= next_status:
+            for subscription in subscriptions:
+                monitor = subscription.monitor
+                if monitor.last_error:
+                    logger.warning("%s: %s", subscription.key, monitor.last_error)
+                else:
+                    logger.info("%s: %s (%s)", subscription.key,
+                                monitor.get_current_status(), monitor.get_heart_rate_trend())
+            next_status += args.status_interval
+        if reports and now >= next_report:
+            for subscription in subscriptions:
+                if subscription.latest_data:
+                    dispatcher.send(
+                        args.telegram_token, args.telegram_chat_id,
+                        format_telegram_report(subscription.monitor, subscription.latest_data,
+                                               args.patient),
+                    )
+            next_report += args.report_interval
+        deadline = min(next_status, next_report) if reports else next_status
+        stop.wait(max(deadline - time.monotonic(), 0))
+
+    logger.info("Shutting down")
+    if ingest is not None:
+        ingest.stop()
+    if api is not None:
+        api.stop()
+    if metrics is not None:
+        metrics.stop()
+    for subscription in subscriptions:
+        if subscription.monitor.recorder is not None:
+            subscription.monitor.recorder.close()
+        subscription.close()
+    rules.stop()
+    hub.poller.stop()
+    dispatcher.flush(timeout=5)
+    dispatcher.stop()
+    store.close()
+    return 0
+
+
+def parse_time(text):
+    """Parse an ISO date/time, or a duration like ``24h``/``7d`` before now, to epoch seconds"""
+    units = {"h": 3600, "d": 86400}
+    if text and text[-1] in units and text[:-1].isdigit():
+        return (datetime.now() - timedelta(seconds=int(text[:-1]) * units[text[-1]])).timestamp()
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected an ISO date/time or e.g. 24h, 7d: {text!r}")
+
+
+def run_report(args):
+    from notifier import TelegramDispatcher
+    from reports import format_report_summary, generate_reports
+
+    reports = generate_reports(
+        args.data_dir, args.start, args.end, patients=args.patients or None,
+        thresholds=args.thresholds, out_dir=args.out, formats=args.format,
+        workers=args.workers,
+    )
+    for report in reports:
+        summary = report.summary
+        logger.info("%s: %d readings, %d events", report.patient, summary["valid_readings"],
+                    sum(summary["events"].values()))
+    if args.out:
+        logger.info("Exported %d reports to %s", len(reports), args.out)
+
+    if args.telegram_token and args.telegram_chat_id:
+        dispatcher = TelegramDispatcher(spool_dir=os.path.join(args.data_dir, "telegram_outbox"))
+        for report in reports:
+            dispatcher.send(args.telegram_token, args.telegram_chat_id,
+                            format_report_summary(report))
+        dispatcher.flush(timeout=60)
+        dispatcher.stop()
+    return 0
+
+
+def run_replay(args):
+    from monitor import HeartRateMonitor
+    from recording import SessionReplayer
+    from rules import RuleEngine
+
+    monitor = HeartRateMonitor()
+    monitor.max_history = args.max_history
+    monitor.thresholds = args.thresholds
+    rules = RuleEngine()
+    rules.add_stream(args.recording, args.thresholds)
+    monitor.add_listener(lambda data: rules.submit(args.recording, data))
+
+    def report_event(event):
+        when = datetime.fromtimestamp(event.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        logger.info("%s %s: %s (%g BPM)", when, event.kind, event.rule.name, event.value)
+
+    rules.on_event = report_event
+    replayer = SessionReplayer(args.recording, args.speed,
+                               on_step=lambda monitor, record: rules.evaluate())
+    started = time.perf_counter()
+    count = replayer.run(monitor)
+    elapsed = time.perf_counter() - started
+
+    logger.info("Replayed %d responses in %.3f s (%.0f/s)", count, elapsed,
+                count / elapsed if elapsed else 0)
+    logger.info("Final status: %s, trend: %s", monitor.get_current_status(),
+                monitor.get_heart_rate_trend())
+    for insight in monitor.generate_health_insights():
+        logger.info("Insight: %s", insight)
+    return 0
+
+
+def parse_speed(text):
+    if text == "max":
+        return None
+    try:
+        speed = float(text)
+    except ValueError:
+        speed = 0
+    if speed <= 0:
+        raise argparse.ArgumentTypeError(f"Expected a positive number or 'max': {text!r}")
+    return speed
+
+
+def run_simulate(args):
+    from simulator import FleetSimulator, SimulatorServer
+
+    simulator = FleetSimulator(args.devices, seed=args.seed, interval=args.interval)
+    server = SimulatorServer(simulator, host=args.host, port=args.port)
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    with server:
+        logger.info("Simulating %d devices at %s/<0..%d>/api", args.devices, server.url,
+                    args.devices - 1)
+        if args.devices <= 10:
+            for url in server.urls():
+                logger.info("  %s", url)
+        stop.wait()
+    return 0
+
+
+def run_bench(args):
+    import json
+    from bench import compare_results, run_benchmarks
+
+    results = run_benchmarks(args.sizes, args.devices, chart=not args.no_chart,
+                             min_time=args.min_time)
+    with open(args.out, "w") as handle:
+        json.dump(results, handle, indent=2)
+    logger.info("Wrote %d results to %s", len(results["results"]), args.out)
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        regressions = compare_results(baseline, results, args.tolerance)
+        for (case, history, devices), ratio in regressions:
+            logger.warning("Regression: %s history=%d devices=%d is %.2fx slower",
+                           case, history, devices, ratio)
+        if regressions:
+            return 1
+    return 0
+
+
+def run_ui(args):
+    from streamlit.web import cli
+
+    app = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    sys.argv = ["streamlit", "run", app] + args.streamlit_args
+    return cli.main()
+
+
+def add_data_dir_argument(parser):
+    parser.add_argument("--data-dir", default=os.environ.get("HEART_RATE_DATA_DIR", DEFAULT_DATA_DIR))
+
+
+def add_thresholds_argument(parser):
+    parser.add_argument("--thresholds", type=parse_thresholds, default=None,
+                        help="low,high,very_low,very_high BPM limits (default 60,100,50,120)")
+
+
+def add_telegram_arguments(parser):
+    parser.add_argument("--telegram-token", default=os.environ.get("TELEGRAM_BOT_TOKEN"))
+    parser.add_argument("--telegram-chat-id", default=os.environ.get("TELEGRAM_CHAT_ID"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m heartrate")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    worker = commands.add_parser("worker", help="Monitor devices headless, without the dashboard")
+    worker.add_argument("--devices", nargs="+", required=True,
+                        help="Device API URLs, push://<id> for pushing devices, or 'mock'")
+    worker.add_argument("--interval", type=float, default=2,
+                        help="Base polling interval in seconds")
+    worker.add_argument("--max-history", type=int, default=100,
+                        help="Readings kept in memory per device")
+    add_data_dir_argument(worker)
+    worker.add_argument("--ingest-port", type=int, default=None,
+                        help="Also accept pushed samples on this port")
+    worker.add_argument("--ingest-host", default="127.0.0.1",
+                        help="Address the ingest server listens on (needs --ingest-token "
+                             "unless it is a loopback address)")
+    worker.add_argument("--ingest-token", default=os.environ.get("HEART_RATE_INGEST_TOKEN"),
+                        help="Shared token pushing devices must send as a Bearer token")
+    worker.add_argument("--patient", default="", help="Patient name used in reports")
+    add_telegram_arguments(worker)
+    worker.add_argument("--alerts", action="store_true",
+                        help="Send automatic Telegram alerts when readings stay out of range")
+    add_thresholds_argument(worker)
+    worker.add_argument("--report-interval", type=float, default=0,
+                        help="Send a Telegram status report every N seconds (0 disables)")
+    worker.add_argument("--status-interval", type=float, default=30,
+                        help="Log every device's status every N seconds")
+    worker.add_argument("--api-port", type=int, default=None,
+                        help="Serve the read-only vitals API on this port")
+    worker.add_argument("--api-host", default="127.0.0.1",
+                        help="Address the vitals API listens on (needs --api-token unless "
+                             "it is a loopback address)")
+    worker.add_argument("--api-token", default=os.environ.get("HEART_RATE_API_TOKEN"),
+                        help="Shared token API clients must send as a Bearer token")
+    worker.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics on this port")
+    worker.add_argument("--record-dir",
+                        help="Record every raw API response to a session log in this directory")
+    worker.set_defaults(run=run_worker)
+
+    report = commands.add_parser("report", help="Summarize stored history for many patients")
+    report.add_argument("--patients", nargs="*",
+                        help="Stored device/patient directories (default: all)")
+    report.add_argument("--start", type=parse_time, default=parse_time("24h"),
+                        help="ISO date/time, or a duration before now like 24h or 7d (default 24h)")
+    report.add_argument("--end", type=parse_time, default=datetime.now().timestamp(),
+                        help="ISO date/time (default now)")
+    report.add_argument("--out", help="Export each report's tables to this directory")
+    report.add_argument("--format", nargs="+", choices=["csv", "parquet"], default=["csv"])
+    report.add_argument("--workers", type=int, default=None,
+                        help="Processes to use (default: one per core)")
+    add_data_dir_argument(report)
+    add_thresholds_argument(report)
+    add_telegram_arguments(report)
+    report.set_defaults(run=run_report)
+
+    replay = commands.add_parser("replay", help="Replay a recorded session through the monitor")
+    replay.add_argument("recording", help="Session log written with --record-dir or the dashboard")
+    replay.add_argument("--speed", type=parse_speed, default=1.0,
+                        help="Multiple of real time, e.g. 1 or 100, or 'max' (default 1)")
+    replay.add_argument("--max-history", type=int, default=100)
+    add_thresholds_argument(replay)
+    replay.set_defaults(run=run_replay)
+
+    simulate = commands.add_parser("simulate", help="Serve simulated ESP32 sensors over HTTP")
+    simulate.add_argument("--devices", type=int, default=1)
+    simulate.add_argument("--seed", type=int, default=None,
+                          help="Seed for reproducible readings")
+    simulate.add_argument("--interval", type=float, default=1.0,
+                          help="Seconds between new readings")
+    simulate.add_argument("--host", default="127.0.0.1")
+    simulate.add_argument("--port", type=int, default=8600)
+    simulate.set_defaults(run=run_simulate)
+
+    bench = commands.add_parser("bench", help="Benchmark the ingest, statistics and render path")
+    bench.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10_000, 100_000, 1_000_000],
+                       help="History sizes to benchmark")
+    bench.add_argument("--devices", type=int, nargs="+", default=[1, 10, 100],
+                       help="Device counts for the fleet polling benchmark")
+    bench.add_argument("--min-time", type=float, default=0.2,
+                       help="Seconds to spend on each case")
+    bench.add_argument("--no-chart", action="store_true",
+                       help="Skip the chart benchmark, which imports the dashboard")
+    bench.add_argument("--out", default="bench.json", help="Where to write the results")
+    bench.add_argument("--compare", help="Earlier results to compare against")
+    bench.add_argument("--tolerance", type=float, default=1.25,
+                       help="Slowdown factor reported as a regression (default 1.25)")
+    bench.set_defaults(run=run_bench)
+
+    ui = commands.add_parser("ui", help="Start the Streamlit dashboard")
+    ui.add_argument("streamlit_args", nargs=argparse.REMAINDER,
+                    help="Extra arguments passed to 'streamlit run'")
+    ui.set_defaults(run=run_ui)
+
+    args = parser.parse_args(argv)
+    if args.command in ("worker", "report", "replay") and args.thresholds is None:
+        from rules import DEFAULT_THRESHOLDS
+        args.thresholds = DEFAULT_THRESHOLDS
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+import numpy as np
+from datetime import datetime
+
+# Column layout of the history buffer
+HISTORY_FIELDS = (
+    ("timestamp", np.float64),
+    ("current_bpm", np.float64),
+    ("average_bpm", np.float64),
+    ("ir_value", np.int64),
+    ("finger_detected", np.bool_),
+)
+
+
+def to_local_datetime64(timestamps):
+    """Convert epoch seconds to local-time datetime64 values for plotting"""
+    offset = datetime.now().astimezone().utcoffset().total_seconds()
+    millis = np.rint((np.asarray(timestamps) + offset) * 1000).astype(np.int64)
+    return millis.astype("datetime64[ms]")
+
+
+class HeartRateHistory:
+    """Fixed-capacity columnar ring buffer of heart rate samples.
+
+    Every sample is written twice, at ``pos`` and ``pos + capacity``, so the
+    latest ``n`` samples are always one contiguous slice of each column and
+    windows can be returned as views without copying.
+    """
+
+    def __init__(self, capacity=100):
+        self._columns = {}
+        self._capacity = 0
+        self._pos = 0
+        self._count = 0
+        self.resize(capacity)
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def __len__(self):
+        return self._count
+
+    def resize(self, capacity):
+        """Change the capacity, keeping the most recent samples"""
+        capacity = int(capacity)
+        if capacity < 1:
+            raise ValueError("History capacity must be at least 1")
+        if capacity == self._capacity:
+            return
+
+        keep = min(self._count, capacity)
+        columns = {}
+        for name, dtype in HISTORY_FIELDS:
+            column = np.zeros(2 * capacity, dtype=dtype)
+            if keep:
+                recent = self.column(name, keep)
+                column[:keep] = recent
+                column[capacity:capacity + keep] = recent
+            columns[name] = column
+
+        self._columns = columns
+        self._capacity = capacity
+        self._count = keep
+        self._pos = keep % capacity
+
+    def clear(self):
+        self._pos = 0
+        self._count = 0
+
+    def append(self, timestamp, current_bpm, average_bpm, ir_value, finger_detected):
+        """Append one sample in O(1)"""
+        pos = self._pos
+        mirror = pos + self._capacity
+        for name, value in (
+            ("timestamp", timestamp),
+            ("current_bpm", current_bpm),
+            ("average_bpm", average_bpm),
+            ("ir_value", ir_value),
+            ("finger_detected", finger_detected),
+        ):
+            column = self._columns[name]
+            column[pos] = value
+            column[mirror] = value
+
+        self._pos = (pos + 1) % self._capacity
+        if self._count < self._capacity:
+            self._count += 1
+
+    def extend(self, columns):
+        """Append a block of samples given as arrays by field name, oldest first"""
+        count = len(columns["timestamp"])
+        capacity = self._capacity
+        skip = max(count - capacity, 0)
+        # Written as at most two slices, the second one wrapping to the start
+        start = (self._pos + skip) % capacity
+        first = min(count - skip, capacity - start)
+        rest = count - skip - first
+        for name, _ in HISTORY_FIELDS:
+            values = np.asarray(columns[name])[skip:]
+            column = self._columns[name]
+            column[start:start + first] = values[:first]
+            column[start + capacity:start + capacity + first] = values[:first]
+            if rest:
+                column[:rest] = values[first:]
+                column[capacity:capacity + rest] = values[first:]
+
+        self._pos = (self._pos + count) % capacity
+        self._count = min(self._count + count, capacity)
+
+    def append_sample(self, data, timestamp=None):
+        """Append a sample in the device /api JSON shape"""
+        if timestamp is None:
+            timestamp = data.get("timestamp", datetime.now())
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        self.append(
+            timestamp,
+            data["heart_rate"]["current_bpm"],
+            data["heart_rate"]["average_bpm"],
+            data["sensor"]["ir_value"],
+            data["sensor"]["finger_detected"],
+        )
+
+    def column(self, name, n=None):
+        """Return a read-only view of the latest ``n`` values of a column, oldest first"""
+        if n is None or n > self._count:
+            n = self._count
+        end = self._pos + self._capacity
+        view = self._columns[name][end - n:end]
+        view.flags.writeable = False
+        return view
+
+    def timestamps(self, n=None):
+        return self.column("timestamp", n)
+
+    def current_bpm(self, n=None):
+        return self.column("current_bpm", n)
+
+    def average_bpm(self, n=None):
+        return self.column("average_bpm", n)
+
+    def ir_values(self, n=None):
+        return self.column("ir_value", n)
+
+    def finger_detected(self, n=None):
+        return self.column("finger_detected", n)
+
+    def valid_bpm(self, n=None):
+        """Return the latest ``n`` heart rate readings that are above zero"""
+        rates = self.current_bpm(n)
+        return rates[rates > 0]
+
+    def datetimes(self, n=None):
+        """Return timestamps as local-time datetime64 values for plotting"""
+        return to_local_datetime64(self.timestamps(n))
+
+    def latest(self):
+        """Return the newest sample in the device /api JSON shape"""
+        if not self._count:
+            return None
+        index = self._pos + self._capacity - 1
+        columns = self._columns
+        return {
+            "heart_rate": {
+                "current_bpm": columns["current_bpm"][index].item(),
+                "average_bpm": columns["average_bpm"][index].item(),
+            },
+            "sensor": {
+                "ir_value": columns["ir_value"][index].item(),
+                "finger_detected": columns["finger_detected"][index].item(),
+            },
+            "timestamp": datetime.fromtimestamp(columns["timestamp"][index].item()),
+        }
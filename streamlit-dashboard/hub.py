@@ -0,0 +1,254 @@
+import itertools
+import queue
+import threading
+import weakref
+
+from fleet import FleetPoller, DEFAULT_TIMEOUT, DEFAULT_WORKERS
+from metrics import METRICS
+from monitor import HeartRateMonitor
+from rules import DEFAULT_THRESHOLDS
+
+MOCK_DEVICE_KEY = "mock://"
+# Devices under this prefix push their samples to the ingest server
+PUSH_DEVICE_PREFIX = "push://"
+
+DEFAULT_INTERVAL = 2
+DEFAULT_HISTORY = 100
+# Samples buffered per subscriber before the oldest are dropped
+SUBSCRIBER_QUEUE_SIZE = 500
+
+
+def device_key(api_url, use_mock_data=False):
+    return MOCK_DEVICE_KEY if use_mock_data else api_url.strip()
+
+
+def is_push_device(key):
+    return key.startswith(PUSH_DEVICE_PREFIX)
+
+
+class SharedDevice:
+    """One polled device shared by every session watching it"""
+
+    def __init__(self, key, store=None, relayed=False):
+        self.key = key
+        self.monitor = HeartRateMonitor()
+        self.monitor.name = key
+        # Relayed devices are polled, stored and checked elsewhere (see
+        # shards.ShardedIngest) and only mirrored here
+        self.relayed = relayed
+        if store is not None and not relayed:
+            self.monitor.store = store.device(key)
+        if key == MOCK_DEVICE_KEY:
+            self.monitor.set_use_mock_data(True)
+        elif not is_push_device(key):
+            self.monitor.set_api_url(key)
+        # subscriber token -> (poll interval, history size) it asked for
+        self.preferences = {}
+        # subscriber token -> callback feeding its sample queue
+        self.listeners = {}
+        # Listener feeding the hub's rule engine, if any
+        self.rule_listener = None
+        # Where automatic alerts go (notifier.AlertTarget), shared by all viewers
+        self.alert_target = None
+
+    def apply_preferences(self, poller):
+        """Poll as often as the most demanding viewer wants and keep enough history for all"""
+        if not self.preferences:
+            return
+        interval = min(p[0] for p in self.preferences.values())
+        max_history = max(p[1] for p in self.preferences.values())
+        self.monitor.max_history = max_history
+        if is_push_device(self.key) or self.relayed:
+            # Pushed samples arrive through ingest.IngestServer and relayed
+            # ones from their owner, never polled here
+            return
+        if self.key in poller:
+            poller.set_interval(self.key, interval)
+        else:
+            poller.add(self.key, self.monitor, interval)
+
+
+class Subscription:
+    """A session's read-only handle on a shared device.
+
+    New samples are delivered to a bounded per-subscriber queue; history and
+    statistics are read from the shared monitor and must not be modified.
+    The subscription is released automatically when it is garbage collected,
+    e.g. when the Streamlit session that owns it ends.
+    """
+
+    def __init__(self, hub, device, token, samples):
+        self.key = device.key
+        self.token = token
+        self._hub = hub
+        self._device = device
+        self._samples = samples
+        self._finalizer = weakref.finalize(self, hub._release, device.key, token)
+
+    @property
+    def monitor(self):
+        return self._device.monitor
+
+    @property
+    def latest_data(self):
+        return self._device.monitor.latest_data
+
+    @property
+    def closed(self):
+        return not self._finalizer.alive
+
+    def configure(self, interval=None, max_history=None):
+        """Record this viewer's refresh rate and history size"""
+        self._hub._configure(self.key, self.token, interval, max_history)
+
+    def drain(self):
+        """Return the samples delivered since the last call, oldest first"""
+        samples = []
+        while True:
+            try:
+                samples.append(self._samples.get_nowait())
+            except queue.Empty:
+                return samples
+
+    def close(self):
+        self._finalizer()
+
+
+class DeviceHub:
+    """Process-wide fleet registry of reference-counted, shared monitors.
+
+    However many sessions subscribe to the same API URL, the device is only
+    polled once per interval and every sample is fanned out to all of them.
+    All devices are polled by one FleetPoller over pooled connections,
+    samples are persisted to ``store`` (a store.TimeSeriesStore) and checked
+    against ``rules`` (a rules.RuleEngine) if given.
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, store=None,
+                 rules=None):
+        self._lock = threading.Lock()
+        self._devices = {}
+        self._tokens = itertools.count()
+        self.poller = FleetPoller(max_workers, timeout)
+        self.store = store
+        self.rules = rules
+
+    def subscribe(self, api_url, use_mock_data=False, interval=DEFAULT_INTERVAL,
+                  max_history=DEFAULT_HISTORY, receive_samples=True, relayed=False):
+        """Subscribe to a device; overview pages that only read the latest
+        state can pass ``receive_samples=False`` to skip the sample queue.
+
+        A new ``relayed`` device is never polled, stored or checked against
+        the rules; its samples are fed to ``monitor.ingest`` by the caller.
+        """
+        key = device_key(api_url, use_mock_data)
+        samples = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+
+        def deliver(data):
+            try:
+                samples.put_nowait(data)
+            except queue.Full:
+                # A slow viewer loses its oldest samples, never blocks the poller
+                try:
+                    samples.get_nowait()
+                except queue.Empty:
+                    pass
+                samples.put_nowait(data)
+
+        with self._lock:
+            device = self._devices.get(key)
+            if device is None:
+                device = self._devices[key] = SharedDevice(key, self.store, relayed)
+                if self.rules is not None and not relayed:
+                    self._watch(device)
+            token = next(self._tokens)
+            device.preferences[token] = (interval, max_history)
+            if receive_samples:
+                device.listeners[token] = deliver
+                device.monitor.add_listener(deliver)
+            device.apply_preferences(self.poller)
+        return Subscription(self, device, token, samples)
+
+    def _watch(self, device):
+        """Feed every sample of a new device into the rule engine"""
+        key = device.key
+        rules = self.rules
+        rules.add_stream(key, device.monitor.thresholds)
+
+        def submit(data):
+            rules.submit(key, data)
+
+        device.rule_listener = submit
+        device.monitor.add_listener(submit)
+
+    def configure_alerts(self, key, thresholds=DEFAULT_THRESHOLDS, target=None):
+        """Set a device's thresholds and where its automatic alerts are sent.
+
+        The settings are shared by every viewer of the device, so callers
+        should only change them on an explicit user action.
+        """
+        with self._lock:
+            device = self._devices.get(key)
+            if device is None:
+                return
+            device.monitor.thresholds = thresholds
+            device.alert_target = target
+            if self.rules is not None:
+                self.rules.add_stream(key, thresholds, target)
+
+    def alert_settings(self, key):
+        """Return a device's ``(thresholds, alert target)``"""
+        with self._lock:
+            device = self._devices.get(key)
+            if device is None:
+                return DEFAULT_THRESHOLDS, None
+            return device.monitor.thresholds, device.alert_target
+
+    def active_alerts(self, key):
+        if self.rules is None:
+            return []
+        return self.rules.active_alerts(key)
+
+    def devices(self):
+        """Return the number of subscribers per device key"""
+        with self._lock:
+            return {key: len(device.preferences) for key, device in self._devices.items()}
+
+    def monitors(self):
+        """Return the shared monitor of every registered device by key"""
+        with self._lock:
+            return {key: device.monitor for key, device in self._devices.items()}
+
+    def _configure(self, key, token, interval, max_history):
+        with self._lock:
+            device = self._devices.get(key)
+            if device is None or token not in device.preferences:
+                return
+            current_interval, current_history = device.preferences[token]
+            preferences = (
+                current_interval if interval is None else interval,
+                current_history if max_history is None else max_history,
+            )
+            if preferences != device.preferences[token]:
+                device.preferences[token] = preferences
+                device.apply_preferences(self.poller)
+
+    def _release(self, key, token):
+        with self._lock:
+            device = self._devices.get(key)
+            if device is None or token not in device.preferences:
+                return
+            del device.preferences[token]
+            if token in device.listeners:
+                device.monitor.remove_listener(device.listeners.pop(token))
+            if device.preferences:
+                device.apply_preferences(self.poller)
+            else:
+                self.poller.remove(key)
+                if device.rule_listener is not None:
+                    device.monitor.remove_listener(device.rule_listener)
+                    self.rules.remove_stream(key)
+                if device.monitor.store is not None:
+                    device.monitor.store.flush()
+                del self._devices[key]
+                METRICS.forget(key)
@@ -0,0 +1,455 @@
+import argparse
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+
+from auth import authorized, check_bind
+from beats import BeatDetector, beat_sample, synthetic_ir
+from hub import DEFAULT_HISTORY, PUSH_DEVICE_PREFIX
+from packets import CONTENT_TYPE as PACKET_CONTENT_TYPE, decode_readings, encode_records
+from poller import SamplePoller
+
+DEFAULT_INGEST_HOST = "127.0.0.1"
+DEFAULT_INGEST_PORT = 8502
+INGEST_PATH = "/ingest"
+DEVICE_ID_PATTERN = re.compile(r"[A-Za-z0-9._-]{1,64}")
+# Largest request body accepted, in bytes
+MAX_BODY_SIZE = 1 << 20
+# Below this a timestamp is taken as device uptime rather than epoch milliseconds
+EPOCH_MS_MIN = 1e11
+# Seconds between batched beat detection passes over raw IR windows
+BEAT_INTERVAL = 1.0
+
+
+def push_device_url(device_id):
+    """The API URL the dashboard uses to subscribe to a pushing device"""
+    return PUSH_DEVICE_PREFIX + device_id
+
+
+def parse_batch(payload, received=None):
+    """Turn a pushed JSON payload into samples in the /api shape, oldest first.
+
+    The payload is either one sample or ``{"samples": [...]}``. Sample
+    timestamps are milliseconds, read from ``timestamp`` or, as served by
+    ``/api``, ``heart_rate.timestamp``. When the batch carries the device
+    clock at send time as ``device_time``, timestamps are taken relative to
+    it, so devices that only know their uptime (``millis()``) still get
+    correct wall-clock times; otherwise they must be epoch milliseconds.
+    """
+    received = time.time() if received is None else received
+    if not isinstance(payload, dict):
+        raise ValueError("Payload must be a JSON object")
+    items = payload.get("samples", [payload])
+    if not isinstance(items, list):
+        raise ValueError("'samples' must be a list")
+    device_time = payload.get("device_time")
+
+    samples = []
+    for item in items:
+        try:
+            heart_rate = item["heart_rate"]
+            sensor = item["sensor"]
+            stamp = item.get("timestamp", heart_rate.get("timestamp"))
+            sample = {
+                "heart_rate": {
+                    "current_bpm": float(heart_rate["current_bpm"]),
+                    "average_bpm": float(heart_rate["average_bpm"]),
+                    "timestamp": stamp,
+                },
+                "sensor": {
+                    "ir_value": int(sensor["ir_value"]),
+                    "finger_detected": bool(sensor["finger_detected"]),
+                },
+            }
+            if stamp is None:
+                when = received
+            elif device_time is not None:
+                when = received - (float(device_time) - float(stamp)) / 1000
+            elif float(stamp) >= EPOCH_MS_MIN:
+                when = float(stamp) / 1000
+            else:
+                when = received
+            heart_rate = sample["heart_rate"]
+            values = (heart_rate["current_bpm"], heart_rate["average_bpm"], when)
+            if not all(math.isfinite(value) for value in values) or when < 0:
+                raise ValueError
+        except (KeyError, TypeError, ValueError, AttributeError, OverflowError):
+            raise ValueError(f"Invalid sample: {item!r}")
+        # Never place samples in the future because of device clock skew
+        sample["timestamp"] = datetime.fromtimestamp(min(when, received))
+        samples.append(sample)
+
+    samples.sort(key=lambda s: s["timestamp"])
+    return samples
+
+
+def parse_raw(raw, sample_rate):
+    """Validate a ``{"sample_rate": hz, "ir": [...]}`` window of raw IR samples"""
+    if not isinstance(raw, dict) or not isinstance(raw.get("ir"), list):
+        raise ValueError("'raw' must be an object with an 'ir' list")
+    if raw.get("sample_rate", sample_rate) != sample_rate:
+        raise ValueError(f"Raw samples must be sent at {sample_rate} Hz")
+    try:
+        return [float(value) for value in raw["ir"]]
+    except (TypeError, ValueError):
+        raise ValueError("'ir' must only contain numbers")
+
+
+class IngestServer:
+    """HTTP endpoint that sensors POST batches of samples to.
+
+    ``POST /ingest/<device_id>`` with a JSON body (see ``parse_batch``)
+    records the samples straight into the hub's shared monitor for
+    ``push://<device_id>``, so dashboards subscribed to that URL see them
+    within one refresh, without any polling. The server keeps its own
+    subscription to every device that has pushed, so history is retained
+    even while no dashboard is open. Samples older than the newest one
+    already recorded for a device, e.g. from overlapping batches, are
+    dropped.
+
+    Only known devices may push: those in ``device_ids`` and those the hub
+    is already monitoring as ``push://<device_id>``. With a ``token`` every
+    request must carry ``Authorization: Bearer <token>``; one is required
+    to listen on anything but a loopback address.
+
+    Batches may also be sent as a binary sample packet (see packets.py)
+    with ``Content-Type: application/vnd.heartrate.samples``; those are
+    decoded straight into the monitor's history columns.
+
+    Devices may instead send windows of raw IR samples as
+    ``{"raw": {"sample_rate": 100, "ir": [...]}}``. Beats of all such
+    devices are then detected together every ``BEAT_INTERVAL`` seconds
+    by a beats.BeatDetector, and each result is recorded as a sample.
+    """
+
+    def __init__(self, hub, host=DEFAULT_INGEST_HOST, port=DEFAULT_INGEST_PORT,
+                 max_history=DEFAULT_HISTORY, beats=None, token=None, device_ids=()):
+        check_bind(host, token, "ingest server")
+        self.hub = hub
+        self.max_history = max_history
+        self.token = token
+        self.device_ids = frozenset(device_ids)
+        self.beats = beats if beats is not None else BeatDetector()
+        self.beats.on_result = self._record_beats
+        self._beat_poller = SamplePoller(self.beats.process, BEAT_INTERVAL)
+        self._lock = threading.Lock()
+        # device_id -> [subscription, lock, newest recorded timestamp]
+        self._devices = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                path = self.path.split("?")[0].rstrip("/")
+                if not path.startswith(INGEST_PATH + "/"):
+                    self._reply(404, {"error": "Unknown endpoint"})
+                    return
+                if not authorized(self.headers, server.token):
+                    self._reply(401, {"error": "Missing or wrong token"})
+                    return
+                device_id = path[len(INGEST_PATH) + 1:]
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                except ValueError:
+                    length = -1
+                if not DEVICE_ID_PATTERN.fullmatch(device_id) or not 0 <= length <= MAX_BODY_SIZE:
+                    self._reply(400, {"error": "Invalid device or payload size"})
+                    return
+                if not server.known(device_id):
+                    self._reply(404, {"error": "Unknown device"})
+                    return
+                content_type = self.headers.get("Content-Type", "").split(";")[0].strip()
+                if content_type == PACKET_CONTENT_TYPE:
+                    try:
+                        readings = decode_readings(self.rfile.read(length), time.time())
+                    except ValueError as e:
+                        self._reply(400, {"error": str(e)})
+                        return
+                    accepted = server.ingest_readings(device_id, readings)
+                    self._reply(200, {"accepted": accepted, "raw": 0})
+                    return
+                try:
+                    payload = json.loads(self.rfile.read(length).decode("utf-8"))
+                    raw = None
+                    if isinstance(payload, dict) and "raw" in payload:
+                        raw = parse_raw(payload.pop("raw"), server.beats.sample_rate)
+                    samples = []
+                    if raw is None or "samples" in payload or "heart_rate" in payload:
+                        samples = parse_batch(payload)
+                except (UnicodeDecodeError, json.JSONDecodeError, ValueError) as e:
+                    self._reply(400, {"error": str(e)})
+                    return
+                if raw:
+                    server.beats.add_samples(device_id, raw)
+                accepted = server.ingest(device_id, samples)
+                self._reply(200, {"accepted": accepted, "raw": len(raw or [])})
+
+            def _reply(self, status, body):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def known(self, device_id):
+        """Whether pushes from a device are accepted"""
+        if device_id in self.device_ids:
+            return True
+        with self._lock:
+            if device_id in self._devices:
+                return True
+        return push_device_url(device_id) in self.hub.devices()
+
+    def ingest(self, device_id, samples):
+        """Record already parsed samples for a device, oldest first; returns how many were new"""
+        if not samples:
+            return 0
+        entry = self._device(device_id)
+        with entry[1]:
+            fresh = [data for data in samples if data["timestamp"].timestamp() > entry[2]]
+            if fresh:
+                entry[2] = fresh[-1]["timestamp"].timestamp()
+                entry[0].monitor.ingest(fresh)
+        return len(fresh)
+
+    def ingest_readings(self, device_id, readings):
+        """Record a decoded sample packet for a device; returns how many readings were new"""
+        if not len(readings["timestamp"]):
+            return 0
+        entry = self._device(device_id)
+        with entry[1]:
+            order = np.argsort(readings["timestamp"], kind="stable")
+            order = order[readings["timestamp"][order] > entry[2]]
+            if len(order):
+                readings = {name: column[order] for name, column in readings.items()}
+                entry[2] = float(readings["timestamp"][-1])
+                entry[0].monitor.ingest_readings(readings)
+        return len(order)
+
+    def _device(self, device_id):
+        with self._lock:
+            entry = self._devices.get(device_id)
+            if entry is None:
+                subscription = self.hub.subscribe(
+                    push_device_url(device_id), max_history=self.max_history,
+                    receive_samples=False,
+                )
+                entry = self._devices[device_id] = [subscription, threading.Lock(), -math.inf]
+            return entry
+
+    def _record_beats(self, device_id, result):
+        sample = beat_sample(result, self.beats.latest(device_id), datetime.now())
+        self.ingest(device_id, [sample])
+
+    def devices(self):
+        """IDs of every device that has pushed samples"""
+        with self._lock:
+            return sorted(self._devices)
+
+    def start(self):
+        self._thread.start()
+        self._beat_poller.start()
+
+    def stop(self):
+        self._beat_poller.stop()
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            for subscription, _, _ in self._devices.values():
+                subscription.close()
+            self._devices = {}
+
+
+class FakePushDevice:
+    """Local stand-in for a sensor that pushes its readings, for tests.
+
+    Takes a reading every ``sample_interval`` seconds and posts them in
+    batches every ``batch_interval`` seconds, stamped with its own uptime
+    clock like the ESP32's ``millis()``. With ``raw=True`` it posts raw IR
+    waveforms at ``sample_rate`` Hz instead and leaves beat detection to
+    the server, and with ``binary=True`` it posts binary sample packets.
+    """
+
+    def __init__(self, url, device_id, sample_interval=0.25, batch_interval=1.0, seed=None,
+                 raw=False, sample_rate=100, binary=False, token=None):
+        self.url = f"{url.rstrip('/')}{INGEST_PATH}/{device_id}"
+        self.device_id = device_id
+        self.sample_interval = sample_interval
+        self.batch_interval = batch_interval
+        self.raw = raw
+        self.binary = binary
+        self.sample_rate = sample_rate
+        self.sent = 0
+        self.failures = 0
+        self._raw_time = 0.0
+        self._raw_phase = 0.0
+        self._random = random.Random(seed)
+        self._bpm = self._random.uniform(65, 85)
+        self._booted = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+        self._session = requests.Session()
+        if token:
+            self._session.headers["Authorization"] = f"Bearer {token}"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def uptime_ms(self):
+        return int((time.monotonic() - self._booted) * 1000)
+
+    def read_sample(self):
+        """One reading in the /api JSON shape"""
+        self._bpm = min(max(self._bpm + self._random.gauss(0, 1.5), 45), 150)
+        finger = self._random.random() > 0.05
+        return {
+            "heart_rate": {
+                "current_bpm": round(self._bpm) if finger else 0,
+                "average_bpm": round(self._bpm) if finger else 0,
+                "timestamp": self.uptime_ms(),
+            },
+            "sensor": {
+                "ir_value": self._random.randint(60000, 120000) if finger else self._random.randint(800, 1000),
+                "finger_detected": finger,
+            },
+        }
+
+    def read_raw(self, seconds):
+        """Raw IR samples covering the next ``seconds`` of the waveform"""
+        self._bpm = min(max(self._bpm + self._random.gauss(0, 1.5), 45), 150)
+        values = synthetic_ir(self._bpm, seconds, self.sample_rate, start=self._raw_time,
+                              phase=self._raw_phase, rng=self._random.getrandbits(32))
+        elapsed = len(values) / self.sample_rate
+        self._raw_time += elapsed
+        self._raw_phase += 2 * math.pi * self._bpm / 60.0 * elapsed
+        return [int(value) for value in values]
+
+    def send(self, samples=None, raw=None):
+        """POST one batch; returns True if the server accepted it"""
+        if raw is not None:
+            request = {"json": {"raw": {"sample_rate": self.sample_rate, "ir": raw}}}
+        elif self.binary:
+            request = {
+                "data": encode_records(
+                    [s["heart_rate"]["timestamp"] for s in samples],
+                    [s["heart_rate"]["current_bpm"] for s in samples],
+                    [s["heart_rate"]["average_bpm"] for s in samples],
+                    [s["sensor"]["ir_value"] for s in samples],
+                    [s["sensor"]["finger_detected"] for s in samples],
+                    device_time=self.uptime_ms(),
+                ),
+                "headers": {"Content-Type": PACKET_CONTENT_TYPE},
+            }
+        else:
+            request = {"json": {"device_time": self.uptime_ms(), "samples": samples}}
+        try:
+            response = self._session.post(self.url, timeout=3, **request)
+        except requests.exceptions.RequestException:
+            self.failures += 1
+            return False
+        if response.status_code != 200:
+            self.failures += 1
+            return False
+        self.sent += len(samples if raw is None else raw)
+        return True
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._session.close()
+
+    def _run(self):
+        if self.raw:
+            self._run_raw()
+            return
+        batch = []
+        next_sample = next_send = time.monotonic()
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= next_sample:
+                batch.append(self.read_sample())
+                next_sample += self.sample_interval
+            if now >= next_send:
+                # Keep unsent samples for the next batch if the server is down
+                if batch and self.send(batch):
+                    batch = []
+                next_send += self.batch_interval
+            self._stop.wait(max(min(next_sample, next_send) - time.monotonic(), 0))
+
+    def _run_raw(self):
+        next_send = time.monotonic()
+        while not self._stop.is_set():
+            self.send(raw=self.read_raw(self.batch_interval))
+            next_send += self.batch_interval
+            self._stop.wait(max(next_send - time.monotonic(), 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Push fake heart rate samples to an ingest server")
+    parser.add_argument("url", help="Ingest server URL, e.g. http://localhost:8502")
+    parser.add_argument("devices", nargs="+", help="Device IDs to simulate")
+    parser.add_argument("--sample-interval", type=float, default=0.25)
+    parser.add_argument("--batch-interval", type=float, default=1.0)
+    parser.add_argument("--raw", action="store_true",
+                        help="Send raw IR waveforms for beat detection on the server")
+    parser.add_argument("--binary", action="store_true",
+                        help="Send batches as binary sample packets instead of JSON")
+    parser.add_argument("--token", default=os.environ.get("HEART_RATE_INGEST_TOKEN"),
+                        help="Shared token the ingest server expects")
+    args = parser.parse_args()
+
+    fakes = [
+        FakePushDevice(args.url, device_id, args.sample_interval, args.batch_interval,
+                       raw=args.raw, binary=args.binary, token=args.token)
+        for device_id in args.devices
+    ]
+    for fake in fakes:
+        fake.start()
+    try:
+        while True:
+            time.sleep(5)
+            for fake in fakes:
+                print(f"{fake.device_id}: {fake.sent} sent, {fake.failures} failed batches")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for fake in fakes:
+            fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import bisect
+import functools
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Histogram:
+    """Prometheus-style histogram with one set of buckets per label combination"""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def series(self):
+        """``{labels: (bucket counts, sum, count)}`` copied under the lock"""
+        with self._lock:
+            return {key: (list(counts), total, count)
+                    for key, (counts, total, count) in self._series.items()}
+
+    def quantile(self, q, counts):
+        """Estimate a quantile from bucket counts, interpolating within the bucket"""
+        count = sum(counts)
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self.series().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = _labels(self.labels, key, [("le", bound)])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {total!r}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Counter:
+    """Prometheus-style counter per label combination"""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def remove(self, predicate):
+        """Drop every series whose labels match ``predicate(labels)``"""
+        with self._lock:
+            for key in [key for key in self._values if predicate(key)]:
+                del self._values[key]
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_labels(self.labels, key)} {value}")
+        return lines
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_stage", "_started")
+
+    def __init__(self, histogram, stage):
+        self._histogram = histogram
+        self._stage = stage
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started, self._stage)
+        return False
+
+
+class Metrics:
+    """Hot-path latency timers and per-device polling counters.
+
+    ``timer(stage)`` and ``timed(stage)`` feed one latency histogram per
+    pipeline stage (device round trip, JSON decode, statistics, chart,
+    Telegram send, dashboard rerun, ...). Polls are counted per device by
+    outcome, and the age of every device's latest sample is computed when
+    the metrics are read. While ``enabled`` is False every call returns
+    after a single attribute check, so the instrumentation can stay in
+    place permanently.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = Histogram("heartrate_stage_seconds", "Time spent in each pipeline stage",
+                                ("stage",))
+        self.polls = Counter("heartrate_polls_total", "Device polls by outcome",
+                             ("device", "result"))
+        self._last_sample = {}
+
+    def timer(self, stage):
+        """Context manager timing one run of ``stage``"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self.stages, stage)
+
+    def timed(self, stage):
+        """Decorator timing every call of a function as ``stage``"""
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Timer(self.stages, stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def poll_result(self, device, result):
+        """Count a poll of ``device`` as "success", "failure" or "timeout" """
+        if self.enabled:
+            self.polls.inc(device, result)
+
+    def sample_received(self, device):
+        if self.enabled:
+            self._last_sample[device] = time.time()
+
+    def forget(self, device):
+        """Stop reporting a device that is no longer monitored"""
+        self._last_sample.pop(device, None)
+        self.polls.remove(lambda labels: labels[0] == device)
+
+    def sample_ages(self):
+        now = time.time()
+        return {device: now - last for device, last in list(self._last_sample.items())}
+
+    def stage_summary(self):
+        """Rows of stage, count, mean, p50 and p95 (seconds) for display"""
+        rows = []
+        for (stage,), (counts, total, count) in sorted(self.stages.series().items()):
+            rows.append({
+                "stage": stage,
+                "count": count,
+                "mean": total / count if count else None,
+                "p50": self.stages.quantile(0.5, counts),
+                "p95": self.stages.quantile(0.95, counts),
+            })
+        return rows
+
+    def expose(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = self.stages.expose() + self.polls.expose()
+        lines += [
+            "# HELP heartrate_sample_age_seconds Seconds since the latest sample of each device",
+            "# TYPE heartrate_sample_age_seconds gauge",
+        ]
+        for device, age in sorted(self.sample_ages().items()):
+            lines.append(f"heartrate_sample_age_seconds{_labels(('device',), (device,))} {age!r}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide metrics, enabled by the metrics server or HEART_RATE_METRICS=1
+METRICS = Metrics(enabled=os.environ.get("HEART_RATE_METRICS") == "1")
+
+
+class MetricsServer:
+    """Serve ``metrics.expose()`` at ``/metrics`` for Prometheus to scrape"""
+
+    def __init__(self, metrics=METRICS, host="127.0.0.1", port=9464):
+        self.metrics = metrics
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                payload = server.metrics.expose().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """Start serving and turn the metrics on"""
+        self.metrics.enabled = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
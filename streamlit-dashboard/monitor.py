@@ -0,0 +1,353 @@
+import requests
+from datetime import datetime, timedelta
+import json
+import random
+import threading
+
+from adaptive import AdaptivePollSchedule
+from analytics import HeartRateAnalytics, analyze_history
+from history import HeartRateHistory
+from metrics import METRICS
+from packets import (
+    ACCEPT, PacketError, decode_readings, decode_sample, is_packet_response, reading_sample,
+)
+from poller import SamplePoller
+from rules import DEFAULT_THRESHOLDS
+from simulator import FleetSimulator
+from stats import HeartRateStats, summarize
+
+class HeartRateMonitor:
+    def __init__(self):
+        self.history = HeartRateHistory(100)
+        self.stats = HeartRateStats(100)
+        # HRV and anomaly scores, updated with every recorded sample
+        self.analytics = HeartRateAnalytics()
+        self._insights = (None, None, None, None)
+        self.api_url = ""
+        self.use_mock_data = False
+        # Per-patient limits used for the status and health insights
+        self.thresholds = DEFAULT_THRESHOLDS
+        # Optional pooled requests.Session and per-request timeout in seconds
+        self.session = None
+        self.timeout = 3
+        # Adapts the polling rate to activity and backs off from dead devices
+        self.schedule = AdaptivePollSchedule()
+        # Optional store.DeviceStore that persists every recorded sample
+        self.store = None
+        # Optional recording.SessionRecorder that logs every raw response
+        self.recorder = None
+        # Sample timestamps come from here; replays substitute a recorded clock
+        self.clock = datetime.now
+        # Seeds the mock data simulator, seed it for reproducible sessions
+        self.rng = random.Random()
+        self.simulator = None
+        self._simulator_started = None
+        # Names the device in metrics; the hub uses its device key
+        self.name = None
+        # Guards history/stats against the background poller
+        self.lock = threading.RLock()
+        self.poller = None
+        self.latest_data = None
+        self.last_error = None
+        self._listeners = []
+
+    @property
+    def max_history(self):
+        return self.history.capacity
+
+    @max_history.setter
+    def max_history(self, value):
+        with self.lock:
+            if value != self.history.capacity:
+                self.history.resize(value)
+                # Shrinking drops readings the running windows still count
+                current_bpm = self.history.current_bpm()
+                self.stats.rebuild(current_bpm, window=value)
+                self.analytics.rebuild(current_bpm)
+
+    def clear_history(self):
+        with self.lock:
+            self.history.clear()
+            self.stats.reset()
+            self.analytics.reset()
+            self.latest_data = None
+            self.last_error = None
+
+    @METRICS.timed("record")
+    def record_sample(self, data):
+        """Append a sample to the history and update the running statistics"""
+        with self.lock:
+            self.history.append_sample(data)
+            self.stats.update(data['heart_rate']['current_bpm'])
+            self.analytics.update(data)
+        if self.store is not None:
+            self.store.append_sample(data)
+
+    @METRICS.timed("record")
+    def record_readings(self, readings):
+        """Append decoded packet columns (see packets.decode_readings) in bulk"""
+        bpm = readings["current_bpm"].tolist()
+        finger = readings["finger_detected"].tolist()
+        with self.lock:
+            self.history.extend(readings)
+            self.stats.extend(bpm)
+            self.analytics.update_readings(bpm, finger)
+        if self.store is not None:
+            for row in zip(readings["timestamp"].tolist(), bpm, readings["average_bpm"].tolist(),
+                           readings["ir_value"].tolist(), finger):
+                self.store.append(*row)
+
+    def start_polling(self, interval):
+        """Sample in the background every ``interval`` seconds"""
+        if self.poller is None:
+            self.poller = SamplePoller(self.poll, interval, next_delay=self.next_poll_delay)
+        self.poller.set_interval(interval)
+        self.poller.start()
+
+    def stop_polling(self):
+        if self.poller is not None:
+            self.poller.stop()
+
+    def add_listener(self, callback):
+        """Call ``callback(data)`` for every new sample, or the latest of a pushed packet"""
+        self._listeners = self._listeners + [callback]
+
+    def remove_listener(self, callback):
+        self._listeners = [c for c in self._listeners if c is not callback]
+
+    def next_poll_delay(self, interval):
+        """Seconds until the next poll, adapted from the base ``interval``"""
+        return self.schedule.next_delay(interval)
+
+    def poll(self):
+        """Fetch one sample and publish it as the latest snapshot"""
+        self.schedule.before_request()
+        data = self.fetch_data()
+        self.latest_data = data
+        if data is not None:
+            for callback in self._listeners:
+                callback(data)
+
+    def ingest(self, samples):
+        """Record samples pushed by the device itself, oldest first"""
+        if not samples:
+            return
+        for data in samples:
+            self.record_sample(data)
+        self.latest_data = samples[-1]
+        self.last_error = None
+        METRICS.sample_received(self.device_label())
+        for callback in self._listeners:
+            for data in samples:
+                callback(data)
+
+    def ingest_readings(self, readings):
+        """Record a decoded packet pushed by the device itself"""
+        if not len(readings["timestamp"]):
+            return
+        self.record_readings(readings)
+        # Listeners only act on the newest sample, so only it becomes a dict
+        data = reading_sample(readings)
+        data['timestamp'] = datetime.fromtimestamp(float(readings["timestamp"][-1]))
+        self.latest_data = data
+        self.last_error = None
+        METRICS.sample_received(self.device_label())
+        for callback in self._listeners:
+            callback(data)
+
+    def device_label(self):
+        return self.name or ("mock" if self.use_mock_data else self.api_url)
+
+    def set_api_url(self, url):
+        self.api_url = url
+        
+    def set_use_mock_data(self, use_mock):
+        self.use_mock_data = use_mock
+        
+    def generate_mock_data(self):
+        """Generate realistic mock heart rate data for testing"""
+        # One simulated sensor, seeded from self.rng and advanced by the clock
+        now = self.clock().timestamp()
+        if self.simulator is None:
+            self.simulator = FleetSimulator(1, seed=self.rng.getrandbits(64))
+            self._simulator_started = now
+        self.simulator.advance_to(now - self._simulator_started)
+        return self.simulator.sample(0)
+        
+    @METRICS.timed("fetch")
+    def fetch_data(self):
+        # Errors are kept on the monitor rather than shown directly, since
+        # this usually runs on the poller thread outside the Streamlit script
+        if self.use_mock_data:
+            # Generate mock data for testing
+            mock_data = self.generate_mock_data()
+            received = self.clock()
+            if self.recorder is not None:
+                self.recorder.record(200, json.dumps(mock_data), received.timestamp())
+            mock_data['timestamp'] = received
+            self.record_sample(mock_data)
+            self.schedule.record_success(mock_data)
+            self.last_error = None
+            METRICS.poll_result(self.device_label(), "success")
+            METRICS.sample_received(self.device_label())
+            return mock_data
+            
+        if not self.api_url:
+            return None
+            
+        response = None
+        try:
+            http = self.session if self.session is not None else requests
+            timeout = self.schedule.request_timeout(self.timeout)
+            with METRICS.timer("request"):
+                response = http.get(self.api_url, timeout=timeout,
+                                    headers={"Accept": ACCEPT})
+            received = self.clock()
+            if self.recorder is not None:
+                self.recorder.record(response.status_code, response.content, received.timestamp())
+            if response.status_code == 200 and is_packet_response(response):
+                with METRICS.timer("decode"):
+                    single = decode_sample(response.content)
+                    if single is None:
+                        readings = decode_readings(response.content, received.timestamp())
+                if single is not None:
+                    # The usual one-reading poll takes the same path as JSON
+                    age, data = single
+                    data['timestamp'] = received - timedelta(milliseconds=age)
+                    self.record_sample(data)
+                else:
+                    # Batches go straight into the history columns
+                    if not len(readings["timestamp"]):
+                        raise PacketError("Empty sample packet")
+                    self.record_readings(readings)
+                    data = reading_sample(readings)
+                    data['timestamp'] = received
+                self.schedule.record_success(data)
+                self.last_error = None
+                METRICS.poll_result(self.device_label(), "success")
+                METRICS.sample_received(self.device_label())
+                return data
+            elif response.status_code == 200:
+                with METRICS.timer("decode"):
+                    data = response.json()
+                data['timestamp'] = received
+                self.record_sample(data)
+                self.schedule.record_success(data)
+                self.last_error = None
+                METRICS.poll_result(self.device_label(), "success")
+                METRICS.sample_received(self.device_label())
+                return data
+            else:
+                self.schedule.record_failure()
+                self.last_error = f"API returned status code: {response.status_code}"
+                METRICS.poll_result(self.device_label(), "failure")
+                return None
+        except requests.exceptions.RequestException as e:
+            timed_out = isinstance(e, requests.exceptions.Timeout)
+            METRICS.poll_result(self.device_label(), "timeout" if timed_out else "failure")
+            # Responses with unparsable bodies were already recorded above
+            if self.recorder is not None and response is None:
+                self.recorder.record_error(e)
+            self.schedule.record_failure()
+            self.last_error = f"Connection issue: {str(e)}"
+            return None
+        except json.JSONDecodeError:
+            self.schedule.record_failure()
+            METRICS.poll_result(self.device_label(), "failure")
+            self.last_error = "Invalid JSON response from API"
+            return None
+        except PacketError as e:
+            self.schedule.record_failure()
+            METRICS.poll_result(self.device_label(), "failure")
+            self.last_error = f"Invalid sample packet from API: {e}"
+            return None
+    
+    def get_current_status(self):
+        with self.lock:
+            if not len(self.history):
+                return "No data"
+            
+            heart_rate = self.history.current_bpm(1)[0]
+            finger_detected = self.history.finger_detected(1)[0]
+        
+        if not finger_detected:
+            return "No finger detected"
+        elif heart_rate == 0:
+            return "Measuring..."
+        elif heart_rate < self.thresholds.low:
+            return "Low heart rate"
+        elif heart_rate > self.thresholds.high:
+            return "High heart rate"
+        else:
+            return "Normal"
+    
+    def get_heart_rate_trend(self):
+        return self.stats.snapshot().trend
+
+    @METRICS.timed("insights")
+    def generate_health_insights(self, heart_rates=None):
+        """Generate health insights based on heart rate data"""
+        if heart_rates is not None:
+            return self._build_insights(
+                summarize(heart_rates), analyze_history(heart_rates)["snapshot"], self.thresholds
+            )
+
+        # Insights only change when a new sample updates the snapshots
+        with self.lock:
+            snapshot = self.stats.snapshot()
+            analytics = self.analytics.snapshot()
+        # Thresholds can change between samples and alter the insights too
+        thresholds = self.thresholds
+        cached_snapshot, cached_analytics, cached_thresholds, insights = self._insights
+        if (cached_snapshot is not snapshot or cached_analytics is not analytics
+                or cached_thresholds != thresholds):
+            insights = self._build_insights(snapshot, analytics, thresholds)
+            self._insights = (snapshot, analytics, thresholds, insights)
+        return list(insights)
+
+    def _build_insights(self, snapshot, analytics, thresholds):
+        if snapshot.count < 5:
+            return ["Insufficient data for health analysis"]
+
+        insights = []
+        avg_hr = snapshot.mean
+        max_hr = snapshot.max
+        min_hr = snapshot.min
+        hr_std = snapshot.std
+
+        # Overall health assessment
+        if avg_hr < thresholds.low:
+            insights.append("Low average heart rate - may indicate good cardiovascular fitness")
+        elif avg_hr > thresholds.high:
+            insights.append("High average heart rate - consider consulting a healthcare provider")
+        else:
+            insights.append("Normal average heart rate - within healthy range")
+        
+        # Variability assessment
+        if hr_std > 15:
+            insights.append("High heart rate variability - may indicate stress or changing activity levels")
+        else:
+            insights.append("Stable heart rate pattern - consistent activity or rest state")
+        
+        # Extreme values alert
+        if max_hr > thresholds.very_high:
+            insights.append("⚠️ Warning: Detected very high heart rate values")
+        if min_hr < thresholds.very_low:
+            insights.append("⚠️ Warning: Detected very low heart rate values")
+        
+        # Beat-to-beat variability and rhythm
+        if analytics.rmssd is not None:
+            insights.append(
+                f"Heart rate variability: RMSSD {analytics.rmssd:.0f} ms, "
+                f"SDNN {analytics.sdnn:.0f} ms, pNN50 {analytics.pnn50:.0f}%"
+            )
+            if analytics.irregular:
+                insights.append("⚠️ Irregular rhythm detected - beat intervals vary unusually; consider an ECG check")
+            elif analytics.ectopic:
+                insights.append(f"Occasional irregular beats detected ({analytics.ectopic} in the last {analytics.ibi_count})")
+        else:
+            insights.append("Heart rate variability unavailable - needs beat-to-beat intervals from raw IR beat detection")
+        if analytics.anomaly:
+            insights.append("⚠️ Sudden heart rate change - the latest reading is far outside the recent range")
+            
+        return insights
@@ -0,0 +1,510 @@
+import hashlib
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API_URL = "https://api.telegram.org"
+# Telegram rejects longer message texts
+MAX_MESSAGE_LENGTH = 4096
+DIGEST_SEPARATOR = "\n\n──────────\n\n"
+# Delivered or dropped message ids whose outcome is still reported by status()
+MAX_FINISHED_STATUSES = 10_000
+
+AlertTarget = namedtuple("AlertTarget", ["token", "chat_id", "patient_name"])
+
+
+class TokenBucket:
+    """Allow ``rate`` events per second with bursts of up to ``capacity``"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now=None):
+        """Seconds until a token is available (0 if one is available now)"""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def full(self, now=None):
+        """Whether the bucket has refilled, so a fresh one would behave the same"""
+        self.delay(now)
+        return self.tokens >= self.capacity
+
+
+def token_ref(token):
+    """Stable reference to a bot token that can be stored without exposing it"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+
+
+def chat_rate(chat_id):
+    """Telegram's documented limits: 1 msg/s per private chat, 20/min per group"""
+    return 20 / 60 if str(chat_id).startswith("-") else 1.0
+
+
+def build_digest(texts):
+    """Join queued texts into as few messages under Telegram's limit as possible"""
+    texts = [text[:MAX_MESSAGE_LENGTH] for text in texts]
+    digests = []
+    current = []
+    length = 0
+    for text in texts:
+        extra = len(text) + (len(DIGEST_SEPARATOR) if current else 0)
+        if current and length + extra > MAX_MESSAGE_LENGTH:
+            digests.append((len(current), DIGEST_SEPARATOR.join(current)))
+            current, length = [], 0
+            extra = len(text)
+        current.append(text)
+        length += extra
+    if current:
+        digests.append((len(current), DIGEST_SEPARATOR.join(current)))
+    return digests
+
+
+class _Chat:
+    """Messages waiting for one (bot token, chat) pair"""
+
+    def __init__(self, token, chat_id, now):
+        self.token = token
+        self.chat_id = chat_id
+        self.messages = []
+        self.first_queued = now
+        self.next_attempt = now
+        self.attempts = 0
+
+
+class TelegramDispatcher:
+    """Deliver Telegram messages from a background thread.
+
+    ``send`` only enqueues, so callers such as the dashboard never block on
+    the network. The dispatcher thread:
+
+    * coalesces messages queued for the same chat within
+      ``coalesce_window`` seconds into one digest message,
+    * respects per-chat and per-bot token-bucket rate limits and
+      Telegram's ``retry_after`` hints,
+    * retries network errors and 5xx responses with jittered exponential
+      backoff, indefinitely, while dropping messages Telegram rejects,
+    * keeps every undelivered message in ``spool_dir`` (if given) and
+      resends it after a restart.
+
+    Bot tokens are never written to the spool, only a ``token_ref``.
+    Spooled messages are resent once their token is known again, from a
+    new ``send`` or from ``register_token``. The outcome of the last
+    ``MAX_FINISHED_STATUSES`` finished messages is kept for ``status``.
+
+    Point ``api_url`` at a StubTelegramServer to exercise it locally.
+    """
+
+    def __init__(self, api_url=TELEGRAM_API_URL, spool_dir=None, coalesce_window=2.0,
+                 bot_rate=30.0, timeout=10, base_backoff=1.0, max_backoff=300.0):
+        self.api_url = api_url.rstrip("/")
+        self.spool_dir = spool_dir
+        self.coalesce_window = coalesce_window
+        self.bot_rate = bot_rate
+        self.timeout = timeout
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        self.sent = 0
+        self.failed = 0
+        self._status = {}
+        self._finished = {}
+        self._tokens = {}
+        # token_ref -> spooled messages waiting for their bot token
+        self._unclaimed = {}
+        self._ids = itertools.count()
+        self._incoming = queue.Queue()
+        self._chats = {}
+        # (token, chat_id) -> TokenBucket, kept after a chat's queue drains
+        # until it has refilled, so a new burst can't start on a full one
+        self._chat_buckets = {}
+        self._bot_buckets = {}
+        self._idle = threading.Condition()
+        self._stop = threading.Event()
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+            self._load_spool()
+        self._thread = threading.Thread(target=self._run, name="telegram-dispatcher", daemon=True)
+        self._thread.start()
+
+    def send(self, token, chat_id, text):
+        """Queue a message and return its id without waiting for delivery"""
+        self.register_token(token)
+        message = {
+            "id": f"{time.time_ns()}-{next(self._ids)}",
+            "token": token,
+            "chat_id": str(chat_id),
+            "text": text,
+            "created": time.time(),
+        }
+        self._spool(message)
+        self._status[message["id"]] = "queued"
+        self._incoming.put(message)
+        return message["id"]
+
+    def register_token(self, token):
+        """Make a bot token known, resending messages spooled for it before a restart"""
+        ref = token_ref(token)
+        if ref in self._tokens:
+            return
+        self._tokens[ref] = token
+        for message in self._unclaimed.pop(ref, []):
+            message["token"] = token
+            self._incoming.put(message)
+
+    def status(self, message_id):
+        """Return 'queued', 'sent', 'failed' or None for an unknown id"""
+        status = self._status.get(message_id)
+        return status if status is not None else self._finished.get(message_id)
+
+    def pending(self):
+        return self._incoming.qsize() + sum(len(c.messages) for c in list(self._chats.values()))
+
+    def flush(self, timeout=None):
+        """Wait until every queued message has been delivered or dropped"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self.pending():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining if remaining is not None else 0.5)
+        return True
+
+    def stop(self):
+        """Stop the thread; undelivered messages stay in the spool"""
+        self._stop.set()
+        self._incoming.put(None)
+        self._thread.join()
+        self.session.close()
+
+    def _spool_path(self, message_id):
+        return os.path.join(self.spool_dir, message_id + ".json")
+
+    def _spool(self, message):
+        if not self.spool_dir:
+            return
+        path = self._spool_path(message["id"])
+        spooled = dict(message, token_ref=token_ref(message["token"]))
+        del spooled["token"]
+        with open(path + ".tmp", "w", encoding="utf-8") as handle:
+            json.dump(spooled, handle)
+        os.replace(path + ".tmp", path)
+
+    def _unspool(self, messages):
+        if not self.spool_dir:
+            return
+        for message in messages:
+            try:
+                os.remove(self._spool_path(message["id"]))
+            except FileNotFoundError:
+                pass
+
+    def _load_spool(self):
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.spool_dir, name), encoding="utf-8") as handle:
+                    message = json.load(handle)
+            except (OSError, ValueError):
+                logger.warning("Skipping unreadable spooled message %s", name)
+                continue
+            self._status[message["id"]] = "queued"
+            if "token" in message:
+                # Spooled before tokens were kept out of the spool; rewrite it
+                self._spool(message)
+                self.register_token(message["token"])
+                self._incoming.put(message)
+                continue
+            ref = message.pop("token_ref")
+            if ref in self._tokens:
+                message["token"] = self._tokens[ref]
+                self._incoming.put(message)
+            else:
+                self._unclaimed.setdefault(ref, []).append(message)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._accept(self._next_wait())
+            now = time.monotonic()
+            for key, chat in list(self._chats.items()):
+                if now < chat.first_queued + self.coalesce_window or now < chat.next_attempt:
+                    continue
+                chat_bucket = self._chat_buckets.get(key)
+                if chat_bucket is None:
+                    chat_bucket = self._chat_buckets[key] = TokenBucket(chat_rate(chat.chat_id))
+                bot_bucket = self._bot_buckets.setdefault(chat.token, TokenBucket(self.bot_rate))
+                wait = max(chat_bucket.delay(now), bot_bucket.delay(now))
+                if wait > 0:
+                    chat.next_attempt = now + wait
+                    continue
+                chat_bucket.take()
+                bot_bucket.take()
+                self._deliver(key, chat)
+                now = time.monotonic()
+            for key, bucket in list(self._chat_buckets.items()):
+                if key not in self._chats and bucket.full(now):
+                    del self._chat_buckets[key]
+            with self._idle:
+                self._idle.notify_all()
+
+    def _next_wait(self):
+        if not self._chats:
+            return None
+        now = time.monotonic()
+        due = min(
+            max(chat.first_queued + self.coalesce_window, chat.next_attempt)
+            for chat in self._chats.values()
+        )
+        return max(due - now, 0.0)
+
+    def _accept(self, wait):
+        """Move newly queued messages into their chat's pending batch"""
+        try:
+            message = self._incoming.get(timeout=wait)
+        except queue.Empty:
+            return
+        while message is not None:
+            key = (message["token"], message["chat_id"])
+            chat = self._chats.get(key)
+            if chat is None:
+                chat = self._chats[key] = _Chat(message["token"], message["chat_id"], time.monotonic())
+            chat.messages.append(message)
+            try:
+                message = self._incoming.get_nowait()
+            except queue.Empty:
+                message = None
+
+    def _deliver(self, key, chat):
+        count, text = build_digest([m["text"] for m in chat.messages])[0]
+        batch = chat.messages[:count]
+        if count > 1:
+            text = f"📬 {count} queued alerts\n\n" + text
+            text = text[:MAX_MESSAGE_LENGTH]
+
+        retry_after = None
+        try:
+            with METRICS.timer("telegram_send"):
+                response = self.session.post(
+                    f"{self.api_url}/bot{chat.token}/sendMessage",
+                    data={"chat_id": chat.chat_id, "text": text},
+                    timeout=self.timeout,
+                )
+            if response.status_code == 200:
+                outcome = "sent"
+            elif response.status_code == 429 or response.status_code >= 500:
+                outcome = "retry"
+                if response.status_code == 429:
+                    try:
+                        retry_after = response.json()["parameters"]["retry_after"]
+                    except (ValueError, KeyError, TypeError):
+                        pass
+            else:
+                outcome = "failed"
+                logger.warning("Telegram rejected message (%s): %s",
+                               response.status_code, response.text[:200])
+        except requests.exceptions.RequestException as e:
+            outcome = "retry"
+            logger.info("Telegram unreachable, will retry: %s", e)
+
+        if outcome == "retry":
+            chat.attempts += 1
+            backoff = min(self.base_backoff * 2 ** (chat.attempts - 1), self.max_backoff)
+            if retry_after is not None:
+                backoff = max(backoff, float(retry_after))
+            chat.next_attempt = time.monotonic() + backoff * random.uniform(1, 1.5)
+            return
+
+        for message in batch:
+            self._finished[message["id"]] = outcome
+            self._status.pop(message["id"], None)
+        while len(self._finished) > MAX_FINISHED_STATUSES:
+            del self._finished[next(iter(self._finished))]
+        if outcome == "sent":
+            self.sent += len(batch)
+        else:
+            self.failed += len(batch)
+        self._unspool(batch)
+        chat.messages = chat.messages[count:]
+        chat.attempts = 0
+        if not chat.messages:
+            del self._chats[key]
+
+
+def format_alert_message(event, patient_name):
+    """Format a rules.AlertEvent as a Telegram message"""
+    patient = patient_name or "Not specified"
+    when = datetime.fromtimestamp(event.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+    if event.kind == "fired":
+        message = f"🚨 ALERT: {event.rule.name}\n\n"
+        message += f"👤 Patient: {patient}\n"
+        message += f"• Heart Rate: {event.value:g} BPM (limit {event.threshold:g})\n"
+        if event.rule.duration:
+            message += f"• Sustained for at least {event.rule.duration:g} seconds\n"
+    else:
+        message = f"✅ RESOLVED: {event.rule.name}\n\n"
+        message += f"👤 Patient: {patient}\n"
+        message += f"• Heart Rate: {event.value:g} BPM\n"
+    message += f"\n⏰ {when}"
+    return message
+
+
+@METRICS.timed("telegram_report")
+def format_telegram_report(monitor, latest_data, patient_name):
+    """Format the current state as a Telegram report"""
+    if not latest_data:
+        return "No data available for report"
+    
+    # Get current metrics
+    heart_rate = latest_data['heart_rate']['current_bpm']
+    avg_heart_rate = latest_data['heart_rate']['average_bpm']
+    finger_detected = latest_data['sensor']['finger_detected']
+    ir_value = latest_data['sensor']['ir_value']
+    status = monitor.get_current_status()
+    trend = monitor.get_heart_rate_trend()
+    
+    # Get health insights
+    snapshot = monitor.stats.snapshot()
+    analytics = monitor.analytics.snapshot()
+    insights = monitor.generate_health_insights()
+    
+    # Format message
+    message = "❤️ HEART RATE STATUS REPORT ❤️\n\n"
+    message += f"👤 Patient: {patient_name}\n" if patient_name else "👤 Patient: Not specified\n"
+    message += f"📊 Current Status: {status}\n"
+    message += f"📈 Trend: {trend}\n\n"
+    
+    message += "🔢 CURRENT METRICS:\n"
+    message += f"• Heart Rate: {heart_rate if heart_rate > 0 else 'N/A'} BPM\n"
+    message += f"• Average HR: {avg_heart_rate if avg_heart_rate > 0 else 'N/A'} BPM\n"
+    message += f"• Finger Detected: {'Yes' if finger_detected else 'No'}\n"
+    message += f"• IR Sensor Value: {ir_value}\n\n"
+    
+    if snapshot.count > 0:
+        message += "📈 STATISTICS:\n"
+        message += f"• Max HR: {snapshot.max:g} BPM\n"
+        message += f"• Min HR: {snapshot.min:g} BPM\n"
+        message += f"• Data Points: {snapshot.count}\n"
+        message += f"• Variability: {snapshot.std:.2f}\n\n"
+    
+    if analytics.rmssd is not None:
+        message += "💓 HEART RATE VARIABILITY:\n"
+        message += f"• RMSSD: {analytics.rmssd:.0f} ms\n"
+        message += f"• SDNN: {analytics.sdnn:.0f} ms\n"
+        message += f"• pNN50: {analytics.pnn50:.0f}%\n"
+        message += f"• Rhythm: {'Irregular' if analytics.irregular else 'Regular'}\n\n"
+    else:
+        message += "💓 HEART RATE VARIABILITY: unavailable (no beat-to-beat data)\n\n"
+    
+    message += "💡 HEALTH INSIGHTS:\n"
+    for i, insight in enumerate(insights, 1):
+        message += f"{i}. {insight}\n"
+    
+    message += f"\n⏰ Report generated at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+    
+    return message
+
+
+class AlertNotifier:
+    """Send rule events to the Telegram target registered for their stream"""
+
+    def __init__(self, dispatcher, rules=None):
+        self.dispatcher = dispatcher
+        self.rules = rules
+
+    def __call__(self, event):
+        target = self.rules.target(event.stream) if self.rules is not None else None
+        if target is None:
+            return
+        self.dispatcher.send(
+            target.token, target.chat_id, format_alert_message(event, target.patient_name)
+        )
+
+
+class StubTelegramServer:
+    """Local stand-in for the Bot API's sendMessage endpoint, for tests.
+
+    Records every message it receives in ``messages``. Set ``fail_next`` to
+    a list of status codes to answer the next requests with those instead.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.messages = []
+        self.fail_next = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                fields = parse_qs(self.rfile.read(length).decode("utf-8"))
+                self._handle(fields)
+
+            def do_GET(self):
+                self._handle(parse_qs(urlparse(self.path).query))
+
+            def _handle(self, fields):
+                if stub.fail_next:
+                    status = stub.fail_next.pop(0)
+                    body = {"ok": False, "error_code": status}
+                    if status == 429:
+                        body["parameters"] = {"retry_after": 1}
+                else:
+                    status = 200
+                    stub.messages.append({
+                        "token": self.path.split("/")[1][len("bot"):],
+                        "chat_id": fields.get("chat_id", [""])[0],
+                        "text": fields.get("text", [""])[0],
+                    })
+                    body = {"ok": True}
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,174 @@
+"""Compact binary sample format shared with the ESP32 firmware.
+
+A packet is a 12 byte header followed by ``count`` fixed-size records, all
+little-endian:
+
+    header  magic "HRS", version (u8), count (u16), record size (u16),
+            device clock when the packet was built in ms (u32)
+    record  timestamp in device ms (u32), IR value (u32),
+            current BPM x 100 (u16), average BPM (u8), flags (u8, bit 0 =
+            finger detected)
+
+Newer versions may only grow the record, so decoders read the fields they
+know using the record size from the header. Devices serve it when the
+request's Accept header lists ``CONTENT_TYPE``; anything else gets JSON.
+"""
+import functools
+import struct
+
+import numpy as np
+
+CONTENT_TYPE = "application/vnd.heartrate.samples"
+# Sent by the host: binary preferred, JSON from devices that don't support it
+ACCEPT = f"{CONTENT_TYPE}, application/json;q=0.9"
+MAGIC = b"HRS"
+VERSION = 1
+HEADER = struct.Struct("<3sBHHI")
+RECORD_DTYPE = np.dtype([
+    ("timestamp", "<u4"),
+    ("ir_value", "<u4"),
+    ("current_bpm", "<u2"),
+    ("average_bpm", "u1"),
+    ("flags", "u1"),
+])
+# The same version 1 record for struct, used to decode a lone reading
+RECORD = struct.Struct("<IIHBB")
+FINGER_DETECTED = 1
+# Most records in one packet, well within a single device response
+MAX_RECORDS = 4096
+
+
+class PacketError(ValueError):
+    """A body that is not a valid sample packet"""
+
+
+def accepts_packets(accept):
+    """Whether an Accept header value asks for the binary format"""
+    return any(part.split(";")[0].strip() == CONTENT_TYPE for part in (accept or "").split(","))
+
+
+def is_packet_response(response):
+    return response.headers.get("Content-Type", "").split(";")[0].strip() == CONTENT_TYPE
+
+
+def encode_records(timestamp, current_bpm, average_bpm, ir_value, finger_detected,
+                   device_time=None):
+    """Encode columns of readings (device ms timestamps) into one packet"""
+    timestamp = np.atleast_1d(np.asarray(timestamp, dtype=np.int64))
+    records = np.zeros(len(timestamp), dtype=RECORD_DTYPE)
+    records["timestamp"] = timestamp & 0xFFFFFFFF
+    records["ir_value"] = np.clip(ir_value, 0, 0xFFFFFFFF)
+    records["current_bpm"] = np.clip(np.rint(np.asarray(current_bpm, dtype=np.float64) * 100),
+                                     0, 0xFFFF)
+    records["average_bpm"] = np.clip(average_bpm, 0, 0xFF)
+    records["flags"] = np.where(finger_detected, FINGER_DETECTED, 0)
+    if device_time is None:
+        device_time = int(timestamp[-1]) if len(timestamp) else 0
+    header = HEADER.pack(MAGIC, VERSION, len(records), RECORD_DTYPE.itemsize,
+                         device_time & 0xFFFFFFFF)
+    return header + records.tobytes()
+
+
+def encode_sample(data):
+    """Encode one sample in the /api JSON shape"""
+    heart_rate, sensor = data["heart_rate"], data["sensor"]
+    return encode_records(heart_rate["timestamp"], heart_rate["current_bpm"],
+                          heart_rate["average_bpm"], sensor["ir_value"],
+                          sensor["finger_detected"])
+
+
+def _unpack_header(payload):
+    """Validate a packet's header and return ``(device_time, count, record_size)``"""
+    if len(payload) < HEADER.size:
+        raise PacketError("Packet shorter than its header")
+    magic, version, count, record_size, device_time = HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise PacketError("Not a heart rate sample packet")
+    if version < 1 or record_size < RECORD_DTYPE.itemsize:
+        raise PacketError(f"Unsupported packet version {version}")
+    if count > MAX_RECORDS or len(payload) < HEADER.size + count * record_size:
+        raise PacketError("Packet truncated or too large")
+    return device_time, count, record_size
+
+
+def decode_records(payload):
+    """Validate a packet and return ``(device_time, records)``, a view on the payload"""
+    device_time, count, record_size = _unpack_header(payload)
+    records = np.frombuffer(payload, dtype=_record_dtype(record_size), count=count,
+                            offset=HEADER.size)
+    return device_time, records
+
+
+def decode_sample(payload):
+    """Decode a one-reading packet into ``(age_ms, sample)`` without numpy.
+
+    The sample is in the /api JSON shape and ``age_ms`` is how old the
+    reading was when the packet was built. Returns None for packets holding
+    any other number of readings; use decode_readings for those.
+    """
+    device_time, count, _ = _unpack_header(payload)
+    if count != 1:
+        return None
+    timestamp, ir_value, current_bpm, average_bpm, flags = RECORD.unpack_from(
+        payload, HEADER.size)
+    sample = {
+        "heart_rate": {
+            "current_bpm": current_bpm / 100.0,
+            "average_bpm": average_bpm,
+            "timestamp": timestamp,
+        },
+        "sensor": {
+            "ir_value": ir_value,
+            "finger_detected": bool(flags & FINGER_DETECTED),
+        },
+    }
+    return (device_time - timestamp) & 0xFFFFFFFF, sample
+
+
+@functools.lru_cache(maxsize=8)
+def _record_dtype(record_size):
+    """RECORD_DTYPE padded to ``record_size``; later versions append fields"""
+    if record_size == RECORD_DTYPE.itemsize:
+        return RECORD_DTYPE
+    return np.dtype({
+        "names": RECORD_DTYPE.names,
+        "formats": [RECORD_DTYPE.fields[name][0] for name in RECORD_DTYPE.names],
+        "offsets": [RECORD_DTYPE.fields[name][1] for name in RECORD_DTYPE.names],
+        "itemsize": record_size,
+    })
+
+
+def decode_readings(payload, received):
+    """Decode a packet into history columns (see history.HISTORY_FIELDS).
+
+    Device timestamps are milliseconds of uptime; each reading is placed
+    relative to ``received`` (epoch seconds) by its age against the
+    packet's device clock, so a single-sample poll lands exactly at
+    ``received`` like a JSON poll does.
+    """
+    device_time, records = decode_records(payload)
+    age = (device_time - records["timestamp"].astype(np.int64)) & 0xFFFFFFFF
+    columns = {
+        "timestamp": received - age / 1000.0,
+        "current_bpm": records["current_bpm"] / 100.0,
+        "average_bpm": records["average_bpm"].astype(np.float64),
+        "ir_value": records["ir_value"].astype(np.int64),
+        "finger_detected": (records["flags"] & FINGER_DETECTED).astype(bool),
+    }
+    columns["device_ms"] = records["timestamp"].astype(np.int64)
+    return columns
+
+
+def reading_sample(readings, index=-1):
+    """One decoded reading as a sample in the /api JSON shape"""
+    return {
+        "heart_rate": {
+            "current_bpm": float(readings["current_bpm"][index]),
+            "average_bpm": int(readings["average_bpm"][index]),
+            "timestamp": int(readings["device_ms"][index]),
+        },
+        "sensor": {
+            "ir_value": int(readings["ir_value"][index]),
+            "finger_detected": bool(readings["finger_detected"][index]),
+        },
+    }
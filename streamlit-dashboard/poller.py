@@ -0,0 +1,104 @@
+import logging
+import threading
+import time
+import weakref
+
+logger = logging.getLogger(__name__)
+
+
+def _weak_callable(func):
+    """Return a callable that yields ``func``, or None once its owner is gone"""
+    if hasattr(func, "__self__"):
+        return weakref.WeakMethod(func)
+    return lambda: func
+
+
+class SamplePoller:
+    """Call a sampling function on a fixed schedule from a background thread.
+
+    Deadlines are computed from the monotonic clock rather than by sleeping a
+    fixed amount after each call, so the sample rate does not drift with the
+    time the call itself takes. Ticks missed because a call overran are
+    skipped instead of being fired back to back.
+
+    If ``next_delay(interval)`` is given it is asked for the period after
+    every call, which lets the owner speed up, slow down or back off.
+
+    An exception from either call is logged and the schedule carries on, so
+    one bad sample never silently stops polling.
+
+    Only weak references to bound methods are kept, so the thread exits on
+    its own once the owner (e.g. a closed dashboard session) is collected.
+    """
+
+    def __init__(self, sample, interval, next_delay=None):
+        self._sample = _weak_callable(sample)
+        self._next_delay = _weak_callable(next_delay) if next_delay is not None else None
+        self.interval = float(interval)
+        self._stop = None
+        self._wake = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        # A fresh event per thread, so a thread still finishing a slow call
+        # after stop() can never be revived by a later start()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(self._stop,), name="heart-rate-poller", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, wait=False):
+        """Stop sampling; by default without waiting for an in-flight call"""
+        if self._stop is not None:
+            self._stop.set()
+        self._wake.set()
+        if wait and self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def set_interval(self, interval):
+        """Change the period; takes effect from the next tick"""
+        interval = float(interval)
+        if interval != self.interval:
+            self.interval = interval
+            self._wake.set()
+
+    def _run(self, stop):
+        deadline = time.monotonic()
+        while not stop.is_set():
+            sample = self._sample()
+            if sample is None:
+                break
+            try:
+                sample()
+            except Exception:
+                logger.exception("Sampling call failed")
+            del sample
+
+            interval = self.interval
+            if self._next_delay is not None:
+                next_delay = self._next_delay()
+                if next_delay is None:
+                    break
+                try:
+                    interval = next_delay(interval)
+                except Exception:
+                    logger.exception("Poll delay call failed")
+                del next_delay
+            deadline += interval
+            now = time.monotonic()
+            if deadline <= now:
+                if interval > 0:
+                    deadline += ((now - deadline) // interval + 1) * interval
+                else:
+                    deadline = now
+            if self._wake.wait(deadline - now):
+                self._wake.clear()
+                deadline = time.monotonic()
@@ -0,0 +1,186 @@
+import json
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import requests
+
+from packets import CONTENT_TYPE as PACKET_CONTENT_TYPE, MAGIC as PACKET_MAGIC
+
+# File header: magic, format version, recording start (epoch seconds)
+FILE_MAGIC = b"HRREC"
+FILE_VERSION = 1
+_HEADER = struct.Struct("<5sBd")
+# Record header: arrival (epoch seconds), HTTP status, body length
+_RECORD = struct.Struct("<dhI")
+# Status recorded for requests that failed without a response
+CONNECTION_ERROR = -1
+
+Record = namedtuple("Record", ["arrival", "status", "body"])
+
+
+class SessionRecorder:
+    """Append every raw /api response of a device to a compact binary log.
+
+    Each record is a 14 byte header (arrival time, HTTP status, body length)
+    followed by the response body exactly as received, so a replay goes
+    through the same JSON parsing as the live dashboard. Requests that fail
+    without a response are kept with status ``CONNECTION_ERROR`` and the
+    error message as body.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "ab")
+        if new:
+            self._file.write(_HEADER.pack(FILE_MAGIC, FILE_VERSION, time.time()))
+        self.records = 0
+
+    def record(self, status, body, arrival=None):
+        arrival = time.time() if arrival is None else arrival
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(_RECORD.pack(arrival, status, len(body)) + body)
+            self.records += 1
+
+    def record_error(self, error, arrival=None):
+        self.record(CONNECTION_ERROR, str(error), arrival)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_recording(path):
+    """Return the records of a session log, oldest first"""
+    with open(path, "rb") as handle:
+        data = handle.read()
+    if len(data) < _HEADER.size:
+        raise ValueError(f"Not a session recording: {path}")
+    magic, version, _ = _HEADER.unpack_from(data)
+    if magic != FILE_MAGIC:
+        raise ValueError(f"Not a session recording: {path}")
+    if version != FILE_VERSION:
+        raise ValueError(f"Unsupported recording version {version}: {path}")
+
+    records = []
+    offset = _HEADER.size
+    while offset + _RECORD.size <= len(data):
+        arrival, status, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        if offset + length > len(data):
+            # Truncated by a crash while writing the last record
+            break
+        records.append(Record(arrival, status, data[offset:offset + length]))
+        offset += length
+    return records
+
+
+class ReplayResponse:
+    """The parts of requests.Response that HeartRateMonitor.fetch_data uses"""
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        # Recordings keep bodies only; binary sample packets start with their magic
+        content_type = PACKET_CONTENT_TYPE if content[:3] == PACKET_MAGIC else "application/json"
+        self.headers = {"Content-Type": content_type}
+
+    def json(self):
+        return json.loads(self.content.decode("utf-8"))
+
+
+class ReplayClock:
+    """Clock that reads the arrival time of the record being replayed"""
+
+    def __init__(self):
+        self.current = None
+
+    def now(self):
+        return datetime.fromtimestamp(self.current)
+
+
+class ReplaySession:
+    """Stand-in for requests.Session that answers every GET with the next record"""
+
+    def __init__(self, records, clock):
+        self._records = iter(records)
+        self._clock = clock
+
+    def get(self, url, timeout=None, headers=None):
+        record = next(self._records)
+        self._clock.current = record.arrival
+        if record.status == CONNECTION_ERROR:
+            raise requests.exceptions.ConnectionError(record.body.decode("utf-8"))
+        return ReplayResponse(record.status, record.body)
+
+    def close(self):
+        pass
+
+
+class SessionReplayer:
+    """Feed a recorded session back through ``HeartRateMonitor.fetch_data``.
+
+    The monitor's HTTP session and clock are replaced so every poll returns
+    the next recorded response, stamped with its original arrival time;
+    history, statistics, listeners and alert rules see exactly what they
+    saw live. ``speed`` is a multiple of real time (1, 100, ...) or None to
+    replay as fast as possible. ``on_step(monitor, record)`` runs after
+    every replayed response, e.g. to evaluate alert rules deterministically.
+    """
+
+    def __init__(self, path, speed=1.0, on_step=None):
+        self.path = path
+        self.records = read_recording(path)
+        self.speed = speed
+        self.on_step = on_step
+        self.clock = ReplayClock()
+
+    def attach(self, monitor):
+        """Point a monitor at this replay instead of a device"""
+        monitor.use_mock_data = False
+        monitor.api_url = "replay://" + os.path.basename(self.path)
+        monitor.session = ReplaySession(self.records, self.clock)
+        monitor.clock = self.clock.now
+
+    def run(self, monitor, stop=None):
+        """Replay every record into ``monitor``; returns the number replayed"""
+        self.attach(monitor)
+        if not self.records:
+            return 0
+        first = self.records[0].arrival
+        started = time.monotonic()
+        replayed = 0
+        for record in self.records:
+            if stop is not None and stop.is_set():
+                break
+            if self.speed:
+                delay = started + (record.arrival - first) / self.speed - time.monotonic()
+                if delay > 0:
+                    if stop is not None:
+                        stop.wait(delay)
+                    else:
+                        time.sleep(delay)
+            monitor.poll()
+            replayed += 1
+            if self.on_step is not None:
+                self.on_step(monitor, record)
+        return replayed
@@ -0,0 +1,218 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from history import to_local_datetime64
+from rules import DEFAULT_THRESHOLDS
+from store import StoreReader, TimeSeriesStore, device_dirname
+
+# Time-in-range bands, lowest first
+BANDS = ("very_low", "low", "in_range", "high", "very_high")
+# A reading counts for the time until the next one, but never longer than this
+MAX_GAP = 10.0
+# Out-of-range episodes shorter than this are not counted as events
+MIN_EVENT_SECONDS = 30.0
+EXPORT_FORMATS = ("csv", "parquet")
+
+PatientReport = namedtuple(
+    "PatientReport",
+    ["patient", "start", "end", "summary", "time_in_range", "hourly", "daily", "events"],
+)
+
+
+def samples_frame(columns):
+    """Sample columns as returned by DeviceStore.read_range -> DataFrame indexed by local time"""
+    frame = pd.DataFrame(columns)
+    frame.index = pd.DatetimeIndex(to_local_datetime64(columns["timestamp"]), name="time")
+    return frame
+
+
+def classify(current_bpm, thresholds=DEFAULT_THRESHOLDS):
+    """Band index into ``BANDS`` of every reading"""
+    bpm = np.asarray(current_bpm, dtype=np.float64)
+    return np.select(
+        [bpm < thresholds.very_low, bpm < thresholds.low, bpm <= thresholds.high,
+         bpm <= thresholds.very_high],
+        [0, 1, 2, 3],
+        default=4,
+    )
+
+
+def _band_percentages(durations):
+    """Rows of durations per band -> rows of percentages, all bands present"""
+    durations = durations.reindex(columns=list(BANDS), fill_value=0.0)
+    totals = durations.sum(axis=1).replace(0, np.nan)
+    return durations.div(totals, axis=0).mul(100).fillna(0.0)
+
+
+def _aggregate(valid, freq):
+    """Heart rate statistics and time in range per ``freq`` bucket"""
+    grouper = pd.Grouper(freq=freq)
+    stats = valid.groupby(grouper)["current_bpm"].agg(["mean", "min", "max", "std", "count"])
+    stats = stats[stats["count"] > 0]
+    durations = valid.groupby([grouper, "band"], observed=True)["duration"].sum().unstack("band")
+    percentages = _band_percentages(durations).add_suffix("_pct")
+    return stats.join(percentages, how="left")
+
+
+def _events(valid):
+    """Contiguous out-of-range episodes, split wherever readings stop for a while"""
+    columns = ["start", "end", "band", "duration", "readings", "peak_bpm"]
+    if valid.empty:
+        return pd.DataFrame(columns=columns)
+    band = valid["band"]
+    gap = valid["timestamp"].diff() > MAX_GAP
+    run = ((band != band.shift()) | gap).cumsum()
+    runs = valid.groupby(run).agg(
+        start=("timestamp", "first"),
+        end=("timestamp", "last"),
+        band=("band", "first"),
+        duration=("duration", "sum"),
+        readings=("current_bpm", "size"),
+        high=("current_bpm", "max"),
+        low=("current_bpm", "min"),
+    )
+    runs = runs[(runs["band"] != "in_range") & (runs["duration"] >= MIN_EVENT_SECONDS)]
+    runs["peak_bpm"] = runs["high"].where(runs["band"].isin(["high", "very_high"]), runs["low"])
+    for name in ("start", "end"):
+        runs[name] = to_local_datetime64(runs[name].to_numpy())
+    return runs[columns].reset_index(drop=True)
+
+
+def build_report(patient, frame, start, end, thresholds=DEFAULT_THRESHOLDS):
+    """Aggregate one patient's samples (see ``samples_frame``) into a PatientReport"""
+    valid = frame[frame["current_bpm"] > 0].copy()
+    timestamps = valid["timestamp"].to_numpy()
+    durations = np.diff(timestamps, append=timestamps[-1:]) if len(timestamps) else timestamps
+    valid["duration"] = np.minimum(durations, MAX_GAP)
+    valid["band"] = pd.Categorical.from_codes(classify(valid["current_bpm"], thresholds), BANDS)
+
+    time_in_range = _band_percentages(
+        valid.groupby("band", observed=False)["duration"].sum().to_frame().T
+    ).iloc[0]
+    events = _events(valid)
+    bpm = valid["current_bpm"]
+    summary = {
+        "readings": int(len(frame)),
+        "valid_readings": int(len(valid)),
+        "monitored_hours": float(valid["duration"].sum() / 3600),
+        "mean_bpm": float(bpm.mean()) if len(bpm) else None,
+        "min_bpm": float(bpm.min()) if len(bpm) else None,
+        "max_bpm": float(bpm.max()) if len(bpm) else None,
+        "events": events["band"].value_counts().reindex(BANDS, fill_value=0)
+                                 .drop("in_range").astype(int).to_dict(),
+    }
+    return PatientReport(
+        patient=patient,
+        start=start,
+        end=end,
+        summary=summary,
+        time_in_range=time_in_range,
+        hourly=_aggregate(valid, "h"),
+        daily=_aggregate(valid, "D"),
+        events=events,
+    )
+
+
+def export_report(report, out_dir, formats=("csv",)):
+    """Write a report's tables to ``out_dir/<patient>/`` and return the file paths"""
+    directory = os.path.join(out_dir, device_dirname(report.patient))
+    os.makedirs(directory, exist_ok=True)
+    tables = {
+        "hourly": report.hourly,
+        "daily": report.daily,
+        "events": report.events,
+        "time_in_range": report.time_in_range.rename("percent").to_frame(),
+    }
+    paths = []
+    for name, table in tables.items():
+        for fmt in formats:
+            path = os.path.join(directory, f"{name}.{fmt}")
+            if fmt == "csv":
+                table.to_csv(path)
+            elif fmt == "parquet":
+                table.to_parquet(path)
+            else:
+                raise ValueError(f"Unsupported export format: {fmt}")
+            paths.append(path)
+    return paths
+
+
+def format_report_summary(report):
+    """Format a PatientReport as a Telegram message"""
+    summary = report.summary
+    start = datetime.fromtimestamp(report.start).strftime('%Y-%m-%d %H:%M')
+    end = datetime.fromtimestamp(report.end).strftime('%Y-%m-%d %H:%M')
+
+    message = "📋 HEART RATE HISTORY REPORT 📋\n\n"
+    message += f"👤 Patient: {report.patient}\n"
+    message += f"🗓 Period: {start} - {end}\n\n"
+    if not summary["valid_readings"]:
+        message += "No heart rate readings recorded in this period."
+        return message
+
+    message += "🔢 SUMMARY:\n"
+    message += f"• Monitored: {summary['monitored_hours']:.1f} h ({summary['valid_readings']} readings)\n"
+    message += f"• Average HR: {summary['mean_bpm']:.0f} BPM\n"
+    message += f"• Range: {summary['min_bpm']:g} - {summary['max_bpm']:g} BPM\n\n"
+
+    message += "🎯 TIME IN RANGE:\n"
+    labels = {"very_low": "Very low", "low": "Low", "in_range": "In range",
+              "high": "High", "very_high": "Very high"}
+    for band in BANDS:
+        message += f"• {labels[band]}: {report.time_in_range[band]:.1f}%\n"
+
+    events = summary["events"]
+    message += "\n⚠️ EVENTS:\n"
+    if any(events.values()):
+        for band, count in events.items():
+            if count:
+                message += f"• {labels[band]}: {count}\n"
+    else:
+        message += "• None\n"
+    return message
+
+
+def report_patient(root, patient, start, end, thresholds=DEFAULT_THRESHOLDS, out_dir=None,
+                   formats=("csv",)):
+    """Build (and optionally export) the report of one stored patient"""
+    # Read-only, since the dashboard or a worker may be writing the store
+    columns = StoreReader(os.path.join(root, device_dirname(patient))).read_range(start, end)
+    report = build_report(patient, samples_frame(columns), start, end, thresholds)
+    if out_dir is not None:
+        export_report(report, out_dir, formats)
+    return report
+
+
+def _report_job(job):
+    return report_patient(*job)
+
+
+def generate_reports(root, start, end, patients=None, thresholds=DEFAULT_THRESHOLDS,
+                     out_dir=None, formats=("csv",), workers=None):
+    """Build reports for many patients at once, one process per core.
+
+    ``patients`` defaults to every device in the store at ``root``;
+    ``thresholds`` is one HeartRateThresholds or a dict of them by patient.
+    Returns the PatientReports in the order of ``patients``.
+    """
+    for fmt in formats:
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+    if patients is None:
+        patients = TimeSeriesStore(root).devices()
+    jobs = [
+        (root, patient, start, end,
+         thresholds.get(patient, DEFAULT_THRESHOLDS) if isinstance(thresholds, dict) else thresholds,
+         out_dir, formats)
+        for patient in patients
+    ]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) < 2:
+        return [_report_job(job) for job in jobs]
+    with ProcessPoolExecutor(min(workers, len(jobs))) as executor:
+        return list(executor.map(_report_job, jobs, chunksize=max(len(jobs) // (workers * 4), 1)))
@@ -0,0 +1,266 @@
+import re
+import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+from poller import SamplePoller
+
+HeartRateThresholds = namedtuple(
+    "HeartRateThresholds", ["low", "high", "very_low", "very_high"]
+)
+
+DEFAULT_THRESHOLDS = HeartRateThresholds(low=60, high=100, very_low=50, very_high=120)
+
+
+def thresholds_ordered(thresholds):
+    """Whether ``very_low <= low < high <= very_high``, as the alert rules assume"""
+    return thresholds.very_low <= thresholds.low < thresholds.high <= thresholds.very_high
+
+AlertRule = namedtuple(
+    "AlertRule",
+    ["name", "metric", "op", "threshold", "duration", "cooldown", "hysteresis"],
+)
+
+AlertEvent = namedtuple(
+    "AlertEvent", ["stream", "rule", "kind", "value", "threshold", "timestamp"]
+)
+
+# Sample fields a rule can test
+METRICS = ("current_bpm", "average_bpm")
+
+DEFAULT_RULES = (
+    "Very high heart rate: current_bpm > very_high for 30s cooldown 300s hysteresis 5",
+    "Very low heart rate: current_bpm < very_low for 30s cooldown 300s hysteresis 5",
+    "High heart rate: current_bpm > high for 60s cooldown 600s hysteresis 5",
+    "Low heart rate: current_bpm < low for 60s cooldown 600s hysteresis 5",
+)
+
+_RULE_PATTERN = re.compile(
+    r"^\s*(?P<name>[^:]+):\s*(?P<metric>\w+)\s*(?P<op>[<>])\s*(?P<threshold>[\w.]+)"
+    r"(?:\s+for\s+(?P<duration>[\d.]+)\s*s)?"
+    r"(?:\s+cooldown\s+(?P<cooldown>[\d.]+)\s*s)?"
+    r"(?:\s+hysteresis\s+(?P<hysteresis>[\d.]+))?\s*$"
+)
+
+
+def parse_rule(text):
+    """Parse ``"name: metric > threshold [for Ns] [cooldown Ns] [hysteresis N]"``.
+
+    The threshold is a number or the name of a HeartRateThresholds field,
+    which is then looked up per patient.
+    """
+    match = _RULE_PATTERN.match(text)
+    if not match:
+        raise ValueError(f"Invalid alert rule: {text!r}")
+    metric = match["metric"]
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric!r} in alert rule: {text!r}")
+    threshold = match["threshold"]
+    if threshold not in HeartRateThresholds._fields:
+        try:
+            threshold = float(threshold)
+        except ValueError:
+            raise ValueError(f"Unknown threshold {threshold!r} in alert rule: {text!r}")
+    return AlertRule(
+        name=match["name"].strip(),
+        metric=metric,
+        op=match["op"],
+        threshold=threshold,
+        duration=float(match["duration"] or 0),
+        cooldown=float(match["cooldown"] or 0),
+        hysteresis=float(match["hysteresis"] or 0),
+    )
+
+
+class RuleEngine:
+    """Evaluate compiled alert rules over many sample streams at once.
+
+    Rules are compiled once into per-rule arrays, and the state of every
+    (stream, rule) pair lives in 2-D arrays, so each tick is a handful of
+    vectorised NumPy operations regardless of how many streams there are.
+
+    * ``duration``: the condition must hold continuously that long to fire
+    * ``hysteresis``: once active, the alert only resolves after the value
+      moves back past the threshold by this margin
+    * ``cooldown``: minimum seconds between two firings of the same rule
+
+    Readings of zero or less (no finger, still measuring) never satisfy a
+    condition, so they reset pending durations and resolve active alerts.
+
+    Samples are handed in with ``submit`` from any thread and evaluated on
+    the next ``evaluate`` call, which ``start`` runs on a fixed interval.
+    """
+
+    def __init__(self, rules=DEFAULT_RULES, on_event=None):
+        self.rules = [parse_rule(r) if isinstance(r, str) else r for r in rules]
+        self.on_event = on_event
+        self.events = deque(maxlen=200)
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._free = []
+        self._targets = {}
+        # Events produced while submitting, not yet passed to on_event
+        self._backlog = []
+        self._poller = None
+        self._compile()
+        self._allocate(16)
+
+    def _compile(self):
+        rules = self.rules
+        self._metric = np.array([METRICS.index(r.metric) for r in rules], dtype=np.int64)
+        self._sign = np.array([1.0 if r.op == ">" else -1.0 for r in rules])
+        self._duration = np.array([r.duration for r in rules])
+        self._cooldown = np.array([r.cooldown for r in rules])
+        self._hysteresis = np.array([r.hysteresis for r in rules])
+
+    def _allocate(self, capacity):
+        rules = len(self.rules)
+        old = getattr(self, "_capacity", 0)
+
+        def grow(name, fill, dtype=np.float64, width=rules):
+            array = np.full((capacity, width), fill, dtype=dtype)
+            if old:
+                array[:old] = getattr(self, name)
+            setattr(self, name, array)
+
+        grow("_thresholds", np.nan)
+        grow("_since", np.nan)
+        grow("_last_fired", -np.inf)
+        grow("_active", False, dtype=bool)
+        grow("_values", np.nan, width=len(METRICS))
+        pending = np.zeros(capacity, dtype=bool)
+        times = np.zeros(capacity)
+        if old:
+            pending[:old] = self._pending
+            times[:old] = self._times
+        self._pending = pending
+        self._times = times
+        self._free.extend(range(capacity - 1, old - 1, -1))
+        self._capacity = capacity
+
+    def _threshold_row(self, thresholds):
+        return np.array([
+            getattr(thresholds, r.threshold) if isinstance(r.threshold, str) else r.threshold
+            for r in self.rules
+        ], dtype=np.float64)
+
+    def add_stream(self, key, thresholds=DEFAULT_THRESHOLDS, target=None):
+        """Register a stream, or update the thresholds/target of an existing one"""
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                if not self._free:
+                    self._allocate(self._capacity * 2)
+                row = self._rows[key] = self._free.pop()
+                self._since[row] = np.nan
+                self._last_fired[row] = -np.inf
+                self._active[row] = False
+                self._pending[row] = False
+            self._thresholds[row] = self._threshold_row(thresholds)
+            self._targets[key] = target
+
+    def remove_stream(self, key):
+        with self._lock:
+            row = self._rows.pop(key, None)
+            if row is not None:
+                self._targets.pop(key, None)
+                self._thresholds[row] = np.nan
+                self._pending[row] = False
+                self._free.append(row)
+
+    def target(self, key):
+        return self._targets.get(key)
+
+    def submit(self, key, data, timestamp=None):
+        """Queue the latest sample of a stream for the next evaluation"""
+        if timestamp is None:
+            timestamp = data.get("timestamp")
+            timestamp = timestamp.timestamp() if timestamp is not None else time.time()
+        heart_rate = data["heart_rate"]
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                return
+            if self._pending[row]:
+                # Evaluate the sample already waiting before overwriting it
+                self._backlog.extend(self._evaluate_locked())
+            self._values[row] = [heart_rate[metric] for metric in METRICS]
+            self._times[row] = timestamp
+            self._pending[row] = True
+
+    def active_alerts(self, key):
+        """Names of the rules currently active for a stream"""
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                return []
+            return [rule.name for rule, active in zip(self.rules, self._active[row]) if active]
+
+    def evaluate(self):
+        """Evaluate every pending sample and return the resulting events"""
+        with self._lock:
+            events = self._backlog + self._evaluate_locked()
+            self._backlog = []
+        if self.on_event is not None:
+            for event in events:
+                self.on_event(event)
+        return events
+
+    def _evaluate_locked(self):
+        rows = np.flatnonzero(self._pending)
+        if not len(rows):
+            return []
+        self._pending[rows] = False
+
+        values = self._values[rows][:, self._metric]
+        now = self._times[rows][:, None]
+        thresholds = self._thresholds[rows]
+        sign = self._sign
+        valid = values > 0
+
+        # Signed so that "beyond the threshold" is always a positive margin
+        margin = (values - thresholds) * sign
+        triggered = valid & (margin > 0)
+        held = valid & (margin > -self._hysteresis)
+
+        since = self._since[rows]
+        since = np.where(triggered, np.where(np.isnan(since), now, since), np.nan)
+        sustained = triggered & (now - since >= self._duration)
+
+        was_active = self._active[rows]
+        last_fired = self._last_fired[rows]
+        fired = sustained & ~was_active & (now - last_fired >= self._cooldown)
+        active = np.where(was_active, held, fired)
+        resolved = was_active & ~active
+
+        self._since[rows] = since
+        self._active[rows] = active
+        self._last_fired[rows] = np.where(fired, now, last_fired)
+
+        events = []
+        if fired.any() or resolved.any():
+            keys = {row: key for key, row in self._rows.items()}
+            for kind, mask in (("fired", fired), ("resolved", resolved)):
+                for i, r in zip(*np.nonzero(mask)):
+                    events.append(AlertEvent(
+                        stream=keys[rows[i]],
+                        rule=self.rules[r],
+                        kind=kind,
+                        value=float(values[i, r]),
+                        threshold=float(thresholds[i, r]),
+                        timestamp=float(now[i, 0]),
+                    ))
+            self.events.extend(events)
+        return events
+
+    def start(self, interval=1.0):
+        """Evaluate pending samples every ``interval`` seconds in the background"""
+        if self._poller is None:
+            self._poller = SamplePoller(self.evaluate, interval)
+        self._poller.start()
+
+    def stop(self):
+        if self._poller is not None:
+            self._poller.stop()
@@ -0,0 +1,760 @@
+import bisect
+import functools
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import types
+import time
+import weakref
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from fleet import DEFAULT_TIMEOUT, DEFAULT_WORKERS
+from hub import DEFAULT_HISTORY, DEFAULT_INTERVAL, MOCK_DEVICE_KEY
+from poller import SamplePoller
+from rules import DEFAULT_THRESHOLDS
+from store import DEFAULT_FLUSH_INTERVAL, StoreReader, device_dirname
+
+logger = logging.getLogger(__name__)
+
+# Points per worker on the hash ring; more spreads devices more evenly
+DEFAULT_REPLICAS = 64
+# Snapshot slots in shared memory, i.e. the most devices at once
+DEFAULT_CAPACITY = 4096
+# Seconds between liveness checks of the worker processes
+SUPERVISE_INTERVAL = 0.5
+# Seconds between re-publishing the error state of failing devices
+ERROR_PUBLISH_INTERVAL = 1.0
+# Seconds a reader retries a slot that stays mid-write before giving up
+READ_TIMEOUT = 0.1
+# Seconds a watched device's owner buffers appended rows before writing
+# them to the store, i.e. how far a single-device view can lag behind
+WATCH_FLUSH_INTERVAL = 0.5
+# Seconds of stored rows a newly watched device's view starts with
+WATCH_BACKFILL = 600
+
+STATUSES = ("No data", "No finger detected", "Measuring...", "Low heart rate",
+            "High heart rate", "Normal")
+TRENDS = ("No trend data", "Insufficient data", "Rising", "Falling", "Stable")
+
+# Snapshot flags
+HAS_SAMPLE = 1
+HAS_ERROR = 2
+PAUSED = 4
+
+# One fixed-size record per device. ``seq`` is a sequence lock: odd while
+# the owning worker is writing, so readers retry instead of seeing a torn
+# record
+SNAPSHOT_DTYPE = np.dtype([
+    ("seq", np.uint32),
+    ("flags", np.uint8),
+    ("status", np.uint8),
+    ("trend", np.uint8),
+    ("received", np.float64),
+    ("current_bpm", np.float64),
+    ("average_bpm", np.float64),
+    ("ir_value", np.int64),
+    ("finger_detected", np.bool_),
+    ("count", np.uint32),
+    ("mean", np.float64),
+    ("std", np.float64),
+    ("min", np.float64),
+    ("max", np.float64),
+], align=True)
+
+ShardSnapshot = namedtuple(
+    "ShardSnapshot",
+    ["key", "worker", "status", "trend", "received", "current_bpm", "average_bpm", "ir_value",
+     "finger_detected", "count", "mean", "std", "min", "max", "error", "paused"],
+)
+
+
+def _hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of device keys onto workers.
+
+    Every worker owns ``replicas`` points on a 64-bit ring and a key
+    belongs to the first point at or after its hash, so adding or removing
+    a worker only moves the keys of the ring segments it gains or loses.
+    """
+
+    def __init__(self, nodes=(), replicas=DEFAULT_REPLICAS):
+        self.replicas = replicas
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(set(self._owners))
+
+    def add(self, node):
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            index = bisect.bisect_left(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node):
+        keep = [i for i, owner in enumerate(self._owners) if owner != node]
+        self._points = [self._points[i] for i in keep]
+        self._owners = [self._owners[i] for i in keep]
+
+    def node_for(self, key):
+        if not self._points:
+            raise LookupError("The hash ring has no nodes")
+        index = bisect.bisect_left(self._points, _hash(key))
+        return self._owners[index % len(self._owners)]
+
+
+def snapshot_table(shm, capacity):
+    return np.ndarray((capacity,), dtype=SNAPSHOT_DTYPE, buffer=shm.buf)
+
+
+def write_snapshot(table, slot, monitor):
+    """Publish a monitor's latest state into its slot (owning worker only)"""
+    # The monitor lock also keeps the poller and error publishing from
+    # writing the same record at once
+    with monitor.lock:
+        _write_record(table[slot], monitor)
+
+
+def _write_record(record, monitor):
+    data = monitor.latest_data
+    snapshot = monitor.stats.snapshot()
+    status = monitor.get_current_status()
+    flags = (HAS_SAMPLE if data else 0) | (HAS_ERROR if monitor.last_error else 0)
+    if monitor.schedule.state == "open":
+        flags |= PAUSED
+
+    record["seq"] += 1
+    record["flags"] = flags
+    record["status"] = STATUSES.index(status) if status in STATUSES else 0
+    record["trend"] = TRENDS.index(snapshot.trend) if snapshot.trend in TRENDS else 0
+    if data:
+        timestamp = data.get("timestamp")
+        record["received"] = timestamp.timestamp() if timestamp is not None else time.time()
+        record["current_bpm"] = data["heart_rate"]["current_bpm"]
+        record["average_bpm"] = data["heart_rate"]["average_bpm"]
+        record["ir_value"] = data["sensor"]["ir_value"]
+        record["finger_detected"] = data["sensor"]["finger_detected"]
+    record["count"] = snapshot.count
+    record["mean"] = snapshot.mean
+    record["std"] = snapshot.std
+    record["min"] = snapshot.min if snapshot.min is not None else 0.0
+    record["max"] = snapshot.max if snapshot.max is not None else 0.0
+    record["seq"] += 1
+
+
+def read_snapshot(table, slot, timeout=READ_TIMEOUT):
+    """Consistent copy of a slot's record, retrying while it is being written.
+
+    Returns None if no consistent copy could be made within ``timeout``
+    seconds, e.g. because the writer died halfway through a write.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        seq = int(table["seq"][slot])
+        if seq % 2 == 0:
+            record = table[slot].copy()
+            if int(table["seq"][slot]) == seq:
+                return record
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(0)
+
+
+def _run_shard(worker, shm_name, capacity, commands, events, max_workers, timeout, data_dir):
+    """Entry point of a worker process: poll the devices of one shard.
+
+    The devices run through a hub.DeviceHub of the worker's own, so with a
+    ``data_dir`` their samples are persisted and checked against the alert
+    rules exactly as in a single process.
+    """
+    from hub import DeviceHub
+    from recording import SessionRecorder
+
+    store = rules = dispatcher = None
+    if data_dir is not None:
+        from notifier import AlertNotifier, TelegramDispatcher
+        from rules import RuleEngine
+        from store import TimeSeriesStore
+
+        store = TimeSeriesStore(data_dir)
+        # One spool per worker, so no two workers resend the same messages
+        dispatcher = TelegramDispatcher(
+            spool_dir=os.path.join(data_dir, "telegram_outbox", f"shard-{worker}")
+        )
+        if os.environ.get("TELEGRAM_BOT_TOKEN"):
+            dispatcher.register_token(os.environ["TELEGRAM_BOT_TOKEN"])
+        rules = RuleEngine()
+        rules.on_event = AlertNotifier(dispatcher, rules)
+        rules.start(1.0)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    table = snapshot_table(shm, capacity)
+    hub = DeviceHub(max_workers=max_workers, timeout=timeout, store=store, rules=rules)
+    # key -> (subscription, slot, snapshot listener)
+    devices = {}
+    # Keys of a single-device view -> active alerts last reported for them
+    watched = {}
+    next_errors = time.monotonic()
+
+    def publish(data, key, slot, monitor):
+        write_snapshot(table, slot, monitor)
+        # The view reads samples from the store; only alert changes are sent
+        if key in watched:
+            active = hub.active_alerts(key)
+            if active != watched[key]:
+                watched[key] = active
+                events.put(("alerts", worker, (key, active)))
+
+    try:
+        while True:
+            try:
+                command = commands.get(timeout=ERROR_PUBLISH_INTERVAL)
+            except queue.Empty:
+                command = None
+            if command is not None:
+                action, key = command[0], command[1]
+                if action == "stop":
+                    break
+                if action == "add":
+                    _, _, slot, interval, max_history = command
+                    if key in devices:
+                        devices[key][0].configure(interval=interval)
+                        continue
+                    subscription = hub.subscribe(key, key == MOCK_DEVICE_KEY, interval=interval,
+                                                 max_history=max_history, receive_samples=False)
+                    monitor = subscription.monitor
+                    listener = functools.partial(publish, key=key, slot=slot, monitor=monitor)
+                    monitor.add_listener(listener)
+                    devices[key] = (subscription, slot, listener)
+                elif action == "remove" and key in devices:
+                    subscription, slot, listener = devices.pop(key)
+                    watched.pop(key, None)
+                    _close_device(subscription, listener)
+                    if store is not None:
+                        # The device's new owner writes the store from now on
+                        store.forget(key)
+                    events.put(("removed", worker, slot))
+                elif action == "alerts" and key in devices:
+                    _, _, thresholds, target = command
+                    hub.configure_alerts(key, thresholds, target)
+                    if target is not None and dispatcher is not None:
+                        dispatcher.register_token(target.token)
+                elif action == "watch" and key in devices:
+                    if command[2]:
+                        watched[key] = None
+                    else:
+                        watched.pop(key, None)
+                    if store is not None:
+                        store.device(key).flush_interval = (
+                            WATCH_FLUSH_INTERVAL if command[2] else DEFAULT_FLUSH_INTERVAL
+                        )
+                elif action == "record" and key in devices:
+                    monitor = devices[key][0].monitor
+                    if monitor.recorder is not None:
+                        recorder, monitor.recorder = monitor.recorder, None
+                        recorder.close()
+                    if command[2] is not None:
+                        monitor.recorder = SessionRecorder(command[2])
+            if time.monotonic() >= next_errors:
+                for subscription, slot, _ in list(devices.values()):
+                    monitor = subscription.monitor
+                    if monitor.last_error or monitor.schedule.state == "open":
+                        write_snapshot(table, slot, monitor)
+                next_errors = time.monotonic() + ERROR_PUBLISH_INTERVAL
+    finally:
+        for subscription, _, listener in devices.values():
+            _close_device(subscription, listener)
+        hub.poller.stop()
+        if rules is not None:
+            rules.stop()
+            dispatcher.flush(timeout=5)
+            dispatcher.stop()
+            store.close()
+        del table
+        shm.close()
+
+
+def _close_device(subscription, listener):
+    monitor = subscription.monitor
+    monitor.remove_listener(listener)
+    if monitor.recorder is not None:
+        recorder, monitor.recorder = monitor.recorder, None
+        recorder.close()
+    subscription.close()
+
+
+class _Device:
+    __slots__ = ("key", "max_history", "worker", "slot", "preferences", "watchers", "follower",
+                 "alerts", "recording", "active_alerts")
+
+    def __init__(self, key, max_history):
+        self.key = key
+        self.max_history = max_history
+        self.worker = None
+        self.slot = None
+        # subscriber token -> poll interval it asked for
+        self.preferences = {}
+        # subscriber token -> callback receiving the device's new stored rows
+        self.watchers = {}
+        # _StoreFollower reading those rows while anyone watches
+        self.follower = None
+        # (thresholds, notifier.AlertTarget) sent to whichever worker owns it
+        self.alerts = None
+        # Session log path the owner records raw responses to, if any
+        self.recording = None
+        # Active alerts of the owner's rule engine, as last reported by it
+        self.active_alerts = []
+
+    @property
+    def interval(self):
+        return min(self.preferences.values())
+
+
+class ShardSubscription:
+    """A handle on one device polled by a ShardedIngest.
+
+    Released automatically when garbage collected, like hub.Subscription.
+    """
+
+    def __init__(self, ingest, key, token):
+        self.key = key
+        self.token = token
+        self._ingest = ingest
+        self._finalizer = weakref.finalize(self, ingest._release, key, token)
+
+    @property
+    def closed(self):
+        return not self._finalizer.alive
+
+    def snapshot(self):
+        return self._ingest.snapshot(self.key)
+
+    def configure(self, interval):
+        """Record this subscriber's poll interval; the device uses the shortest"""
+        self._ingest._configure(self.key, self.token, interval)
+
+    def watch(self, callback):
+        """Call ``callback(readings)`` in this process with the device's new samples.
+
+        ``readings`` are history columns as packets.decode_readings returns,
+        read from the store the owner writes, so this needs a ``data_dir``.
+        Equal callbacks of several subscribers, e.g. the ``ingest_readings``
+        method of one shared monitor, are called once per batch.
+        """
+        self._ingest._watch(self.key, self.token, callback)
+
+    def close(self):
+        self._finalizer()
+
+
+class _StoreFollower:
+    """Hand the rows an owner appends to a device's store to its watchers"""
+
+    def __init__(self, ingest, key, reader, interval):
+        self.key = key
+        self.reader = reader
+        self._ingest = ingest
+        self._since = time.time() - WATCH_BACKFILL
+        self.poller = SamplePoller(self.poll, interval)
+
+    def poll(self):
+        readings = self.reader.read_range(self._since, np.inf)
+        if not len(readings["timestamp"]):
+            return
+        self._since = np.nextafter(readings["timestamp"][-1], np.inf)
+        # The store keeps no device clock; epoch milliseconds stand in for it
+        readings["device_ms"] = (readings["timestamp"] * 1000).astype(np.int64)
+        for callback in self._ingest._watchers(self.key):
+            try:
+                callback(readings)
+            except Exception:
+                logger.exception("Relaying samples of %s failed", self.key)
+
+
+class ShardedIngest:
+    """Poll devices from a pool of worker processes instead of the UI process.
+
+    Device keys (API URLs, or ``hub.MOCK_DEVICE_KEY``) are sharded across
+    workers by consistent hashing; each worker runs a fleet.FleetPoller
+    over its own HeartRateMonitors, so JSON decoding, history and
+    statistics use every core instead of competing with the dashboard
+    under one GIL. Workers publish a fixed-size snapshot of every device
+    (latest sample, status, trend and running statistics) into one shared
+    memory table that ``snapshot`` reads without any pickling.
+
+    Each worker runs its devices through a hub.DeviceHub, so with a
+    ``data_dir`` samples are persisted to a store.TimeSeriesStore there and
+    checked against the alert rules set with ``configure_alerts``. A
+    single-device view subscribes with ``watch`` and follows the rows the
+    owner appends to that store instead of polling the device a second
+    time; only changes of the active alerts travel through a queue.
+
+    When a worker is added, or dies and is replaced, the ring moves only
+    the devices whose ring segment changed owner. A moved device starts a
+    fresh in-memory history on its new worker; its last snapshot is carried
+    over until the first new sample arrives.
+    """
+
+    def __init__(self, workers=None, capacity=DEFAULT_CAPACITY, replicas=DEFAULT_REPLICAS,
+                 max_workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, respawn=True,
+                 data_dir=None):
+        self.capacity = capacity
+        self.data_dir = data_dir
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.respawn = respawn
+        self._initial_workers = workers or os.cpu_count() or 1
+        self._context = multiprocessing.get_context("spawn")
+        self._ring = HashRing(replicas=replicas)
+        self._lock = threading.RLock()
+        self._workers = {}
+        self._devices = {}
+        self._free_slots = list(range(capacity - 1, -1, -1))
+        self._ids = itertools.count()
+        self._tokens = itertools.count()
+        self._events = self._context.Queue()
+        self._shm = None
+        self._table = None
+        self._stop = threading.Event()
+        self._supervisor = threading.Thread(target=self._supervise, name="shard-supervisor",
+                                            daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._shm = shared_memory.SharedMemory(create=True,
+                                               size=self.capacity * SNAPSHOT_DTYPE.itemsize)
+        self._table = snapshot_table(self._shm, self.capacity)
+        self._table[:] = 0
+        for _ in range(self._initial_workers):
+            self.add_worker()
+        self._supervisor.start()
+
+    def workers(self):
+        """IDs of the live workers"""
+        with self._lock:
+            return sorted(self._workers)
+
+    def owner(self, key):
+        with self._lock:
+            device = self._devices.get(key)
+            return device.worker if device is not None else None
+
+    def subscribe(self, key, interval=DEFAULT_INTERVAL, max_history=DEFAULT_HISTORY):
+        """Start polling a device, or share it if it already is polled"""
+        with self._lock:
+            token = next(self._tokens)
+            device = self._devices.get(key)
+            if device is None:
+                device = self._devices[key] = _Device(key, max_history)
+                device.preferences[token] = interval
+                self._assign(device, self._ring.node_for(key))
+            else:
+                self._set_preference(device, token, interval)
+        return ShardSubscription(self, key, token)
+
+    def snapshot(self, key):
+        """Latest ShardSnapshot of a device, or None when it isn't polled"""
+        with self._lock:
+            device = self._devices.get(key)
+            if device is None or device.slot is None:
+                return None
+            slot, worker = device.slot, device.worker
+        record = read_snapshot(self._table, slot)
+        if record is None:
+            return ShardSnapshot(key, worker, "No data", "No trend data", None, None, None, None,
+                                 None, 0, None, None, None, None, True, False)
+        if not record["flags"] & HAS_SAMPLE and not record["flags"] & HAS_ERROR:
+            return ShardSnapshot(key, worker, "No data", "No trend data", None, None, None, None,
+                                 None, 0, None, None, None, None, False, False)
+        sample = bool(record["flags"] & HAS_SAMPLE)
+        count = int(record["count"])
+        return ShardSnapshot(
+            key=key,
+            worker=worker,
+            status=STATUSES[record["status"]],
+            trend=TRENDS[record["trend"]],
+            received=float(record["received"]) if sample else None,
+            current_bpm=float(record["current_bpm"]) if sample else None,
+            average_bpm=float(record["average_bpm"]) if sample else None,
+            ir_value=int(record["ir_value"]) if sample else None,
+            finger_detected=bool(record["finger_detected"]) if sample else None,
+            count=count,
+            mean=float(record["mean"]) if count else None,
+            std=float(record["std"]) if count else None,
+            min=float(record["min"]) if count else None,
+            max=float(record["max"]) if count else None,
+            error=bool(record["flags"] & HAS_ERROR),
+            paused=bool(record["flags"] & PAUSED),
+        )
+
+    def snapshots(self):
+        with self._lock:
+            keys = list(self._devices)
+        return {key: self.snapshot(key) for key in keys}
+
+    def configure_alerts(self, key, thresholds, target=None):
+        """Set a device's thresholds and where its owner sends automatic alerts"""
+        with self._lock:
+            device = self._devices.get(key)
+            if device is None:
+                return
+            device.alerts = (thresholds, target)
+            if device.worker in self._workers:
+                self._send(device.worker, ("alerts", key, thresholds, target))
+
+    def alert_settings(self, key):
+        """Return a device's ``(thresholds, alert target)``"""
+        with self._lock:
+            device = self._devices.get(key)
+            if device is None or device.alerts is None:
+                return DEFAULT_THRESHOLDS, None
+            return device.alerts
+
+    def active_alerts(self, key):
+        """Active alerts of a watched device, as of its latest relayed sample"""
+        with self._lock:
+            device = self._devices.get(key)
+            return list(device.active_alerts) if device is not None else []
+
+    def record(self, key, path):
+        """Have the owner record a device's raw responses to ``path`` (None stops)"""
+        with self._lock:
+            device = self._devices.get(key)
+            if device is None:
+                return
+            device.recording = path
+            if device.worker in self._workers:
+                self._send(device.worker, ("record", key, path))
+
+    def recording(self, key):
+        with self._lock:
+            device = self._devices.get(key)
+            return device.recording if device is not None else None
+
+    def add_worker(self):
+        """Start another worker process and move its share of devices to it"""
+        with self._lock:
+            worker = next(self._ids)
+            commands = self._context.Queue()
+            process = self._context.Process(
+                target=_run_shard, name=f"shard-{worker}", daemon=True,
+                args=(worker, self._shm.name, self.capacity, commands, self._events,
+                      self.max_workers, self.timeout, self.data_dir),
+            )
+            self._start_process(process)
+            self._workers[worker] = (process, commands)
+            self._ring.add(worker)
+            self._rebalance()
+            return worker
+
+    def stop_worker(self, worker):
+        """Stop a worker gracefully, handing its devices to the others"""
+        with self._lock:
+            if worker not in self._workers or len(self._workers) == 1:
+                return False
+            self._ring.remove(worker)
+            self._rebalance()
+            process, commands = self._workers.pop(worker)
+            commands.put(("stop", None))
+        process.join(5)
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._supervisor.is_alive():
+            self._supervisor.join()
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers.clear()
+            for device in self._devices.values():
+                if device.follower is not None:
+                    device.follower.poller.stop()
+                    device.follower = None
+        for _, commands in workers:
+            commands.put(("stop", None))
+        for process, _ in workers:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        if self._shm is not None:
+            self._table = None
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def _configure(self, key, token, interval):
+        with self._lock:
+            device = self._devices.get(key)
+            if device is not None and token in device.preferences:
+                self._set_preference(device, token, interval)
+
+    def _set_preference(self, device, token, interval):
+        previous = device.interval if device.preferences else None
+        device.preferences[token] = interval
+        if device.follower is not None:
+            device.follower.poller.set_interval(device.interval)
+        if device.interval != previous and device.worker in self._workers:
+            self._send(device.worker, ("add", device.key, device.slot, device.interval,
+                                       device.max_history))
+
+    def _release(self, key, token):
+        with self._lock:
+            device = self._devices.get(key)
+            if device is None or token not in device.preferences:
+                return
+            previous = device.interval
+            del device.preferences[token]
+            if device.watchers.pop(token, None) is not None and not device.watchers:
+                if device.follower is not None:
+                    device.follower.poller.stop()
+                    device.follower = None
+                if device.worker in self._workers:
+                    self._send(device.worker, ("watch", key, False))
+            if not device.preferences:
+                del self._devices[key]
+                self._unassign(device)
+                return
+            if device.follower is not None:
+                device.follower.poller.set_interval(device.interval)
+            if device.interval != previous and device.worker in self._workers:
+                self._send(device.worker, ("add", key, device.slot, device.interval,
+                                           device.max_history))
+
+    def _watch(self, key, token, callback):
+        if self.data_dir is None:
+            raise RuntimeError("Watching a device needs a data_dir to read its samples from")
+        with self._lock:
+            device = self._devices.get(key)
+            if device is None or token not in device.preferences:
+                return
+            first = not device.watchers
+            device.watchers[token] = callback
+            if first:
+                reader = StoreReader(os.path.join(self.data_dir, device_dirname(key)))
+                device.follower = _StoreFollower(self, key, reader, device.interval)
+                device.follower.poller.start()
+                if device.worker in self._workers:
+                    self._send(device.worker, ("watch", key, True))
+
+    def _watchers(self, key):
+        with self._lock:
+            device = self._devices.get(key)
+            if device is None:
+                return []
+            return list(dict.fromkeys(device.watchers.values()))
+
+    def _start_process(self, process):
+        # A spawned process re-imports the parent's main script first, which
+        # under Streamlit is the whole dashboard; workers only need this module
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = types.ModuleType("__main__")
+        try:
+            process.start()
+        finally:
+            sys.modules["__main__"] = main
+
+    def _send(self, worker, command):
+        self._workers[worker][1].put(command)
+
+    def _assign(self, device, worker):
+        if not self._free_slots:
+            raise RuntimeError(f"All {self.capacity} snapshot slots are in use")
+        slot = self._free_slots.pop()
+        record = None
+        if device.slot is not None:
+            # Carry the last snapshot over until the new owner publishes one
+            record = read_snapshot(self._table, device.slot)
+        if record is not None:
+            self._table[slot] = record
+        else:
+            self._table[slot] = 0
+        device.worker, device.slot = worker, slot
+        self._send(worker, ("add", device.key, slot, device.interval, device.max_history))
+        # The new owner starts from scratch; hand it the device's settings
+        if device.alerts is not None:
+            self._send(worker, ("alerts", device.key) + device.alerts)
+        if device.watchers:
+            self._send(worker, ("watch", device.key, True))
+        if device.recording is not None:
+            self._send(worker, ("record", device.key, device.recording))
+
+    def _unassign(self, device):
+        """Stop the owner polling a device; its slot is freed once the owner confirms"""
+        if device.worker in self._workers:
+            self._send(device.worker, ("remove", device.key))
+        elif device.slot is not None:
+            self._free_slots.append(device.slot)
+
+    def _rebalance(self):
+        for device in self._devices.values():
+            owner = self._ring.node_for(device.key)
+            if owner != device.worker:
+                self._unassign(device)
+                self._assign(device, owner)
+
+    def _supervise(self):
+        next_check = time.monotonic() + SUPERVISE_INTERVAL
+        while not self._stop.is_set():
+            try:
+                event = self._events.get(timeout=max(next_check - time.monotonic(), 0))
+            except queue.Empty:
+                event = None
+            if event is not None:
+                self._handle_event(*event)
+            if time.monotonic() >= next_check:
+                self._replace_dead_workers()
+                next_check = time.monotonic() + SUPERVISE_INTERVAL
+
+    def _handle_event(self, event, worker, payload):
+        if event == "removed":
+            with self._lock:
+                self._free_slots.append(payload)
+        elif event == "alerts":
+            key, active_alerts = payload
+            with self._lock:
+                device = self._devices.get(key)
+                # Late reports from a previous owner are dropped
+                if device is not None and device.worker == worker:
+                    device.active_alerts = active_alerts
+
+    def _replace_dead_workers(self):
+        with self._lock:
+            dead = [worker for worker, (process, _) in self._workers.items()
+                    if not process.is_alive()]
+            for worker in dead:
+                del self._workers[worker]
+                self._ring.remove(worker)
+                for device in self._devices.values():
+                    if device.worker == worker:
+                        device.worker = None
+                        # Killed mid-write, the record is torn and its
+                        # seq stays odd for good since there is no
+                        # writer left; drop it rather than carry it over
+                        if device.slot is not None and self._table["seq"][device.slot] % 2:
+                            self._table[device.slot] = 0
+            if dead and (self.respawn or not self._workers):
+                # Each new worker rebalances, picking up the orphaned devices
+                for _ in dead:
+                    self.add_worker()
+            elif dead:
+                self._rebalance()
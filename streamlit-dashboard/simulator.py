@@ -0,0 +1,223 @@
+import json
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from packets import CONTENT_TYPE as PACKET_CONTENT_TYPE, accepts_packets, encode_sample
+
+# Beat rates kept for the average, as RATE_SIZE on the ESP32
+RATE_SIZE = 4
+
+# Mean seconds between the start of two episodes of each kind, per device
+EXERCISE_EVERY = 1800.0
+DROPOUT_EVERY = 600.0
+ARRHYTHMIA_EVERY = 3600.0
+
+Readings = namedtuple(
+    "Readings", ["timestamp", "current_bpm", "average_bpm", "ir_value", "finger_detected"]
+)
+
+
+class FleetSimulator:
+    """Seeded, vectorised simulator of many MAX30102 heart rate sensors.
+
+    Every device has its own resting rate with slow random drift
+    (an Ornstein-Uhlenbeck process), plus independent episodes of:
+
+    * exercise: the rate climbs towards resting + 20..70 BPM and recovers
+    * dropouts: the finger leaves the sensor for a few seconds
+    * arrhythmia: beat-to-beat intervals become highly irregular
+
+    All devices advance together in steps of ``interval`` seconds using a
+    few NumPy operations per step, so thousands of devices are cheap. The
+    readings follow the ESP32 firmware: BPM of the last beat, an integer
+    average of the last ``RATE_SIZE`` beats, and zeros without a finger.
+    The same seed and number of steps always give the same readings.
+    """
+
+    def __init__(self, devices=1, seed=None, interval=1.0):
+        self.devices = devices
+        self.interval = interval
+        self.elapsed = 0.0
+        self._rng = rng = np.random.default_rng(seed)
+
+        self.resting = rng.normal(70, 8, devices).clip(50, 95)
+        self._drift = np.zeros(devices)
+        self._exercise_left = np.zeros(devices)
+        self._exercise_target = np.zeros(devices)
+        self._exercise_level = np.zeros(devices)
+        self._dropout_left = np.zeros(devices)
+        self._arrhythmia_left = np.zeros(devices)
+        self._ir_level = rng.uniform(70000, 140000, devices)
+        # Devices booted at different times, like millis() on real sensors
+        self._boot_ms = rng.integers(0, 3_600_000, devices)
+        # Sensors have been running a while, so the beat average starts full
+        self._rates = np.repeat(np.floor(self.resting)[:, None], RATE_SIZE, axis=1)
+        self._rate_spot = 0
+        self.step(0)
+
+    def _episodes(self, left, every, dt, low, high):
+        """Count down running episodes and start new ones; returns the starters"""
+        rng = self._rng
+        left -= dt
+        np.maximum(left, 0, out=left)
+        start = (left == 0) & (rng.random(self.devices) < dt / every)
+        left[start] = rng.uniform(low, high, int(start.sum()))
+        return start
+
+    def step(self, dt=None):
+        """Advance every device by ``dt`` seconds and return the new Readings"""
+        dt = self.interval if dt is None else dt
+        rng = self._rng
+        n = self.devices
+        self.elapsed += dt
+
+        # Slow drift of the resting rate, mean-reverting over ~10 minutes
+        theta = 1 / 600
+        self._drift += -theta * self._drift * dt + 2.0 * np.sqrt(dt / 60) * rng.standard_normal(n)
+
+        started = self._episodes(self._exercise_left, EXERCISE_EVERY, dt, 120, 900)
+        self._exercise_target[started] = rng.uniform(20, 70, int(started.sum()))
+        target = np.where(self._exercise_left > 0, self._exercise_target, 0.0)
+        self._exercise_level += (target - self._exercise_level) * (1 - np.exp(-dt / 45))
+
+        self._episodes(self._dropout_left, DROPOUT_EVERY, dt, 2, 20)
+        self._episodes(self._arrhythmia_left, ARRHYTHMIA_EVERY, dt, 30, 300)
+
+        rate = self.resting + self._drift + self._exercise_level
+        jitter = np.where(self._arrhythmia_left > 0, 0.25, 0.03)
+        beat = (rate * (1 + jitter * rng.standard_normal(n))).clip(30, 220)
+
+        finger = self._dropout_left == 0
+        ir = np.where(
+            finger,
+            self._ir_level + rng.normal(0, 1500, n),
+            rng.uniform(800, 1000, n),
+        ).astype(np.int64)
+
+        # The firmware clears its beat history whenever the finger is lost
+        self._rates[~finger] = 0
+        self._rates[:, self._rate_spot] = np.where(finger, np.floor(beat), 0)
+        self._rate_spot = (self._rate_spot + 1) % RATE_SIZE
+        average = np.floor(self._rates.mean(axis=1))
+
+        self._readings = Readings(
+            timestamp=self._boot_ms + int(self.elapsed * 1000),
+            current_bpm=np.where(finger, np.round(beat, 2), 0.0),
+            average_bpm=average.astype(np.int64),
+            ir_value=ir,
+            finger_detected=finger,
+        )
+        return self._readings
+
+    def advance_to(self, elapsed):
+        """Take whole steps until ``elapsed`` seconds of simulated time have passed"""
+        steps = int((elapsed - self.elapsed) / self.interval)
+        for _ in range(max(steps, 0)):
+            self.step()
+        return self._readings
+
+    def readings(self):
+        return self._readings
+
+    def run(self, seconds):
+        """Simulate ``seconds`` ahead and return every field as a (steps, devices) array"""
+        steps = [self.step() for _ in range(int(seconds / self.interval))]
+        return Readings(*(np.stack(column) for column in zip(*steps)))
+
+    def sample(self, device=0):
+        """Latest reading of one device in the ESP32 /api JSON shape"""
+        readings = self._readings
+        return {
+            "heart_rate": {
+                "current_bpm": float(readings.current_bpm[device]),
+                "average_bpm": int(readings.average_bpm[device]),
+                "timestamp": int(readings.timestamp[device]),
+            },
+            "sensor": {
+                "ir_value": int(readings.ir_value[device]),
+                "finger_detected": bool(readings.finger_detected[device]),
+            },
+        }
+
+
+class _FleetHTTPServer(ThreadingHTTPServer):
+    # Concurrent polls of a large fleet overflow the default backlog of 5,
+    # and every dropped connection then waits out a one second SYN retry
+    request_queue_size = 256
+
+
+class SimulatorServer:
+    """Serve a FleetSimulator over HTTP in the ESP32 /api JSON format.
+
+    Device ``i`` answers at ``/<i>/api``, and device 0 also at ``/api``,
+    so a single simulated sensor looks exactly like the real one. The
+    simulator advances with wall-clock time as requests come in. Like the
+    firmware, requests accepting the binary format (see packets.py) get a
+    packet instead of JSON unless ``binary`` is False.
+    """
+
+    def __init__(self, simulator, host="127.0.0.1", port=0, binary=True):
+        self.simulator = simulator
+        self.binary = binary
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._offset = simulator.elapsed
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parts = self.path.split("?")[0].strip("/").split("/")
+                device = 0
+                if len(parts) == 2 and parts[0].isdigit():
+                    device = int(parts[0])
+                    parts = parts[1:]
+                if parts != ["api"] or device >= server.simulator.devices:
+                    self._reply(404, b'{"error":"Not found"}')
+                    return
+                sample = server.sample(device)
+                if server.binary and accepts_packets(self.headers.get("Accept")):
+                    self._reply(200, encode_sample(sample), PACKET_CONTENT_TYPE)
+                else:
+                    self._reply(200, json.dumps(sample).encode("utf-8"))
+
+            def _reply(self, status, payload, content_type="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = _FleetHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def sample(self, device):
+        with self._lock:
+            self.simulator.advance_to(self._offset + time.monotonic() - self._started)
+            return self.simulator.sample(device)
+
+    def urls(self):
+        """API URL of every simulated device"""
+        return [f"{self.url}/{i}/api" for i in range(self.simulator.devices)]
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
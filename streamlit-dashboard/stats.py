@@ -0,0 +1,161 @@
+import math
+from collections import deque, namedtuple
+
+import numpy as np
+
+# Number of most recent samples compared by the trend indicator
+TREND_WINDOW = 5
+# BPM change between the ends of the trend window that counts as rising/falling
+TREND_THRESHOLD = 5
+
+StatsSnapshot = namedtuple(
+    "StatsSnapshot",
+    ["samples", "count", "mean", "std", "min", "max", "latest", "trend"],
+)
+
+EMPTY_SNAPSHOT = StatsSnapshot(0, 0, 0.0, 0.0, None, None, None, "No trend data")
+
+
+def trend_between(first, last):
+    if last > first + TREND_THRESHOLD:
+        return "Rising"
+    elif last < first - TREND_THRESHOLD:
+        return "Falling"
+    else:
+        return "Stable"
+
+
+def summarize(heart_rates):
+    """Build a snapshot from an array of valid heart rates in one pass"""
+    heart_rates = np.asarray(heart_rates, dtype=np.float64)
+    if not len(heart_rates):
+        return EMPTY_SNAPSHOT
+    trend = "Insufficient data"
+    if len(heart_rates) >= 2:
+        trend = trend_between(heart_rates[0], heart_rates[-1])
+    return StatsSnapshot(
+        samples=len(heart_rates),
+        count=len(heart_rates),
+        mean=float(heart_rates.mean()),
+        std=float(heart_rates.std()),
+        min=float(heart_rates.min()),
+        max=float(heart_rates.max()),
+        latest=float(heart_rates[-1]),
+        trend=trend,
+    )
+
+
+class HeartRateStats:
+    """Streaming statistics over the last ``window`` samples.
+
+    Only readings above zero contribute. Mean and variance are kept with
+    Welford's method (with removal on eviction) and min/max with monotonic
+    deques, so each sample costs amortised O(1) and ``snapshot()`` is free.
+    """
+
+    def __init__(self, window=100):
+        self.window = int(window)
+        self.reset()
+
+    def reset(self):
+        self._seq = 0
+        self._valid = deque()
+        self._max = deque()
+        self._min = deque()
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._snapshot = EMPTY_SNAPSHOT
+
+    def rebuild(self, heart_rates, window=None):
+        """Reset and replay the given readings, e.g. after a window resize"""
+        if window is not None:
+            self.window = int(window)
+        self.reset()
+        for bpm in np.asarray(heart_rates, dtype=np.float64)[-self.window:]:
+            self._push(bpm)
+        self._refresh()
+
+    def update(self, bpm):
+        """Ingest one reading and refresh the cached snapshot"""
+        self._push(float(bpm))
+        self._refresh()
+        return self._snapshot
+
+    def extend(self, heart_rates):
+        """Ingest readings oldest first, refreshing the snapshot once"""
+        for bpm in heart_rates:
+            self._push(float(bpm))
+        self._refresh()
+        return self._snapshot
+
+    def snapshot(self):
+        return self._snapshot
+
+    def _push(self, bpm):
+        seq = self._seq
+        self._seq += 1
+
+        oldest = seq - self.window
+        while self._valid and self._valid[0][0] <= oldest:
+            self._remove(self._valid.popleft()[1])
+        while self._max and self._max[0][0] <= oldest:
+            self._max.popleft()
+        while self._min and self._min[0][0] <= oldest:
+            self._min.popleft()
+
+        if bpm <= 0:
+            return
+
+        self._valid.append((seq, bpm))
+        count = len(self._valid)
+        delta = bpm - self._mean
+        self._mean += delta / count
+        self._m2 += delta * (bpm - self._mean)
+
+        while self._max and self._max[-1][1] <= bpm:
+            self._max.pop()
+        self._max.append((seq, bpm))
+        while self._min and self._min[-1][1] >= bpm:
+            self._min.pop()
+        self._min.append((seq, bpm))
+
+    def _remove(self, bpm):
+        count = len(self._valid)
+        if count == 0:
+            self._mean = 0.0
+            self._m2 = 0.0
+            return
+        delta = bpm - self._mean
+        self._mean -= delta / count
+        self._m2 = max(self._m2 - delta * (bpm - self._mean), 0.0)
+
+    def _trend(self):
+        if self._seq < 2:
+            return "No trend data"
+        recent = self._seq - TREND_WINDOW
+        rates = []
+        for seq, bpm in reversed(self._valid):
+            if seq < recent:
+                break
+            rates.append(bpm)
+        if len(rates) < 2:
+            return "Insufficient data"
+        return trend_between(rates[-1], rates[0])
+
+    def _refresh(self):
+        count = len(self._valid)
+        if not count:
+            self._snapshot = EMPTY_SNAPSHOT._replace(
+                samples=min(self._seq, self.window), trend=self._trend()
+            )
+            return
+        self._snapshot = StatsSnapshot(
+            samples=min(self._seq, self.window),
+            count=count,
+            mean=self._mean,
+            std=math.sqrt(self._m2 / count),
+            min=self._min[0][1],
+            max=self._max[0][1],
+            latest=self._valid[-1][1],
+            trend=self._trend(),
+        )
@@ -0,0 +1,489 @@
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from history import HISTORY_FIELDS
+
+# Rollup resolutions in seconds, finest first
+ROLLUP_RESOLUTIONS = (1, 60, 3600)
+
+ROLLUP_DTYPE = np.dtype([
+    ("start", np.float64),
+    ("min", np.float64),
+    ("max", np.float64),
+    ("mean", np.float64),
+    ("count", np.int64),
+])
+
+# Open rollup buckets saved on flush, so a restart carries them over;
+# ``rows`` is the length of the rollup file the bucket will be appended to
+OPEN_BUCKET_DTYPE = np.dtype(
+    [("resolution", np.int64), ("rows", np.int64)] + ROLLUP_DTYPE.descr
+)
+
+DEFAULT_SEGMENT_SECONDS = 3600
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+
+def device_dirname(device_id):
+    """Turn an API URL or patient name into a safe directory name"""
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", device_id).strip("_") or "device"
+
+
+def _column_path(segment_dir, name):
+    return os.path.join(segment_dir, name + ".bin")
+
+
+def _truncate_rows(path, itemsize, rows=None):
+    """Cut a column file to ``rows`` whole rows (default: drop a torn last row)"""
+    if not os.path.exists(path):
+        return
+    size = os.path.getsize(path)
+    if rows is None:
+        rows = size // itemsize
+    if size != rows * itemsize:
+        os.truncate(path, rows * itemsize)
+
+
+def _memmap(path, dtype):
+    """Memory-map the whole rows of a column file, or return an empty array if it has none"""
+    dtype = np.dtype(dtype)
+    rows = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+    if not rows:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(rows,))
+
+
+def merge_rollups(rows):
+    """Combine rows that share a bucket start, e.g. across a process restart"""
+    if len(rows) < 2:
+        return rows
+    rows = np.sort(rows, order="start", kind="stable")
+    starts, first = np.unique(rows["start"], return_index=True)
+    if len(starts) == len(rows):
+        return rows
+    merged = np.empty(len(starts), dtype=ROLLUP_DTYPE)
+    merged["start"] = starts
+    merged["min"] = np.minimum.reduceat(rows["min"], first)
+    merged["max"] = np.maximum.reduceat(rows["max"], first)
+    counts = np.add.reduceat(rows["count"], first)
+    merged["mean"] = np.add.reduceat(rows["mean"] * rows["count"], first) / counts
+    merged["count"] = counts
+    return merged
+
+
+class _RollupBucket:
+    """Running min/max/sum/count of one open rollup bucket"""
+
+    __slots__ = ("start", "min", "max", "total", "count")
+
+    def __init__(self, start, value):
+        self.start = start
+        self.min = value
+        self.max = value
+        self.total = value
+        self.count = 1
+
+    @classmethod
+    def from_row(cls, row):
+        bucket = cls(float(row["start"]), float(row["min"]))
+        bucket.max = float(row["max"])
+        bucket.total = float(row["mean"]) * int(row["count"])
+        bucket.count = int(row["count"])
+        return bucket
+
+    def add(self, value):
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.total += value
+        self.count += 1
+
+    def row(self):
+        return (self.start, self.min, self.max, self.total / self.count, self.count)
+
+
+class StoreReader:
+    """Read-only view of a device directory, safe while another process writes it.
+
+    Segments and rollups are memory-mapped as they are on disk; nothing is
+    ever created, truncated or rewritten. The writer's open rollup buckets
+    are taken from what it saved at its last flush, so the newest bucket
+    can lag the writer by up to its flush interval.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._raw_dir = os.path.join(path, "raw")
+
+    def _rollup_path(self, resolution):
+        return os.path.join(self.path, f"rollup_{resolution}s.bin")
+
+    def _buckets_path(self):
+        return os.path.join(self.path, "open_buckets.bin")
+
+    def _saved_buckets(self):
+        """Open buckets saved by the writer's last flush, as rows by resolution"""
+        try:
+            with open(self._buckets_path(), "rb") as handle:
+                payload = handle.read()
+        except FileNotFoundError:
+            return {}
+        if len(payload) % OPEN_BUCKET_DTYPE.itemsize:
+            return {}
+        rows = np.frombuffer(payload, dtype=OPEN_BUCKET_DTYPE)
+        return {
+            int(row["resolution"]): row for row in rows
+            if int(row["resolution"]) in ROLLUP_RESOLUTIONS and row["count"] > 0
+        }
+
+    def _pending(self, resolution):
+        """``(bucket row or None, rollup rows it follows)`` for an open bucket"""
+        row = self._saved_buckets().get(resolution)
+        if row is None:
+            return None, None
+        pending = np.array([tuple(row[name] for name in ROLLUP_DTYPE.names)], dtype=ROLLUP_DTYPE)
+        return pending, int(row["rows"])
+
+    def _segments(self):
+        """Return ``(start, directory)`` for every segment, oldest first"""
+        if not os.path.isdir(self._raw_dir):
+            return []
+        segments = []
+        for name in os.listdir(self._raw_dir):
+            if name.isdigit():
+                segments.append((int(name), os.path.join(self._raw_dir, name)))
+        segments.sort()
+        return segments
+
+    def time_bounds(self):
+        """Return the ``(first, last)`` stored timestamps, or None if empty"""
+        segments = self._segments()
+        first = last = None
+        for _, segment_dir in segments:
+            timestamps = _memmap(_column_path(segment_dir, "timestamp"), np.float64)
+            if len(timestamps):
+                first = float(timestamps[0])
+                break
+        for _, segment_dir in reversed(segments):
+            timestamps = _memmap(_column_path(segment_dir, "timestamp"), np.float64)
+            if len(timestamps):
+                last = float(timestamps[-1])
+                break
+        if first is None:
+            return None
+        return first, last
+
+    def read_range(self, start, end):
+        """Return the raw columns with ``start <= timestamp < end`` as arrays"""
+        segments = self._segments()
+        parts = {name: [] for name, _ in HISTORY_FIELDS}
+        for i, (segment_start, segment_dir) in enumerate(segments):
+            segment_end = segments[i + 1][0] if i + 1 < len(segments) else np.inf
+            if segment_end <= start or segment_start >= end:
+                continue
+            columns = {
+                name: _memmap(_column_path(segment_dir, name), dtype)
+                for name, dtype in HISTORY_FIELDS
+            }
+            # Columns are written one after another, and a crash can leave
+            # them at different lengths; trust the shortest
+            length = min(len(column) for column in columns.values())
+            timestamps = columns["timestamp"][:length]
+            lo, hi = np.searchsorted(timestamps, [start, end])
+            if lo == hi:
+                continue
+            for name, column in columns.items():
+                parts[name].append(np.array(column[lo:hi]))
+
+        return {
+            name: np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype=dtype)
+            for name, dtype in HISTORY_FIELDS
+        }
+
+    def read_rollup(self, resolution, start, end):
+        """Return rollup rows of one resolution whose bucket starts in ``[start, end)``"""
+        if resolution not in ROLLUP_RESOLUTIONS:
+            raise ValueError(f"Unsupported rollup resolution: {resolution}")
+        # The open bucket before the rows: if the writer closes it in between,
+        # the rollup file has grown past ``follows`` and the row is in there
+        pending, follows = self._pending(resolution)
+        rows = _memmap(self._rollup_path(resolution), ROLLUP_DTYPE)
+        if follows is not None and len(rows) > follows:
+            pending = None
+
+        starts = rows["start"]
+        lo, hi = np.searchsorted(starts, [start, end])
+        rows = np.array(rows[lo:hi])
+        if pending is not None and start <= pending["start"][0] < end:
+            rows = np.concatenate([rows, pending])
+        return merge_rollups(rows)
+
+    def read_auto(self, start, end, max_points=2000):
+        """Read a range at the finest rollup resolution that fits ``max_points``"""
+        span = max(end - start, 0)
+        for res in ROLLUP_RESOLUTIONS:
+            if span / res <= max_points:
+                return res, self.read_rollup(res, start, end)
+        res = ROLLUP_RESOLUTIONS[-1]
+        return res, self.read_rollup(res, start, end)
+
+
+class DeviceStore(StoreReader):
+    """Append-only columnar sample store for one device or patient.
+
+    Raw samples go into segment directories holding one flat binary file per
+    column, rotated every ``segment_seconds``. Reads memory-map only the
+    segments overlapping the requested range and binary-search their
+    timestamps, so opening a range never loads whole files into memory.
+
+    Heart rate rollups (min/max/mean/count of readings above zero) are kept
+    at every resolution in ``ROLLUP_RESOLUTIONS`` as samples arrive, so long
+    ranges can be served without touching raw samples at all. Open buckets
+    are saved on every flush and picked up again when the store is reopened.
+
+    Reads rely on timestamps only ever increasing, so a sample older than
+    the last one appended is dropped and counted in ``dropped``.
+    """
+
+    def __init__(self, path, segment_seconds=DEFAULT_SEGMENT_SECONDS,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        super().__init__(path)
+        self.segment_seconds = segment_seconds
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        os.makedirs(self._raw_dir, exist_ok=True)
+        self._segment_start = None
+        self._columns = {}
+        for res in ROLLUP_RESOLUTIONS:
+            _truncate_rows(self._rollup_path(res), ROLLUP_DTYPE.itemsize)
+        self._rollup_files = {
+            res: open(self._rollup_path(res), "ab") for res in ROLLUP_RESOLUTIONS
+        }
+        self._rollup_rows = {
+            res: os.path.getsize(self._rollup_path(res)) // ROLLUP_DTYPE.itemsize
+            for res in ROLLUP_RESOLUTIONS
+        }
+        self._buckets = self._load_buckets()
+        self._last_flush = time.monotonic()
+        bounds = StoreReader.time_bounds(self)
+        self._last_timestamp = bounds[1] if bounds is not None else -np.inf
+        self.dropped = 0
+
+    def _load_buckets(self):
+        """Restore the open buckets saved by the last flush"""
+        buckets = dict.fromkeys(ROLLUP_RESOLUTIONS)
+        for res, row in self._saved_buckets().items():
+            # A bucket closed into its rollup file before a crash is in there
+            if self._rollup_rows[res] > row["rows"]:
+                continue
+            buckets[res] = _RollupBucket.from_row(row)
+        return buckets
+
+    def _save_buckets(self):
+        rows = [
+            (res, self._rollup_rows[res]) + bucket.row()
+            for res, bucket in self._buckets.items() if bucket is not None
+        ]
+        path = self._buckets_path()
+        if not rows:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as handle:
+            handle.write(np.array(rows, dtype=OPEN_BUCKET_DTYPE).tobytes())
+        os.replace(tmp_path, path)
+
+    def _open_segment(self, timestamp):
+        self._close_segment()
+        start = int(timestamp // self.segment_seconds * self.segment_seconds)
+        segment_dir = os.path.join(self._raw_dir, f"{start:012d}")
+        os.makedirs(segment_dir, exist_ok=True)
+        # Columns are buffered separately, so a crash can leave them at
+        # different lengths; cut them back to the rows every column has
+        paths = {name: _column_path(segment_dir, name) for name, _ in HISTORY_FIELDS}
+        rows = min(
+            os.path.getsize(paths[name]) // np.dtype(dtype).itemsize
+            if os.path.exists(paths[name]) else 0
+            for name, dtype in HISTORY_FIELDS
+        )
+        for name, dtype in HISTORY_FIELDS:
+            _truncate_rows(paths[name], np.dtype(dtype).itemsize, rows)
+        self._segment_start = start
+        self._columns = {
+            name: open(_column_path(segment_dir, name), "ab") for name, _ in HISTORY_FIELDS
+        }
+
+    def _close_segment(self):
+        for handle in self._columns.values():
+            handle.close()
+        self._columns = {}
+        self._segment_start = None
+
+    def append(self, timestamp, current_bpm, average_bpm, ir_value, finger_detected):
+        with self._lock:
+            if not self._rollup_files:
+                # Closed or detached; a poll finishing late must not reopen
+                # files another writer may own by now
+                return
+            if timestamp < self._last_timestamp:
+                self.dropped += 1
+                return
+            self._last_timestamp = timestamp
+            if (self._segment_start is None
+                    or timestamp >= self._segment_start + self.segment_seconds):
+                self._open_segment(timestamp)
+
+            values = (timestamp, current_bpm, average_bpm, ir_value, finger_detected)
+            for (name, dtype), value in zip(HISTORY_FIELDS, values):
+                self._columns[name].write(np.array(value, dtype=dtype).tobytes())
+
+            if current_bpm > 0:
+                self._update_rollups(timestamp, float(current_bpm))
+
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def append_sample(self, data, timestamp=None):
+        """Append a sample in the device /api JSON shape"""
+        if timestamp is None:
+            timestamp = data.get("timestamp", datetime.now())
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        self.append(
+            timestamp,
+            data["heart_rate"]["current_bpm"],
+            data["heart_rate"]["average_bpm"],
+            data["sensor"]["ir_value"],
+            data["sensor"]["finger_detected"],
+        )
+
+    def _update_rollups(self, timestamp, bpm):
+        for res in ROLLUP_RESOLUTIONS:
+            start = timestamp // res * res
+            bucket = self._buckets[res]
+            if bucket is not None and bucket.start == start:
+                bucket.add(bpm)
+                continue
+            if bucket is not None:
+                row = np.array([bucket.row()], dtype=ROLLUP_DTYPE)
+                self._rollup_files[res].write(row.tobytes())
+                self._rollup_rows[res] += 1
+            self._buckets[res] = _RollupBucket(start, bpm)
+
+    def flush(self):
+        with self._lock:
+            for handle in self._columns.values():
+                handle.flush()
+            for handle in self._rollup_files.values():
+                handle.flush()
+            if self._rollup_files:
+                self._save_buckets()
+            self._last_flush = time.monotonic()
+
+    def close(self):
+        """Write out open rollup buckets and close all files"""
+        with self._lock:
+            for res, bucket in self._buckets.items():
+                if bucket is not None:
+                    row = np.array([bucket.row()], dtype=ROLLUP_DTYPE)
+                    self._rollup_files[res].write(row.tobytes())
+                    self._rollup_rows[res] += 1
+            self._buckets = dict.fromkeys(ROLLUP_RESOLUTIONS)
+            self._close_segment()
+            for handle in self._rollup_files.values():
+                handle.close()
+            self._rollup_files = {}
+            self._save_buckets()
+
+    def detach(self):
+        """Flush and close all files, leaving the open buckets saved for the next writer"""
+        with self._lock:
+            self.flush()
+            self._close_segment()
+            for handle in self._rollup_files.values():
+                handle.close()
+            self._rollup_files = {}
+
+    def _pending(self, resolution):
+        bucket = self._buckets[resolution]
+        if bucket is None:
+            return None, None
+        return np.array([bucket.row()], dtype=ROLLUP_DTYPE), None
+
+    def time_bounds(self):
+        with self._lock:
+            self.flush()
+        return super().time_bounds()
+
+    def read_range(self, start, end):
+        with self._lock:
+            self.flush()
+        return super().read_range(start, end)
+
+    def read_rollup(self, resolution, start, end):
+        # Under the lock, so the open bucket can't be closed into the file
+        # between reading one and the other
+        with self._lock:
+            self.flush()
+            return super().read_rollup(resolution, start, end)
+
+
+class TimeSeriesStore:
+    """Directory of per-device stores, one subdirectory per device or patient"""
+
+    def __init__(self, root, segment_seconds=DEFAULT_SEGMENT_SECONDS,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.root = root
+        self.segment_seconds = segment_seconds
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._devices = {}
+        os.makedirs(root, exist_ok=True)
+
+    def reader(self, device_id):
+        """Read-only view of a device's data, e.g. one another process writes"""
+        return StoreReader(os.path.join(self.root, device_dirname(device_id)))
+
+    def device(self, device_id):
+        """Return the (shared) store for a device, creating it if needed"""
+        name = device_dirname(device_id)
+        with self._lock:
+            store = self._devices.get(name)
+            if store is None:
+                store = DeviceStore(
+                    os.path.join(self.root, name), self.segment_seconds, self.flush_interval
+                )
+                self._devices[name] = store
+            return store
+
+    def forget(self, device_id):
+        """Detach a device's store, e.g. when another process takes the device over"""
+        with self._lock:
+            store = self._devices.pop(device_dirname(device_id), None)
+        if store is not None:
+            store.detach()
+
+    def devices(self):
+        """Return the directory names of every stored device"""
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isdir(os.path.join(self.root, name, "raw"))
+        )
+
+    def flush(self):
+        with self._lock:
+            for store in self._devices.values():
+                store.flush()
+
+    def close(self):
+        with self._lock:
+            for store in self._devices.values():
+                store.close()
+            self._devices = {}
@@ -0,0 +1,61 @@
+import os
+import time
+
+from notifier import StubTelegramServer, TelegramDispatcher
+
+TOKEN = "123:SECRET"
+GROUP = "-100123"
+
+
+def test_group_chat_limit_holds_across_bursts():
+    with StubTelegramServer() as stub:
+        dispatcher = TelegramDispatcher(api_url=stub.url, coalesce_window=0)
+        try:
+            for i in range(6):
+                dispatcher.send(TOKEN, GROUP, f"alert {i}")
+                # Let each message go out and the chat's queue drain
+                dispatcher.flush(timeout=0.03)
+            # Groups get 20 messages a minute, so only the first went out
+            assert len(stub.messages) == 1
+            assert dispatcher.pending() == 5
+        finally:
+            dispatcher.stop()
+
+
+def test_private_chat_sends_one_message_a_second():
+    with StubTelegramServer() as stub:
+        dispatcher = TelegramDispatcher(api_url=stub.url, coalesce_window=0)
+        try:
+            first = dispatcher.send(TOKEN, 42, "first")
+            assert dispatcher.flush(timeout=2)
+            second = dispatcher.send(TOKEN, 42, "second")
+            time.sleep(0.3)
+            assert dispatcher.status(first) == "sent"
+            assert dispatcher.status(second) == "queued"
+            assert dispatcher.flush(timeout=2)
+            assert [m["text"] for m in stub.messages] == ["first", "second"]
+        finally:
+            dispatcher.stop()
+
+
+def test_spooled_messages_wait_for_their_token(tmp_path):
+    spool = str(tmp_path)
+    with StubTelegramServer() as stub:
+        stopped = TelegramDispatcher(api_url=stub.url, spool_dir=spool)
+        stopped.stop()
+        message = stopped.send(TOKEN, 42, "while down")
+        for name in os.listdir(spool):
+            with open(os.path.join(spool, name), encoding="utf-8") as handle:
+                assert TOKEN not in handle.read()
+
+        restarted = TelegramDispatcher(api_url=stub.url, spool_dir=spool, coalesce_window=0)
+        try:
+            assert restarted.status(message) == "queued"
+            time.sleep(0.2)
+            assert stub.messages == []
+            restarted.register_token(TOKEN)
+            assert restarted.flush(timeout=2)
+            assert stub.messages == [{"token": TOKEN, "chat_id": "42", "text": "while down"}]
+            assert os.listdir(spool) == []
+        finally:
+            restarted.stop()
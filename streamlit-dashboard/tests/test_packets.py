@@ -0,0 +1,109 @@
+import time
+
+import numpy as np
+import pytest
+import requests
+
+from hub import DeviceHub
+from ingest import FakePushDevice, IngestServer, push_device_url
+from monitor import HeartRateMonitor
+from packets import ACCEPT, CONTENT_TYPE, HEADER, RECORD_DTYPE, decode_readings, encode_records
+from simulator import FleetSimulator, SimulatorServer
+
+SEED = 0
+
+
+def simulated_columns(count=1000):
+    readings = FleetSimulator(1, seed=SEED).run(count)
+    return [readings.timestamp[:, 0], readings.current_bpm[:, 0], readings.average_bpm[:, 0],
+            readings.ir_value[:, 0], readings.finger_detected[:, 0]]
+
+
+def test_readings_round_trip():
+    columns = simulated_columns()
+    payload = encode_records(*columns)
+    received = time.time()
+    decoded = decode_readings(payload, received)
+
+    assert len(payload) == HEADER.size + len(columns[0]) * RECORD_DTYPE.itemsize
+    expected = received - (columns[0][-1] - columns[0]) / 1000.0
+    np.testing.assert_allclose(decoded["timestamp"], expected, rtol=0, atol=1e-6)
+    # BPM travels in hundredths
+    assert np.abs(decoded["current_bpm"] - columns[1]).max() <= 0.005
+    for name, values in zip(("average_bpm", "ir_value", "finger_detected"), columns[2:]):
+        assert np.array_equal(decoded[name], values)
+
+
+def test_longer_records_of_a_later_version_still_decode():
+    payload = encode_records(*simulated_columns(50))
+    received = time.time()
+    records = np.frombuffer(payload, dtype=RECORD_DTYPE, offset=HEADER.size)
+    grown = np.zeros((len(records), RECORD_DTYPE.itemsize + 4), dtype=np.uint8)
+    grown[:, :RECORD_DTYPE.itemsize] = records.view(np.uint8).reshape(len(records), -1)
+    header = bytearray(payload[:HEADER.size])
+    header[3] = 2
+    header[6:8] = (RECORD_DTYPE.itemsize + 4).to_bytes(2, "little")
+
+    decoded = decode_readings(payload, received)
+    newer = decode_readings(bytes(header) + grown.tobytes(), received)
+    for name in decoded:
+        assert np.array_equal(newer[name], decoded[name])
+
+
+@pytest.mark.parametrize("cut", ["header", "record", "magic"])
+def test_malformed_packets_are_rejected(cut):
+    payload = encode_records(*simulated_columns(10))
+    broken = {
+        "header": payload[:HEADER.size - 1],
+        "record": payload[:-1],
+        "magic": b"XYZ" + payload[3:],
+    }[cut]
+    with pytest.raises(ValueError):
+        decode_readings(broken, time.time())
+
+
+def test_binary_and_json_polls_record_the_same_readings():
+    monitors = []
+    # A long interval keeps the reading fixed, so both monitors see the same samples
+    for binary in (True, False):
+        with SimulatorServer(FleetSimulator(1, seed=SEED, interval=3600), binary=binary) as server:
+            answer = requests.get(server.url + "/api", headers={"Accept": ACCEPT}, timeout=5)
+            assert (answer.headers.get("Content-Type") == CONTENT_TYPE) == binary
+            monitor = HeartRateMonitor()
+            monitor.set_api_url(server.url + "/api")
+            for _ in range(20):
+                monitor.latest_data = monitor.fetch_data()
+                assert monitor.latest_data is not None, monitor.last_error
+            monitors.append(monitor)
+
+    packet, json_monitor = monitors
+    for name in ("current_bpm", "average_bpm", "finger_detected"):
+        ours, theirs = packet.history.column(name), json_monitor.history.column(name)
+        assert len(ours) == len(theirs)
+        np.testing.assert_allclose(ours, theirs, rtol=0, atol=0.005)
+    assert packet.latest_data["sensor"] == json_monitor.latest_data["sensor"]
+
+
+def test_binary_and_json_pushes_record_the_same_readings():
+    hub = DeviceHub()
+    batches = 10
+    try:
+        with IngestServer(hub, host="127.0.0.1", port=0,
+                          device_ids=("packets", "json")) as server:
+            url = f"http://127.0.0.1:{server.port}"
+            monitors = []
+            for binary in (True, False):
+                device_id = "packets" if binary else "json"
+                device = FakePushDevice(url, device_id, seed=SEED, binary=binary)
+                for _ in range(batches):
+                    assert device.send([device.read_sample() for _ in range(4)])
+                device.stop()
+                monitors.append(hub.monitors()[push_device_url(device_id)])
+    finally:
+        hub.poller.stop()
+
+    packet, json_monitor = monitors
+    assert len(packet.history) == min(batches * 4, packet.max_history)
+    for name in ("current_bpm", "average_bpm", "ir_value", "finger_detected"):
+        assert np.array_equal(packet.history.column(name), json_monitor.history.column(name))
+    assert packet.latest_data["sensor"] == json_monitor.latest_data["sensor"]
@@ -0,0 +1,120 @@
+import numpy as np
+
+from reports import report_patient
+from store import DeviceStore, TimeSeriesStore
+
+START = 1_800_000.0
+
+
+def append_seconds(store, first, count, bpm=70):
+    for i in range(first, first + count):
+        store.append(START + i, bpm, bpm, 100000, True)
+
+
+def test_restart_keeps_open_buckets(tmp_path):
+    store = DeviceStore(str(tmp_path))
+    append_seconds(store, 0, 30)
+    store.flush()
+    # Dropped without close(), as after a crash
+    del store
+
+    store = DeviceStore(str(tmp_path))
+    append_seconds(store, 30, 30)
+    assert store.read_rollup(60, 0, 3e6)["count"].sum() == 60
+    store.close()
+
+    reopened = DeviceStore(str(tmp_path))
+    assert reopened.read_rollup(60, 0, 3e6)["count"].tolist() == [60]
+    assert reopened.read_rollup(1, 0, 3e6)["count"].sum() == 60
+    assert len(reopened.read_range(0, 3e6)["timestamp"]) == 60
+    reopened.close()
+
+
+def test_restart_cuts_torn_columns(tmp_path):
+    store = DeviceStore(str(tmp_path))
+    append_seconds(store, 0, 10)
+    store.flush()
+    segment = store._segments()[0][1]
+    with open(f"{segment}/timestamp.bin", "ab") as handle:
+        handle.write(np.float64(START + 10).tobytes())
+    with open(f"{segment}/current_bpm.bin", "ab") as handle:
+        handle.write(b"\x01\x02")
+    del store
+
+    store = DeviceStore(str(tmp_path))
+    append_seconds(store, 11, 1)
+    columns = store.read_range(0, 3e6)
+    assert columns["timestamp"].tolist() == [START + i for i in list(range(10)) + [11]]
+    store.close()
+
+
+def test_reader_leaves_a_live_store_alone(tmp_path):
+    stores = TimeSeriesStore(str(tmp_path))
+    writer = stores.device("bed-1")
+    append_seconds(writer, 0, 30)
+    writer.flush()
+
+    reader = stores.reader("bed-1")
+    assert reader.read_rollup(60, 0, 3e6)["count"].tolist() == [30]
+    assert len(reader.read_range(0, 3e6)["timestamp"]) == 30
+    report = report_patient(str(tmp_path), "bed-1", START, START + 3600)
+    assert report.summary["readings"] == 30
+
+    append_seconds(writer, 30, 30)
+    stores.close()
+    reopened = DeviceStore(writer.path)
+    assert reopened.read_rollup(60, 0, 3e6)["count"].tolist() == [60]
+    assert reopened.read_rollup(1, 0, 3e6)["count"].tolist() == [1] * 60
+    reopened.close()
+
+
+def test_reader_does_not_count_a_closed_bucket_twice(tmp_path):
+    writer = DeviceStore(str(tmp_path))
+    append_seconds(writer, 0, 10)
+    writer.flush()
+    reader = TimeSeriesStore(str(tmp_path.parent)).reader(tmp_path.name)
+    # The writer closes the bucket it saved at its last flush
+    append_seconds(writer, 60, 1)
+    writer._rollup_files[60].flush()
+    assert reader.read_rollup(60, 0, 3e6)["count"].tolist() == [10]
+    writer.close()
+
+
+def test_forget_hands_open_buckets_to_the_next_writer(tmp_path):
+    old_owner = TimeSeriesStore(str(tmp_path))
+    moved = old_owner.device("dev")
+    append_seconds(moved, 0, 30)
+    old_owner.forget("dev")
+    # A late append from the old owner must not touch the files any more
+    append_seconds(moved, 30, 1)
+
+    new_owner = TimeSeriesStore(str(tmp_path))
+    append_seconds(new_owner.device("dev"), 30, 30)
+    new_owner.close()
+    old_owner.close()
+
+    reader = new_owner.reader("dev")
+    assert reader.read_rollup(60, 0, 3e6)["count"].tolist() == [60]
+    assert len(reader.read_range(0, 3e6)["timestamp"]) == 60
+
+
+def test_out_of_order_samples_are_dropped(tmp_path):
+    store = DeviceStore(str(tmp_path), segment_seconds=60)
+    append_seconds(store, 0, 90, bpm=70)
+    # Late samples, one of them from the already closed first segment
+    store.append(START + 30, 200, 200, 100000, True)
+    store.append(START + 85, 200, 200, 100000, True)
+    append_seconds(store, 90, 30, bpm=70)
+    assert store.dropped == 2
+    store.close()
+
+    reopened = DeviceStore(str(tmp_path), segment_seconds=60)
+    reopened.append(START + 100, 200, 200, 100000, True)
+    assert reopened.dropped == 1
+    timestamps = reopened.read_range(0, 3e6)["timestamp"]
+    assert len(timestamps) == 120
+    assert np.all(np.diff(timestamps) > 0)
+    rows = reopened.read_rollup(60, 0, 3e6)
+    assert rows["count"].tolist() == [60, 60]
+    assert rows["max"].max() == 70
+    reopened.close()